@@ -0,0 +1,214 @@
+"""
+Servicio HTTP de perfiles municipales en JSON, sin la interfaz de Streamlit.
+
+Usa la misma capa de datos que el tablero (`datos.py`): el mismo backend, la misma instantánea con su
+refresco y los mismos motores de agregación. Rutas:
+    GET /municipios/<Cod. Municipio>  Perfil del municipio: indicadores generales con sus percentiles,
+                                      etiquetas PDET y ZOMAC, distribuciones de empresas y actividades de
+                                      turismo.
+    GET /salud                        Versión de los datos vigente y si es el respaldo local (backend no disponible).
+
+Las respuestas llevan ETag ligado a la versión de los datos y Last-Modified tomado de los marcadores de
+cambio de las tablas, responden 304 a las peticiones condicionales y se guardan ya serializadas en la
+instantánea, de modo que un perfil se calcula una sola vez por versión. El código del municipio se acepta
+con o sin ceros a la izquierda ('5001' o '05001'); un código que no es numérico responde 400.
+
+Para usarlo con el backend local:
+    MUNICIPIOS_BACKEND=local MUNICIPIOS_DATOS_LOCALES=datos_locales python api.py --puerto 8502
+"""
+import argparse
+import collections
+import email.utils
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import datos
+import perf_utils as pf
+from claves import DIGITOS_CODIGO, texto_clave
+
+logger = pf.obtener_logger_json('municipios.api')
+
+MAXIMO_RESPUESTAS = 512
+_lock_respuestas = threading.Lock()
+
+
+@datos.derivado('respuestas_api')
+def _respuestas_api(inst):
+    return collections.OrderedDict()
+
+
+def _valor_json(valor):
+    # Tipos de NumPy a tipos de Python; los NaN se publican como null
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if isinstance(valor, float) and math.isnan(valor):
+        return None
+    return valor
+
+
+def codigo_municipio(texto: str) -> str:
+    """
+    Normaliza el código de municipio de la ruta al código DIVIPOLA con ceros a la izquierda ('5001' ->
+    '05001'), para que las dos formas compartan la misma entrada del caché.
+
+    Returns:
+        str: Código normalizado, o None si no es un código de hasta `DIGITOS_CODIGO` dígitos.
+    """
+    if not (texto.isascii() and texto.isdigit()) or len(texto) > DIGITOS_CODIGO:
+        return None
+    return texto_clave(int(texto))
+
+
+def perfil_municipio(inst: datos.Instantanea, cod_mpio: str) -> dict:
+    """
+    Arma el perfil de un municipio con los mismos cálculos del tablero.
+
+    Returns:
+        dict: Perfil del municipio, o None si el código no existe.
+    """
+    df_datos_mun = datos.datos_municipio(inst, cod_mpio)
+    ubicacion = inst.derivado('ubicacion')
+    ubicacion = ubicacion[ubicacion[datos.CLAVE] == datos.clave_municipio(cod_mpio)]
+    if df_datos_mun.empty or ubicacion.empty:
+        return None
+
+    pdet, zomac = datos.metricas_pdet_zomac(df_datos_mun)
+    datos.precargar_perfil(inst, cod_mpio=cod_mpio)
+    empresas = {}
+    for nombre, argumentos in datos.DISTRIBUCIONES_EMPRESAS.items():
+        serie = datos.serie_barras(inst, cod_mpio=cod_mpio, **argumentos)
+        empresas[nombre] = {
+            'total': _valor_json(serie['total']),
+            'categorias': [_valor_json(v) for v in serie['categorias']],
+            'valores': [_valor_json(v) for v in serie['valores']],
+            'participacion': [round(_valor_json(v), 4) for v in serie['participacion']],
+        }
+    return {
+        'version': inst.version,
+        'cod_municipio': cod_mpio,
+        'municipio': ubicacion['Municipio'].iloc[0],
+        'departamento': ubicacion['Departamento'].iloc[0],
+        'pdet': _valor_json(pdet),
+        'zomac': _valor_json(zomac),
+        # La clave entera es interna (ver `claves.py`): el código ya va en 'cod_municipio'
+        'indicadores': {columna: _valor_json(valor) for columna, valor in df_datos_mun.drop(columns=datos.CLAVE).iloc[0].items()},
+        'percentiles': {columna: {ambito: _valor_json(round(float(valor), 1)) for ambito, valor in fila.items()}
+                        for columna, fila in datos.percentiles_municipio(inst, cod_mpio).iterrows()},
+        'empresas': empresas,
+    }
+
+
+def respuesta_perfil(inst: datos.Instantanea, cod_mpio: str) -> bytes:
+    """Devuelve el perfil serializado en JSON, desde el caché de la instantánea si ya se calculó."""
+    respuestas = inst.derivado('respuestas_api')
+    with _lock_respuestas:
+        if cod_mpio in respuestas:
+            respuestas.move_to_end(cod_mpio)
+            return respuestas[cod_mpio]
+
+    perfil = perfil_municipio(inst, cod_mpio)
+    cuerpo = None if perfil is None else json.dumps(perfil, ensure_ascii=False, default=str).encode('utf-8')
+    with _lock_respuestas:
+        respuestas[cod_mpio] = cuerpo
+        if len(respuestas) > MAXIMO_RESPUESTAS:
+            respuestas.popitem(last=False)
+    return cuerpo
+
+
+class ManejadorPerfiles(BaseHTTPRequestHandler):
+    """Atiende las rutas del servicio de perfiles."""
+
+    def do_GET(self):
+        self._responder(incluir_cuerpo=True)
+
+    def do_HEAD(self):
+        self._responder(incluir_cuerpo=False)
+
+    def _responder(self, incluir_cuerpo: bool):
+        pf.iniciar_rerun()
+        datos.refrescar_si_vencido()
+        inst = datos.instantanea_actual()
+        ruta = self.path.split('?', 1)[0].rstrip('/')
+        etag = f'"{inst.version}"'
+        modificada = datos.fecha_modificacion(inst)
+        ultima_modificacion = email.utils.formatdate(modificada, usegmt=True)
+
+        if ruta == '/salud':
+            estado, cuerpo = 200, json.dumps({'version': inst.version, 'respaldo': inst.respaldo,
+                                              'datos_al': datos.fecha_respaldo(inst)}).encode('utf-8')
+        elif ruta.startswith('/municipios/'):
+            cod_mpio = codigo_municipio(ruta[len('/municipios/'):])
+            if cod_mpio is None:
+                estado, cuerpo = 400, None
+            else:
+                # El perfil se resuelve antes de mirar las condiciones: un código que no existe responde 404
+                # también a una petición condicional. Queda en el caché de la instantánea, así que un 304 no
+                # lo vuelve a calcular.
+                cuerpo = respuesta_perfil(inst, cod_mpio)
+                if cuerpo is None:
+                    estado = 404
+                elif self._sin_cambios(etag, modificada):
+                    estado, cuerpo = 304, None
+                else:
+                    estado = 200
+        else:
+            estado, cuerpo = 404, None
+
+        if estado == 400:
+            cuerpo = json.dumps({'error': 'código de municipio inválido', 'ruta': ruta}, ensure_ascii=False).encode('utf-8')
+        elif estado == 404:
+            cuerpo = json.dumps({'error': 'no encontrado', 'ruta': ruta}, ensure_ascii=False).encode('utf-8')
+        self.send_response(estado)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', ultima_modificacion)
+        self.send_header('Cache-Control', 'no-cache')
+        if cuerpo is not None:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        if cuerpo is not None and incluir_cuerpo:
+            self.wfile.write(cuerpo)
+
+        resumen = pf.finalizar_rerun()
+        pf.emitir_json(logger, 'solicitud', {'ruta': ruta, 'estado': estado, 'ms': resumen['ms'], 'version': inst.version})
+
+    def _sin_cambios(self, etag: str, modificada: float) -> bool:
+        # If-None-Match tiene prioridad sobre If-Modified-Since (RFC 9110)
+        si_no_coincide = self.headers.get('If-None-Match')
+        if si_no_coincide is not None:
+            return etag in [valor.strip() for valor in si_no_coincide.split(',')] or si_no_coincide.strip() == '*'
+        si_modificado = self.headers.get('If-Modified-Since')
+        if si_modificado is not None:
+            try:
+                return email.utils.parsedate_to_datetime(si_modificado).timestamp() >= int(modificada)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def log_message(self, formato, *args):
+        # Las solicitudes ya se registran como líneas JSON en 'municipios.api'
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servicio HTTP de perfiles municipales en JSON.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8502)
+    args = parser.parse_args()
+
+    # Conexiones y datos listos antes de aceptar la primera solicitud
+    inicio = time.perf_counter()
+    datos.calentar()
+    inst = datos.instantanea_actual()
+    pf.emitir_json(logger, 'inicio', {'host': args.host, 'puerto': args.puerto, 'version': inst.version,
+                                      'ms': round((time.perf_counter() - inicio) * 1000, 3)})
+    ThreadingHTTPServer((args.host, args.puerto), ManejadorPerfiles).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,20 @@
 import funciones as fn
-from snowflake_utils import sf_check_snowflake_connection, st_query_to_snowflake_and_return_dataframe
+import perf_utils as pf
+import datos
 # from snowflake_config import sf_config # Toca crear el archivo .toml
 # import docx # Para generar el reporte
 
 import pandas as pd
-import numpy as np
 import streamlit as st
-import plotly.graph_objs as go
-import folium
-from streamlit_folium import folium_static
-
-import snowflake.connector
-from snowflake.connector.pandas_tools import write_pandas
-from snowflake.connector.pandas_tools import pd_writer
+import streamlit.components.v1 as components
 
 # Configuración de pandas
 pd.options.display.max_columns = None
 pd.options.display.float_format = '{:,.2f}'.format
 pd.set_option('display.max_colwidth', 0)
 
+pf.iniciar_rerun()
+
 fn.cargar_contraseñas(".streamlit/secrets.toml") # Indica la ruta donde están las llaves secretas
 
 # # Archivos
@@ -29,17 +25,22 @@ fn.cargar_contraseñas(".streamlit/secrets.toml") # Indica la ruta donde están
 # df_base = pd.read_csv( a_base, sep="|", decimal=",", encoding ='utf-8', converters={'Cod. Depto':str,'Cod. Municipio':str, 'CIIU Rev 4 principal':str})
 # df_ubicacion = pd.read_excel( a_ubic, skiprows=10, converters={'Código .1':str})
 
-# Obtener los dataframes cargados desde funciones.py
-df_general, df_base, df_ubicacion = fn.get_dataframes()
+# Obtener los dataframes cargados desde datos.py. Toda la ejecución usa la misma instantánea, aunque
+# un refresco en segundo plano publique una nueva mientras tanto.
+datos.refrescar_si_vencido()
+instantanea = datos.instantanea_actual()
 
 # Seleccionar de las bases lo que necesito
-df_ubicacion = df_ubicacion[['Código .1', 'Nombre', 'Nombre.1', 'LATITUD', 'LONGITUD']]
-df_ubicacion=df_ubicacion[df_ubicacion['Código .1'].notna()]
-df_ubicacion.rename(columns={'Código .1': 'Cod. Municipio', 'Nombre': 'Departamento', 'Nombre.1': 'Municipio'}, inplace=True)
+df_ubicacion = instantanea.derivado('ubicacion')
 
 # Configuración página web
 st.set_page_config(page_title="Perfil territorio", page_icon = '🌎', layout="wide",  initial_sidebar_state="expanded") 
 
+# Aviso cuando Snowflake no responde y se muestra la última instantánea local
+if instantanea.respaldo:
+    st.warning(f"Datos al {datos.fecha_respaldo(instantanea)}: la base de datos no está disponible en este momento y "
+               "se muestran los datos guardados más recientes.")
+
 # --------------- Sidebar -------------------------------------------
 
 # Logo ProColombia
@@ -49,22 +50,24 @@ st.sidebar.markdown("---")
 
 # Filtrar el municipio de interés
 st.sidebar.title('Escoja el territorio de interés') 
-depto0 = df_base[df_base['Departamento']!='No determinado']
-depto = sorted(depto0['Departamento'].unique().tolist())
-index1 = depto.index("Arauca")
-depto_seleccionado = st.sidebar.selectbox("Seleccione el departamento", depto, index=index1)
-mpio = sorted(df_base[df_base['Departamento']==depto_seleccionado]['Municipio'].unique().tolist())
-mpio_seleccionado = st.sidebar.selectbox("Seleccione el municipio", mpio)
+with pf.medir('filtro barra lateral'):
+    st.session_state['pagina_en_ejecucion'] = True
+    with st.sidebar:
+        fn.filtro_territorio(datos.departamentos(instantanea),
+                             lambda depto: datos.municipios(instantanea, depto),
+                             "Arauca",
+                             buscar=lambda texto: datos.buscar_municipios(instantanea, texto))
+    st.session_state['pagina_en_ejecucion'] = False
+    depto_seleccionado, mpio_seleccionado = st.session_state['territorio']
 
 # Filtrar la información por el territorio de interés
-cod_mpio_selec = df_base[(df_base['Departamento']==depto_seleccionado)&(df_base['Municipio']==mpio_seleccionado)]['Cod. Municipio'].values[0]
-filtro1 = (df_base['Cod. Municipio']==cod_mpio_selec)
-tejido = df_base[filtro1]
-filtro2 = (df_general['Cod. Municipio']==cod_mpio_selec)
-df_datos_mun = df_general[filtro2]
+with pf.medir('filtro municipio'):
+    cod_mpio_selec = datos.codigo_municipio(instantanea, depto_seleccionado, mpio_seleccionado)
+    df_datos_mun = datos.datos_municipio(instantanea, cod_mpio_selec)
+    pf.anotar(filas=len(df_datos_mun))
 
-# Para verificar si hay información
-print(df_datos_mun.head())
+# Percentiles del municipio en cada indicador, calculados una vez por versión de los datos
+percentiles = datos.percentiles_municipio(instantanea, cod_mpio_selec)
 
 # Fuentes consultadas
 st.sidebar.markdown('##')
@@ -104,14 +107,55 @@ st.markdown("---")
 # Datos generales del municipio
 st.header('🌐 **Ubicación geográfica**')
 
+# Municipios más cercanos según el índice espacial de la instantánea (ver `vecinos.py`)
+with pf.medir('municipios cercanos'):
+    cercanos = datos.municipios_cercanos(instantanea, cod_mpio_selec, k=5)
+    empresas_50_km = datos.empresas_en_radio(instantanea, 50).get(datos.clave_municipio(cod_mpio_selec), 0)
+
 # Mapa del municipio
-mapa = df_ubicacion[df_ubicacion['Cod. Municipio'] == cod_mpio_selec]
-municipio_lat = mapa['LATITUD']
-municipio_lon = mapa['LONGITUD']
-colombia_center = [4.5709, -74.2973]
-m = folium.Map(location=colombia_center, zoom_start=5)
-folium.Marker(location=[municipio_lat, municipio_lon], popup=f'{mpio_seleccionado} - {depto_seleccionado}').add_to(m)
-folium_static(m, width=1300, height=500)
+with pf.medir('mapa folium'):
+    mapa = df_ubicacion[df_ubicacion[datos.CLAVE] == datos.clave_municipio(cod_mpio_selec)]
+    municipio_lat = mapa['LATITUD'].values[0]
+    municipio_lon = mapa['LONGITUD'].values[0]
+    marcadores = tuple((float(fila.LATITUD), float(fila.LONGITUD), f'{fila.Municipio} - {fila.Departamento}')
+                       for fila in cercanos.itertuples())
+    html_mapa = fn.html_mapa(float(municipio_lat), float(municipio_lon), f'{mpio_seleccionado} - {depto_seleccionado}', marcadores)
+    components.html(html_mapa, width=1300, height=510)
+    pf.anotar(bytes=pf.tamano_bytes(html_mapa))
+
+st.subheader('Municipios cercanos')
+st.markdown(f'##### {empresas_50_km:,.0f} empresas en los municipios a menos de 50 km (incluido {mpio_seleccionado})')
+st.dataframe(cercanos.drop(columns=[datos.CLAVE, 'Cod. Municipio', 'LATITUD', 'LONGITUD']),
+             hide_index=True,
+             use_container_width=True,
+             column_config={
+                 'Distancia (km)': st.column_config.NumberColumn(format='%.1f'),
+                 'Población municipio': st.column_config.NumberColumn('Población 2022', format='%d'),
+                 '% pobreza municipio': st.column_config.NumberColumn('% pobreza', format='%.1f'),
+                 '% informalidad municipio': st.column_config.NumberColumn('% informalidad', format='%.1f'),
+                 'Valor agregado municipio': st.column_config.NumberColumn('Valor agregado (COP miles de millones)', format='%.0f'),
+                 'Número de empresas': st.column_config.NumberColumn(format='%d'),
+             })
+
+# Municipios con el perfil más parecido, precalculados para todos los municipios (ver `similitud.py`)
+st.subheader('Municipios con perfil similar')
+st.markdown('##### Según sus indicadores de población, empleo y educación y la mezcla de cadenas productivas de sus empresas')
+with pf.medir('municipios similares'):
+    similares = datos.municipios_similares(instantanea, cod_mpio_selec, k=5)
+st.dataframe(similares.drop(columns=[datos.CLAVE, 'Cod. Municipio']),
+             hide_index=True,
+             use_container_width=True,
+             column_config={
+                 'Similitud': st.column_config.ProgressColumn(format='%.2f', min_value=-1, max_value=1),
+                 'Población municipio': st.column_config.NumberColumn('Población 2022', format='%d'),
+                 '% pobreza municipio': st.column_config.NumberColumn('% pobreza', format='%.1f'),
+                 '% informalidad municipio': st.column_config.NumberColumn('% informalidad', format='%.1f'),
+                 'Valor agregado municipio': st.column_config.NumberColumn('Valor agregado (COP miles de millones)', format='%.0f'),
+             })
+
+# Mapa de todos los municipios por indicador, con la geometría simplificada por nivel de zoom (ver `geometria.py`)
+st.subheader('Mapa nacional por indicador')
+fn.mapa_coropletico(instantanea, cod_mpio_selec[:2])
 
 st.header('🔍 **Información general**')
 
@@ -126,6 +170,7 @@ with c3:
     pob = df_datos_mun['Población municipio'].values[0]
     st.markdown("#### Población 2022")
     st.subheader(f'{pob:,.0f} habitantes')
+    fn.mostrar_percentil(percentiles, 'Población municipio')
 
 # Distribución de la población
 st.subheader('Características de la población')
@@ -142,6 +187,7 @@ with c1:
                                    [femenino, masculino],
                                    ['rgb(255, 218, 0)', 'rgb(0, 109, 254)'],
                                    'Año 2022')
+    fn.mostrar_percentil(percentiles, '% mujeres municipio')
 
 with c2:
     joven = df_datos_mun['% jóvenes municipio'].values[0]
@@ -152,6 +198,7 @@ with c2:
                                    [joven, no_joven],
                                    ['rgb(255, 218, 0)', 'rgb(0, 109, 254)'],
                                    'Año 2022')
+    fn.mostrar_percentil(percentiles, '% jóvenes municipio')
 
 with c3:
     etnico = df_datos_mun['% grupos étnicos municipio'].values[0]
@@ -162,6 +209,7 @@ with c3:
                                    [etnico, no_etnico],
                                    ['rgb(255, 218, 0)', 'rgb(0, 109, 254)'],
                                    'Censo 2018')
+    fn.mostrar_percentil(percentiles, '% grupos étnicos municipio')
 
 c1, c2, c3 = st.columns(3)
 
@@ -184,6 +232,7 @@ with c2:
                                    [pobre, no_pobre],
                                    ['rgb(255, 218, 0)', 'rgb(0, 109, 254)'],
                                    'Censo 2018')
+    fn.mostrar_percentil(percentiles, '% pobreza municipio')
 
 with c3:
     informal = df_datos_mun['% informalidad municipio'].values[0]
@@ -194,6 +243,7 @@ with c3:
                                    [informal, no_informal],
                                    ['rgb(255, 218, 0)', 'rgb(0, 109, 254)'],
                                    'Censo 2018')
+    fn.mostrar_percentil(percentiles, '% informalidad municipio')
 
 # PIB y educación
 c1, c2 = st.columns(2)
@@ -212,6 +262,11 @@ with c1:
     
     va = df_datos_mun['Valor agregado municipio'].values[0]
     st.subheader(f'COP {va:,.0f} miles de millones')
+    fn.mostrar_percentil(percentiles, 'Valor agregado municipio')
+    for columna, etiqueta in [('% Act. primarias municipio', 'Actividades primarias'),
+                              ('% Act. secundarias municipio', 'Actividades secundarias'),
+                              ('% Act. terciarias municipio', 'Actividades terciarias')]:
+        fn.mostrar_percentil(percentiles, columna, etiqueta)
 
 with c2:
     media = df_datos_mun['% pobl. con educación media municipio'].values[0]
@@ -226,6 +281,11 @@ with c2:
                                    [media, tecnica, pre, pos, resto],
                                    ['rgb(255, 218, 0)', 'rgb(0, 109, 254)', 'rgb(252, 0, 81)', 'rgb(106, 124, 133)', 'rgb(69, 87, 108)'],
                                    'Censo 2018')
+    for columna, etiqueta in [('% pobl. con educación media municipio', 'Educación media'),
+                              ('% pobl. con edu. técnica/tecnología municipio', 'Educación técnica/tecnología'),
+                              ('% pobl. con pregrado municipio', 'Pregrado'),
+                              ('% pobl. con posgrado municipio', 'Posgrado')]:
+        fn.mostrar_percentil(percentiles, columna, etiqueta)
 
 st.markdown("---")
 
@@ -233,23 +293,32 @@ st.markdown("---")
 st.header('🏭 **Empresas ubicadas en el territorio**')
 st.markdown('##### Nota: Se enfoca en personas jurídicas con ubicación comercial en el territorio.')
 
-fn.mostrar_empresas_por_categoria_unificada(tejido, 'Tamaño', '', 'Distribución según tamaño', 'rgb(69, 87, 108)')
-fn.mostrar_empresas_por_categoria_unificada(tejido, 'Cadena productiva', '', 'Distribución según cadena productiva', 'rgb(69, 87, 108)', height=700)
-fn.mostrar_empresas_por_categoria_unificada(tejido, 'Valor agregado empresa', '', 'Distribución según valor agregado', 'rgb(69, 87, 108)', height=700)
+# Los conteos de empresas los calcula el motor de agregación configurado (pandas, DuckDB o Polars) y
+# `datos.serie_barras` los deja listos para graficar, una sola vez por versión de los datos
+datos.precargar_perfil(instantanea, cod_mpio=cod_mpio_selec)
+
+def serie(columnas, columna_etiqueta=None, filtro=None):
+    return datos.serie_barras(instantanea, columnas, columna_etiqueta, cod_mpio=cod_mpio_selec, filtro=filtro)
+
+fn.mostrar_empresas_por_categoria_unificada(serie('Tamaño'), '', 'Distribución según tamaño', 'rgb(69, 87, 108)')
+fn.mostrar_empresas_por_categoria_unificada(serie('Cadena productiva'), '', 'Distribución según cadena productiva', 'rgb(69, 87, 108)', height=700)
+fn.mostrar_empresas_por_categoria_unificada(serie('Valor agregado empresa'), '', 'Distribución según valor agregado', 'rgb(69, 87, 108)', height=700)
 
 # Tejido exportador
-exportadoras = tejido[tejido['Tipo* ult 10 años'] != "No exportó ult. 10 años"]
-fn.mostrar_empresas_por_categoria_unificada(tejido, "Cadena* ult 10 años", 
+fn.mostrar_empresas_por_categoria_unificada(serie("Cadena* ult 10 años", filtro='exportadoras'),
                                             "Empresas ubicadas en el territorio que realizaron alguna exportación en los últimos 10 años (2013-2022)", 
-                                            "Distribución según la cadena productiva por la que más exportó la empresa", "rgb(252, 0, 81)",
-                                            df_filtrado=exportadoras)
+                                            "Distribución según la cadena productiva por la que más exportó la empresa", "rgb(252, 0, 81)")
 
 # Instalados
-ied = tejido[tejido['Sucursal sociedad extranjera'] == "Si"]
-fn.mostrar_empresas_por_categoria_unificada(tejido, "Cadena productiva", 
+fn.mostrar_empresas_por_categoria_unificada(serie("Cadena productiva", filtro='ied'),
                                             "Empresas ubicadas en el territorio identificadas como sucursal de sociedad extranjera", 
-                                            "Distribución según cadena productiva", "rgb(0, 109, 254)",
-                                            df_filtrado=ied)
+                                            "Distribución según cadena productiva", "rgb(0, 109, 254)")
 
 # Turismo
-fn.mostrar_empresas_turismo(tejido)
+fn.mostrar_empresas_turismo(serie(['CIIU Rev 4 principal', 'Descripción CIIU principal'], 'Descripción CIIU principal', filtro='turismo'))
+
+# Tiempos de la ejecución
+resumen_rendimiento = pf.finalizar_rerun()
+if pf.habilitado():
+    pf.mostrar_panel_rendimiento(resumen_rendimiento)
+    pf.mostrar_panel_memoria(pf.reporte_memoria(instantanea.tablas))
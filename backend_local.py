@@ -0,0 +1,233 @@
+"""
+Backend local que reemplaza a Snowflake en ejecuciones sin conexión y en pruebas de rendimiento.
+
+Carga las tablas desde archivos Parquet o CSV ubicados en un directorio (un archivo por tabla, con el
+nombre de la tabla, p. ej. `TABLA_TEJIDO_MUNICIPIOS.parquet`) en una base SQLite en memoria, de modo que
+las mismas consultas SQL que se envían a Snowflake se puedan ejecutar sin credenciales.
+
+Para usarlo:
+    MUNICIPIOS_BACKEND=local MUNICIPIOS_DATOS_LOCALES=datos_locales streamlit run app.py
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from perf_utils import registrar_cache
+
+DIRECTORIO_POR_DEFECTO = 'datos_locales'
+
+# Tablas que consulta el tablero
+TABLAS = ('TABLA_BASE_MUNICIPIOS', 'TABLA_TEJIDO_MUNICIPIOS', 'TABLA_DIVIPOLA_MUNICIPIOS')
+
+# Columnas de códigos que deben leerse como texto desde CSV para no perder los ceros a la izquierda
+COLUMNAS_TEXTO = ('Cod. Depto', 'Cod. Municipio', 'CIIU Rev 4 principal', 'Código', 'Código .1')
+
+
+def leer_fixture(directorio: str, tabla: str) -> pd.DataFrame:
+    """
+    Lee el archivo local de una tabla, dando prioridad al formato Parquet sobre CSV.
+
+    Args:
+        directorio (str): Directorio que contiene los archivos de las tablas.
+        tabla (str): Nombre de la tabla, p. ej. 'TABLA_BASE_MUNICIPIOS'.
+
+    Returns:
+        pd.DataFrame: Contenido de la tabla.
+
+    Raises:
+        FileNotFoundError: Si no existe ni `<tabla>.parquet` ni `<tabla>.csv` en el directorio.
+    """
+    ruta = ruta_fixture(directorio, tabla)
+    if ruta.endswith('.parquet'):
+        return pd.read_parquet(ruta)
+    return pd.read_csv(ruta, encoding='utf-8', dtype={col: str for col in COLUMNAS_TEXTO})
+
+
+def ruta_fixture(directorio: str, tabla: str) -> str:
+    """
+    Devuelve la ruta del archivo local de una tabla, dando prioridad al formato Parquet sobre CSV.
+
+    Raises:
+        FileNotFoundError: Si no existe ni `<tabla>.parquet` ni `<tabla>.csv` en el directorio.
+    """
+    ruta_parquet = os.path.join(directorio, f'{tabla}.parquet')
+    ruta_csv = os.path.join(directorio, f'{tabla}.csv')
+    if os.path.exists(ruta_parquet):
+        return ruta_parquet
+    if os.path.exists(ruta_csv):
+        return ruta_csv
+    raise FileNotFoundError(f"No se encontró {ruta_parquet} ni {ruta_csv}")
+
+
+def tablas_publicadas(directorio: str) -> tuple:
+    """Devuelve las tablas de agregados publicadas en el directorio (ver `publicacion.py`)."""
+    if not os.path.isdir(directorio):
+        return ()
+    return tuple(sorted(archivo[:-len('.parquet')] for archivo in os.listdir(directorio)
+                        if archivo.startswith('AGG_') and archivo.endswith('.parquet')))
+
+
+def _marcador_archivo(ruta: str) -> str:
+    # Fecha de modificación y tamaño del archivo: cambian cuando se reemplaza el archivo de la tabla
+    estado = os.stat(ruta)
+    return f'{ruta}:{estado.st_mtime_ns}:{estado.st_size}'
+
+
+class BackendLocal:
+    """
+    Backend que resuelve las consultas contra una base SQLite en memoria cargada desde archivos locales.
+
+    Las tablas se cargan al crear el backend y sólo se vuelven a leer cuando `marcadores_cambio` detecta
+    que su archivo cambió. La conexión se comparte entre los hilos de Streamlit, por lo que las consultas
+    se serializan con un candado.
+
+    Args:
+        directorio (str): Directorio con los archivos Parquet/CSV de las tablas.
+    """
+    nombre = 'local'
+
+    def __init__(self, directorio: str = DIRECTORIO_POR_DEFECTO):
+        self.directorio = directorio
+        self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self._lock = threading.Lock()
+        # Marcador del archivo con el que se cargó cada tabla
+        self._marcadores = {}
+
+        for tabla in TABLAS + tablas_publicadas(directorio):
+            try:
+                self._cargar_tabla(tabla)
+            except FileNotFoundError:
+                continue
+
+        if not self._marcadores:
+            raise FileNotFoundError(f"No se encontraron tablas en el directorio local '{directorio}'")
+        self.tablas = tuple(self._marcadores)
+        registrar_cache(f'backend local SQLite ({directorio})', self.medir_memoria)
+
+    def _cargar_tabla(self, tabla: str) -> None:
+        ruta = ruta_fixture(self.directorio, tabla)
+        marcador = _marcador_archivo(ruta)
+        df = leer_fixture(self.directorio, tabla)
+        with self._lock:
+            df.to_sql(tabla, self._conn, index=False, if_exists='replace')
+            self._marcadores[tabla] = marcador
+
+    def marcadores_cambio(self, tablas) -> dict:
+        """
+        Devuelve un marcador de cambio por tabla (ruta, fecha de modificación y tamaño de su archivo).
+
+        Si el archivo de una tabla cambió desde que se cargó, la tabla se vuelve a cargar en SQLite antes
+        de devolver el marcador, de modo que la siguiente consulta ya lee los datos nuevos.
+        """
+        marcadores = {}
+        for tabla in tablas:
+            try:
+                marcador = _marcador_archivo(ruta_fixture(self.directorio, tabla))
+            except FileNotFoundError:
+                marcadores[tabla] = None
+                continue
+            if marcador != self._marcadores.get(tabla):
+                self._cargar_tabla(tabla)
+            marcadores[tabla] = marcador
+        return marcadores
+
+    def medir_memoria(self) -> tuple:
+        """Devuelve (tablas, bytes) de la base SQLite en memoria."""
+        with self._lock:
+            paginas = self._conn.execute('PRAGMA page_count').fetchone()[0]
+            tamano_pagina = self._conn.execute('PRAGMA page_size').fetchone()[0]
+        return len(self.tablas), paginas * tamano_pagina
+
+    def consultar(self, query: str, registro: dict = None, parametros=None, plazo: float = None) -> pd.DataFrame:
+        """
+        Ejecuta la consulta en la base SQLite local y devuelve los resultados en un DataFrame.
+
+        Args:
+            query (str): La consulta SQL a ejecutar.
+            registro (dict, optional): Diccionario en el que se anotan los tiempos de ejecución y descarga.
+            parametros (list, optional): Valores de los marcadores `?` de la consulta.
+            plazo (float, optional): Segundos máximos de ejecución y descarga; al vencer se interrumpe la consulta.
+
+        Raises:
+            sqlite3.Error: Si la consulta no es válida o referencia una tabla no cargada.
+            PlazoConsultaVencido: Si la consulta superó `plazo`.
+        """
+        from snowflake_utils import PlazoConsultaVencido
+
+        registro = {} if registro is None else registro
+        limite = None if plazo is None else time.perf_counter() + plazo
+        with self._lock:
+            # SQLite llama al manejador cada 1000 instrucciones de su máquina virtual; si devuelve True, interrumpe
+            self._conn.set_progress_handler(lambda: limite is not None and time.perf_counter() > limite, 1000)
+            try:
+                inicio = time.perf_counter()
+                cur = self._conn.execute(query, parametros or ())
+                registro['ejecucion_ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+                inicio = time.perf_counter()
+                column_names = [desc[0] for desc in cur.description]
+                results = cur.fetchall()
+                registro['descarga_ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+            except sqlite3.OperationalError as e:
+                if limite is not None and time.perf_counter() > limite:
+                    raise PlazoConsultaVencido(f"La consulta superó el plazo de {plazo} s") from e
+                raise
+            finally:
+                self._conn.set_progress_handler(None, 1000)
+        return pd.DataFrame(results, columns=column_names)
+
+    def publicar(self, tablas: dict, chunk_size: int = 100_000) -> None:
+        """
+        Guarda DataFrames como archivos Parquet del directorio y los carga en SQLite.
+
+        Igual que en Snowflake, los archivos se escriben primero con otro nombre (en grupos de filas de
+        `chunk_size`) y sólo cuando todos están completos reemplazan a los vigentes.
+
+        Args:
+            tablas (dict): Nombre de tabla -> DataFrame.
+            chunk_size (int, optional): Filas por grupo de filas de Parquet.
+        """
+        temporales = {}
+        try:
+            for tabla, df in tablas.items():
+                temporales[tabla] = os.path.join(self.directorio, f'{tabla}.parquet.nueva')
+                df.to_parquet(temporales[tabla], index=False, row_group_size=chunk_size)
+        except Exception:
+            for temporal in temporales.values():
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+            raise
+        for tabla, temporal in temporales.items():
+            os.replace(temporal, os.path.join(self.directorio, f'{tabla}.parquet'))
+            self._cargar_tabla(tabla)
+        self.tablas = tuple(self._marcadores)
+
+
+def exportar_fixtures(sf_config: dict, directorio: str = DIRECTORIO_POR_DEFECTO, formato: str = 'parquet') -> list:
+    """
+    Descarga las tablas del tablero desde Snowflake y las guarda como archivos locales para el backend local.
+
+    Args:
+        sf_config (dict): Configuración de conexión a Snowflake.
+        directorio (str, optional): Directorio de destino. Se crea si no existe.
+        formato (str, optional): 'parquet' (por defecto) o 'csv'.
+
+    Returns:
+        list: Rutas de los archivos generados.
+    """
+    from snowflake_utils import BackendSnowflake
+
+    os.makedirs(directorio, exist_ok=True)
+    backend = BackendSnowflake(sf_config)
+    rutas = []
+    for tabla in TABLAS:
+        df = backend.consultar(f"SELECT * FROM {tabla}")
+        ruta = os.path.join(directorio, f'{tabla}.{formato}')
+        if formato == 'parquet':
+            df.to_parquet(ruta, index=False)
+        else:
+            df.to_csv(ruta, index=False, encoding='utf-8')
+        rutas.append(ruta)
+    return rutas
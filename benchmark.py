@@ -0,0 +1,222 @@
+"""
+Mide los tiempos de carga y de agregación del tablero sin conexión a Snowflake.
+
+Usa el backend local (ver `backend_local.py`) con los archivos Parquet/CSV del directorio indicado, de
+modo que se puede ejecutar en un portátil o en un servidor de CI sin credenciales.
+
+Con `--motor duckdb`, `--motor polars` o `--motor servidor` se miden también los conteos con ese motor y se verifica que
+coincidan con los del motor de referencia (pandas). Con 'servidor' sólo la primera repetición consulta el backend; las
+demás salen del caché del motor.
+
+Con `--cache <directorio>` las consultas pasan por el caché en disco (ver `cache_consultas.py`): cada tabla se
+carga una vez con el caché vacío y las repeticiones se sirven desde el disco.
+
+Con `--importaciones` se mide además el tiempo de importación de los módulos del tablero en un intérprete
+nuevo (lo que tarda en arrancar un proceso antes de recibir datos), con el detalle de los paquetes que más
+tardan.
+
+Uso:
+    python benchmark.py --datos datos_locales --repeticiones 5 --motor duckdb --importaciones
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import datos
+from cache_consultas import cache_configurado
+from snowflake_utils import (HistogramaConsultas, enviar_consulta, recoger_consultas, registrar_observador_consultas,
+                             st_query_to_snowflake_and_return_dataframe)
+
+CONSULTAS = {
+    'TABLA_BASE_MUNICIPIOS': {'Cod. Municipio': str},
+    'TABLA_TEJIDO_MUNICIPIOS': {'Cod. Depto': str, 'Cod. Municipio': str, 'CIIU Rev 4 principal': str},
+    'TABLA_DIVIPOLA_MUNICIPIOS': {'Código .1': str},
+}
+
+# Columnas por las que el tablero agrupa las empresas de cada municipio
+COLUMNAS_CATEGORIA = ['Tamaño', 'Cadena productiva', 'Valor agregado empresa', 'Cadena* ult 10 años']
+
+
+def cronometrar(funcion, repeticiones):
+    """Ejecuta `funcion` varias veces y devuelve (último resultado, lista de tiempos en milisegundos)."""
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return resultado, tiempos
+
+
+# Módulos que importa el tablero al arrancar, en el orden en que los carga `app.py`
+MODULOS_ARRANQUE = ['perf_utils', 'snowflake_utils', 'datos', 'funciones', 'streamlit']
+
+
+def tiempos_importacion(modulo):
+    """
+    Importa un módulo en un intérprete nuevo con `-X importtime`.
+
+    Returns:
+        tuple: (milisegundos totales del módulo, diccionario importación directa del módulo -> milisegundos
+               acumulados, incluidas sus propias dependencias).
+    """
+    proceso = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+                             capture_output=True, text=True, check=True)
+    total = 0
+    directas = {}
+    pendientes = {}
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith('import time:') or 'cumulative' in linea:
+            continue
+        _, acumulado, nombre = linea[len('import time:'):].split('|')
+        ms = int(acumulado) / 1000
+        # `-X importtime` sangra cada nivel de anidamiento con dos espacios y escribe cada módulo después
+        # de sus dependencias, así que las de nivel 1 se acumulan hasta ver a qué módulo pertenecen
+        nivel = (len(nombre) - len(nombre.lstrip(' '))) // 2
+        if nivel == 1:
+            pendientes[nombre.strip()] = ms
+        elif nivel == 0:
+            if nombre.strip() == modulo:
+                total, directas = ms, pendientes
+            pendientes = {}
+    return total, directas
+
+
+def medir_importaciones(modulos=MODULOS_ARRANQUE, mas_lentos=8):
+    for modulo in modulos:
+        total, directas = tiempos_importacion(modulo)
+        detalle = sorted(directas.items(), key=lambda item: item[1], reverse=True)[:mas_lentos]
+        print(f"importar {modulo:<36} total {total:>10.2f} ms")
+        for importado, ms in detalle:
+            print(f"    {importado:<40} {ms:>10.2f} ms")
+
+
+# Conteos que el tablero pide para cada municipio (argumentos de `conteo` de los motores)
+CONTEOS_PERFIL = [
+    {'columnas': 'Tamaño'},
+    {'columnas': 'Cadena productiva'},
+    {'columnas': 'Valor agregado empresa'},
+    {'columnas': 'Cadena* ult 10 años', 'filtro': 'exportadoras'},
+    {'columnas': 'Cadena productiva', 'filtro': 'ied'},
+    {'columnas': ['CIIU Rev 4 principal', 'Descripción CIIU principal'], 'filtro': 'turismo'},
+]
+
+
+def consultas_perfil(**ambito):
+    """Devuelve los conteos del perfil restringidos a un ámbito (cod_mpio o cod_depto; nada para el país)."""
+    return [{**conteo, **ambito} for conteo in CONTEOS_PERFIL]
+
+
+def ejecutar(motor, consultas):
+    for consulta in consultas:
+        motor.conteo(**consulta)
+
+
+def imprimir(nombre, tiempos):
+    print(f"{nombre:<45} mediana {statistics.median(tiempos):>10.2f} ms   máx {max(tiempos):>10.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datos', default=os.environ.get('MUNICIPIOS_DATOS_LOCALES', 'datos_locales'),
+                        help='Directorio con los archivos Parquet/CSV de las tablas.')
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--municipios', type=int, default=50, help='Número de municipios a perfilar.')
+    parser.add_argument('--importaciones', action='store_true',
+                        help='Mide el tiempo de importación de los módulos del tablero en un intérprete nuevo.')
+    parser.add_argument('--cache', help='Directorio del caché en disco de consultas (ver cache_consultas.py). Las '
+                                        'cargas se miden primero con el caché vacío y luego desde el disco.')
+    parser.add_argument('--motor', choices=['pandas', 'duckdb', 'polars', 'servidor'], help='Motor a comparar con el de referencia.')
+    args = parser.parse_args()
+
+    if args.importaciones:
+        medir_importaciones()
+        print()
+
+    os.environ['MUNICIPIOS_BACKEND'] = 'local'
+    os.environ['MUNICIPIOS_DATOS_LOCALES'] = args.datos
+    histograma = HistogramaConsultas()
+    registrar_observador_consultas(histograma.observar)
+
+    if args.cache:
+        os.environ['MUNICIPIOS_CACHE_CONSULTAS'] = args.cache
+        cache = cache_configurado()
+        cache.vaciar()
+        for tabla, expected_types in CONSULTAS.items():
+            # Primera consulta con el caché vacío, que además lo llena; las repeticiones salen del disco
+            _, tiempos = cronometrar(lambda: st_query_to_snowflake_and_return_dataframe(f"SELECT * FROM {tabla}", {}, expected_types=expected_types), 1)
+            imprimir(f"carga {tabla} sin caché", tiempos)
+        resultados, tamano = cache.medir()
+        print(f"caché en disco: {resultados} resultados, {tamano / 1024:,.0f} KB")
+
+    tablas = {}
+    for tabla, expected_types in CONSULTAS.items():
+        tablas[tabla], tiempos = cronometrar(
+            lambda: st_query_to_snowflake_and_return_dataframe(f"SELECT * FROM {tabla}", {}, expected_types=expected_types),
+            args.repeticiones)
+        imprimir(f"carga {tabla} ({len(tablas[tabla]):,} filas)", tiempos)
+
+    # Las mismas cargas enviadas todas de una vez y recogidas después, como en `datos.cargar_desde_backend`
+    _, tiempos = cronometrar(lambda: recoger_consultas([
+        enviar_consulta(f"SELECT * FROM {tabla}", {}, expected_types=expected_types)
+        for tabla, expected_types in CONSULTAS.items()]), args.repeticiones)
+    imprimir(f"carga de las {len(CONSULTAS)} tablas enviadas juntas", tiempos)
+
+    instantanea = datos.Instantanea(tablas, {})
+    df_base = instantanea.df_base
+    codigos = df_base['Cod. Municipio'].dropna().unique()[:args.municipios]
+    deptos = df_base['Cod. Depto'].dropna().unique()
+    ambitos = {
+        f"perfil de {len(codigos)} municipios": [c for cod in codigos for c in consultas_perfil(cod_mpio=cod)],
+        f"perfil de {len(deptos)} departamentos": [c for cod in deptos for c in consultas_perfil(cod_depto=cod)],
+        "perfil nacional": consultas_perfil(),
+    }
+
+    # Búsqueda de municipios: una consulta por cada prefijo de los textos, como al escribir tecla a tecla
+    textos = ['bogota', 'cucuta', 'san andres', 'medelin']
+    teclas = [texto[:n] for texto in textos for n in range(1, len(texto) + 1)]
+    datos.buscar_municipios(instantanea, 'a')
+    _, tiempos = cronometrar(lambda: [datos.buscar_municipios(instantanea, tecla) for tecla in teclas], args.repeticiones)
+    imprimir(f"búsqueda por tecla (x{len(teclas)})", [t / len(teclas) for t in tiempos])
+
+    # Índice espacial: 5 vecinos de cada municipio y empresas a menos de 50 km de todos a la vez
+    indice_espacial = instantanea.derivado('indice_espacial')
+    cercanos = indice_espacial.municipios[datos.CLAVE].tolist()
+    _, tiempos = cronometrar(lambda: [indice_espacial.cercanos(clave, 5) for clave in cercanos], args.repeticiones)
+    imprimir(f"5 municipios cercanos (x{len(cercanos)})", [t / len(cercanos) for t in tiempos])
+    _, tiempos = cronometrar(lambda: indice_espacial.pares_en_radio(50), args.repeticiones)
+    imprimir(f"pares de municipios a menos de 50 km", tiempos)
+
+    motores = ['pandas'] + ([args.motor] if args.motor and args.motor != 'pandas' else [])
+    for nombre in motores:
+        motor = datos.crear_motor(instantanea, nombre)
+        for ambito, consultas in ambitos.items():
+            _, tiempos = cronometrar(lambda: ejecutar(motor, consultas), args.repeticiones)
+            imprimir(f"[{nombre}] {ambito}", tiempos)
+        if hasattr(motor, 'precargar'):
+            # Un solo viaje al backend por municipio con todos los conteos de su perfil, sin caché previo
+            def precargar_municipios():
+                sin_cache = datos.crear_motor(instantanea, nombre)
+                for cod in codigos:
+                    sin_cache.precargar(consultas_perfil(cod_mpio=cod))
+            _, tiempos = cronometrar(precargar_municipios, args.repeticiones)
+            imprimir(f"[{nombre}] perfil de {len(codigos)} municipios en lote", tiempos)
+
+    if len(motores) > 1:
+        referencia = datos.crear_motor(instantanea, 'pandas')
+        candidato = datos.crear_motor(instantanea, motores[1])
+        consultas = [c for lista in ambitos.values() for c in lista]
+        diferencias = datos.comparar_motores(referencia, candidato, consultas)
+        print(f"\nParidad pandas vs {motores[1]}: {len(consultas) - len(diferencias)}/{len(consultas)} conteos coinciden")
+        for diferencia in diferencias[:10]:
+            print(diferencia)
+
+    print()
+    print(histograma.resumen().to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
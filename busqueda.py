@@ -0,0 +1,87 @@
+"""
+Índice de búsqueda aproximada de municipios.
+
+Busca por el nombre del municipio y, opcionalmente, del departamento, sin distinguir mayúsculas ni tildes
+y tolerando errores de digitación ("bogota", "cucuta", "san andres"). El índice de trigramas se construye
+una vez por instantánea (ver el derivado 'indice_busqueda' en `datos.py`); cada consulta sólo recorre las
+listas de los trigramas del texto buscado, así que responde en microsegundos.
+"""
+import heapq
+import re
+import sys
+import unicodedata
+
+
+def normalizar(texto: str) -> str:
+    """Pasa el texto a minúsculas, sin tildes ni signos de puntuación y con un solo espacio entre palabras."""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(caracter for caracter in texto if not unicodedata.combining(caracter))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', texto.lower()).split())
+
+
+def trigramas(texto: str) -> set:
+    """Devuelve los trigramas de cada palabra de un texto normalizado, con espacios de relleno en los bordes."""
+    resultado = set()
+    for palabra in texto.split():
+        palabra = f'  {palabra} '
+        resultado.update(palabra[i:i + 3] for i in range(len(palabra) - 2))
+    return resultado
+
+
+class IndiceBusqueda:
+    """
+    Índice de trigramas sobre los municipios de la barra lateral.
+
+    Args:
+        codigos (dict): Departamento -> municipio -> Cod. Municipio (el 'codigos' de
+                        `snapshots.indice_territorial`).
+    """
+
+    def __init__(self, codigos: dict):
+        self._entradas = []
+        self._municipios = []
+        self._trigramas = {}
+        for departamento, municipios in codigos.items():
+            for municipio, cod_mpio in municipios.items():
+                posicion = len(self._entradas)
+                self._entradas.append({'departamento': departamento, 'municipio': municipio, 'cod_municipio': cod_mpio})
+                self._municipios.append(normalizar(municipio))
+                for trigrama in trigramas(f'{normalizar(municipio)} {normalizar(departamento)}'):
+                    self._trigramas.setdefault(trigrama, []).append(posicion)
+
+    def buscar(self, texto: str, limite: int = 10) -> list:
+        """
+        Devuelve los municipios que mejor coinciden con el texto, del más al menos parecido.
+
+        El puntaje es la fracción de trigramas del texto que aparecen en el municipio o su departamento,
+        más un punto si el nombre del municipio empieza por el texto.
+
+        Returns:
+            list: Diccionarios con 'departamento', 'municipio', 'cod_municipio' y 'puntaje'.
+        """
+        consulta = normalizar(texto)
+        buscados = trigramas(consulta)
+        if not buscados:
+            return []
+
+        coincidencias = {}
+        for trigrama in buscados:
+            for posicion in self._trigramas.get(trigrama, ()):
+                coincidencias[posicion] = coincidencias.get(posicion, 0) + 1
+
+        puntajes = []
+        for posicion, comunes in coincidencias.items():
+            puntaje = comunes / len(buscados)
+            if self._municipios[posicion].startswith(consulta):
+                puntaje += 1
+            # Se descartan las coincidencias de menos de un tercio de los trigramas buscados
+            if puntaje >= 1 / 3:
+                # Los nombres más cortos primero cuando empatan: "Cúcuta" antes que "San José de Cúcuta"
+                puntajes.append((-puntaje, len(self._municipios[posicion]), posicion))
+        puntajes = heapq.nsmallest(limite, puntajes)
+        return [{**self._entradas[posicion], 'puntaje': round(-puntaje, 3)} for puntaje, _, posicion in puntajes]
+
+    def medir_memoria(self) -> tuple:
+        """Devuelve (municipios indexados, bytes aproximados del índice)."""
+        tamano = sum(sys.getsizeof(trigrama) + sys.getsizeof(lista) for trigrama, lista in self._trigramas.items())
+        return len(self._entradas), tamano
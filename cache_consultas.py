@@ -0,0 +1,223 @@
+"""
+Caché en disco de los resultados de las consultas al backend.
+
+Cada resultado se guarda como un archivo Parquet comprimido con zstd cuyo nombre es el hash SHA-256 de lo
+que determina la respuesta: la consulta normalizada, los parámetros enlazados, el backend, la cuenta, la
+base de datos y el esquema, los tipos esperados y, si se conoce, el marcador de cambio de los datos
+consultados. Así, la misma consulta hecha tras reiniciar el tablero, desde otro proceso del servidor o desde
+un proceso por lotes (`publicacion.py`, `snapshots.py`) se responde desde el disco sin volver a recorrer el
+warehouse.
+
+Los archivos se escriben con otro nombre y se renombran al terminar (`os.replace`), de modo que otro proceso
+nunca lee un resultado a medio escribir. Un resultado vence a los MUNICIPIOS_CACHE_TTL segundos de
+escrito (fecha de modificación del archivo). Cuando el directorio supera MUNICIPIOS_CACHE_MAXIMO_MB se
+borran los resultados usados hace más tiempo (la fecha de acceso se actualiza en cada acierto). Para no
+recorrer el directorio en cada escritura, cada proceso lleva la cuenta aproximada del tamaño (el último
+recorrido más lo que escribió desde entonces) y sólo lo recorre al superar el máximo o cada
+`ESCRITURAS_POR_RECORRIDO` escrituras, que es cuando se entera de lo que escribieron los demás procesos.
+El desalojo deja el directorio en `FRACCION_DESALOJO` del máximo, de modo que con el caché lleno no se
+vuelve a recorrer en la escritura siguiente.
+
+Se activa indicando el directorio:
+    MUNICIPIOS_CACHE_CONSULTAS=cache_consultas streamlit run app.py
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from perf_utils import emitir_json, obtener_logger_json
+
+logger = obtener_logger_json('municipios.cache')
+
+TTL = float(os.environ.get('MUNICIPIOS_CACHE_TTL', 24 * 3600))
+MAXIMO_BYTES = int(float(os.environ.get('MUNICIPIOS_CACHE_MAXIMO_MB', 1024)) * 1024 * 1024)
+
+EXTENSION = '.parquet'
+
+ESCRITURAS_POR_RECORRIDO = 100
+FRACCION_DESALOJO = 0.9
+
+
+def _nombre_tipo(tipo) -> str:
+    return tipo.__name__ if isinstance(tipo, type) else str(tipo)
+
+
+def clave_consulta(consulta: str, parametros=None, sf_config: dict = None, backend: str = None,
+                   expected_types: dict = None, marcador: str = None) -> str:
+    """
+    Calcula la llave de un resultado.
+
+    Args:
+        consulta (str): Consulta SQL normalizada (ver `snowflake_utils.normalizar_consulta`).
+        parametros (list, optional): Valores de los marcadores `?`.
+        sf_config (dict, optional): Configuración de conexión; se usan 'account', 'database' y 'schema'.
+        backend (str, optional): Nombre del backend que ejecuta la consulta.
+        expected_types (dict, optional): Tipos aplicados a las columnas del resultado.
+        marcador (str, optional): Marcador de cambio de los datos consultados.
+
+    Returns:
+        str: Hash SHA-256 en hexadecimal.
+    """
+    sf_config = sf_config or {}
+    contenido = {
+        'consulta': consulta,
+        'parametros': [str(valor) for valor in parametros] if parametros is not None else None,
+        'backend': backend,
+        'ubicacion': [sf_config.get('account'), sf_config.get('database'), sf_config.get('schema')],
+        'tipos': {columna: _nombre_tipo(tipo) for columna, tipo in sorted((expected_types or {}).items())},
+        'marcador': marcador,
+    }
+    return hashlib.sha256(json.dumps(contenido, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class CacheConsultas:
+    """
+    Resultados de consultas guardados como archivos Parquet en un directorio compartido entre procesos.
+
+    Args:
+        directorio (str): Directorio del caché. Se crea si no existe.
+        ttl (float): Segundos durante los que se sirve un resultado después de escrito.
+        maximo_bytes (int): Tamaño total máximo de los archivos; al superarlo se borran los menos usados.
+    """
+
+    def __init__(self, directorio: str, ttl: float = TTL, maximo_bytes: int = MAXIMO_BYTES):
+        self.directorio = directorio
+        self.ttl = ttl
+        self.maximo_bytes = maximo_bytes
+        self._lock = threading.Lock()
+        # Tamaño aproximado del directorio (None hasta el primer recorrido) y escrituras desde el último
+        self._bytes = None
+        self._escrituras = 0
+        os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, clave: str) -> str:
+        # Un subdirectorio por los dos primeros caracteres para no acumular miles de archivos en uno solo
+        return os.path.join(self.directorio, clave[:2], clave + EXTENSION)
+
+    def obtener(self, clave: str) -> pd.DataFrame:
+        """Devuelve el resultado guardado con la llave, o None si no existe o venció."""
+        ruta = self._ruta(clave)
+        try:
+            estado = os.stat(ruta)
+            if time.time() - estado.st_mtime > self.ttl:
+                os.remove(ruta)
+                return None
+            df = pd.read_parquet(ruta)
+            # La fecha de acceso marca el último uso para el desalojo; la de modificación, el vencimiento
+            os.utime(ruta, ns=(time.time_ns(), estado.st_mtime_ns))
+            return df
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # Un archivo dañado se trata como ausente y se vuelve a consultar
+            emitir_json(logger, 'cache_ilegible', {'archivo': ruta, 'error': f'{type(e).__name__}: {e}'})
+            return None
+
+    def guardar(self, clave: str, df: pd.DataFrame) -> bool:
+        """
+        Guarda un resultado de forma atómica y desaloja los menos usados si se supera el tamaño máximo.
+
+        Returns:
+            bool: False si el resultado no se pudo escribir en Parquet (p. ej. una columna con tipos mezclados).
+        """
+        ruta = self._ruta(clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            df.to_parquet(temporal, index=False, compression='zstd')
+            tamano = os.path.getsize(temporal)
+            os.replace(temporal, ruta)
+        except Exception as e:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            emitir_json(logger, 'cache_no_guardado', {'error': f'{type(e).__name__}: {e}'})
+            return False
+        with self._lock:
+            self._escrituras += 1
+            if self._bytes is not None:
+                self._bytes += tamano
+            recorrer = (self._bytes is None or self._bytes > self.maximo_bytes
+                        or self._escrituras >= ESCRITURAS_POR_RECORRIDO)
+        if recorrer:
+            self.desalojar()
+        return True
+
+    def _archivos(self) -> list:
+        archivos = []
+        for raiz, _, nombres in os.walk(self.directorio):
+            for nombre in nombres:
+                if not nombre.endswith(EXTENSION):
+                    continue
+                ruta = os.path.join(raiz, nombre)
+                try:
+                    estado = os.stat(ruta)
+                except FileNotFoundError:
+                    # Otro proceso lo borró mientras se recorría el directorio
+                    continue
+                archivos.append((estado.st_atime, estado.st_mtime, estado.st_size, ruta))
+        return archivos
+
+    def desalojar(self) -> int:
+        """
+        Borra los resultados vencidos y, si el total sigue por encima del máximo, los usados hace más tiempo
+        hasta dejarlo en `FRACCION_DESALOJO` del máximo.
+
+        Returns:
+            int: Número de archivos borrados.
+        """
+        with self._lock:
+            archivos = self._archivos()
+            ahora = time.time()
+            total = sum(tamano for _, _, tamano, _ in archivos)
+            objetivo = self.maximo_bytes if total <= self.maximo_bytes else self.maximo_bytes * FRACCION_DESALOJO
+            borrados = 0
+            for acceso, modificacion, tamano, ruta in sorted(archivos):
+                if ahora - modificacion <= self.ttl and total <= objetivo:
+                    continue
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+                total -= tamano
+                borrados += 1
+            self._bytes = total
+            self._escrituras = 0
+        if borrados:
+            emitir_json(logger, 'cache_desalojo', {'archivos': borrados, 'bytes': total})
+        return borrados
+
+    def vaciar(self) -> None:
+        """Borra todos los resultados guardados."""
+        with self._lock:
+            for _, _, _, ruta in self._archivos():
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+            self._bytes = 0
+            self._escrituras = 0
+
+    def medir(self) -> tuple:
+        """Devuelve (resultados, bytes) guardados en el directorio."""
+        archivos = self._archivos()
+        return len(archivos), sum(tamano for _, _, tamano, _ in archivos)
+
+
+# Cachés ya creados, por directorio
+_caches = {}
+_lock_caches = threading.Lock()
+
+
+def cache_configurado():
+    """Devuelve el caché del directorio MUNICIPIOS_CACHE_CONSULTAS, o None si la variable no está definida."""
+    directorio = os.environ.get('MUNICIPIOS_CACHE_CONSULTAS')
+    if not directorio:
+        return None
+    with _lock_caches:
+        if directorio not in _caches:
+            _caches[directorio] = CacheConsultas(directorio)
+        return _caches[directorio]
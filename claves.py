@@ -0,0 +1,74 @@
+"""
+Clave entera de los municipios.
+
+El código DIVIPOLA de un municipio ('05001') llega como texto en las tres tablas: 'Cod. Municipio' en
+TABLA_BASE_MUNICIPIOS y en el tejido, 'Código .1' en DIVIPOLA. Al cargar cada tabla se le agrega la columna
+'Clave municipio', el mismo código como int32 (5001), común a las tres. Los filtros, índices y uniones en
+memoria usan la clave: comparar, agrupar y buscar en un diccionario son operaciones sobre enteros de 4
+bytes en lugar de cadenas de Python. El código con ceros a la izquierda sólo se usa para mostrarlo y para
+consultar el backend, donde sigue siendo texto.
+
+El departamento es la clave dividida por 1000 (los dos primeros dígitos del código).
+"""
+import numbers
+
+import numpy as np
+import pandas as pd
+
+CLAVE = 'Clave municipio'
+
+# Clave de las filas sin código de municipio (o con un código que no es numérico)
+SIN_CLAVE = -1
+
+# Columna con el código DIVIPOLA del municipio en cada tabla
+COLUMNAS_CODIGO = {
+    'TABLA_BASE_MUNICIPIOS': 'Cod. Municipio',
+    'TABLA_TEJIDO_MUNICIPIOS': 'Cod. Municipio',
+    'TABLA_DIVIPOLA_MUNICIPIOS': 'Código .1',
+}
+
+DIGITOS_CODIGO = 5
+
+
+def clave_municipio(cod_mpio) -> int:
+    """
+    Convierte un código DIVIPOLA ('05001' o 5001) en su clave entera, o `SIN_CLAVE` si no es válido.
+
+    El texto sólo vale con hasta `DIGITOS_CODIGO` dígitos ASCII, igual que `api.codigo_municipio`: `int()`
+    aceptaría también espacios, signos y guiones bajos (' 5_001 ' sería 5001).
+    """
+    if isinstance(cod_mpio, numbers.Integral) and not isinstance(cod_mpio, bool):
+        clave = int(cod_mpio)
+        return clave if 0 <= clave < 10 ** DIGITOS_CODIGO else SIN_CLAVE
+    if isinstance(cod_mpio, str) and cod_mpio.isascii() and cod_mpio.isdigit() \
+            and len(cod_mpio) <= DIGITOS_CODIGO:
+        return int(cod_mpio)
+    return SIN_CLAVE
+
+
+def claves_municipio(codigos: pd.Series) -> np.ndarray:
+    """Convierte una columna de códigos DIVIPOLA en un arreglo int32 de claves, con `SIN_CLAVE` en los faltantes."""
+    return pd.to_numeric(codigos, errors='coerce').fillna(SIN_CLAVE).to_numpy(dtype=np.int32)
+
+
+def texto_clave(clave: int) -> str:
+    """Devuelve el código DIVIPOLA con ceros a la izquierda de una clave, para mostrarlo."""
+    return f'{int(clave):0{DIGITOS_CODIGO}d}'
+
+
+def departamento_clave(claves):
+    """Devuelve la clave del departamento (los dos primeros dígitos del código) de una o varias claves."""
+    return claves // 1000
+
+
+def agregar_clave(tabla: str, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrega a una tabla del tablero la columna `CLAVE` calculada de su columna de código.
+
+    Devuelve el mismo DataFrame, sin copiarlo, si ya tiene la clave (p. ej. las tablas de una instantánea
+    local, que la guardan) o si no tiene columna de código.
+    """
+    columna = COLUMNAS_CODIGO.get(tabla)
+    if df is None or CLAVE in df.columns or columna not in df.columns:
+        return df
+    return df.assign(**{CLAVE: claves_municipio(df[columna])})
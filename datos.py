@@ -0,0 +1,1085 @@
+"""
+Capa de datos del tablero.
+
+Las tres tablas se cargan desde el backend configurado (Snowflake o local, ver `snowflake_utils.py`) y se
+publican como una `Instantanea` inmutable con una versión. Las estructuras derivadas (índices, listas de
+la barra lateral, cachés) se construyen a demanda y viven dentro de la instantánea, de modo que al
+refrescar los datos se reemplaza todo de una sola vez: una sesión que ya tomó la instantánea anterior la
+sigue usando completa hasta terminar su ejecución.
+
+`refrescar` consulta el marcador de cambio de cada tabla (`LAST_ALTERED` en Snowflake) y sólo vuelve a
+descargar las tablas que cambiaron. Si el backend no responde al arrancar (plazo vencido o interruptor
+abierto, ver `snowflake_utils.Interruptor`), se sirve la última instantánea local como respaldo
+(`Instantanea.respaldo`) hasta que el backend vuelva. Esa instantánea la guarda el propio tablero en un
+hilo de fondo después de cada carga correcta desde el backend, como mucho una vez cada
+MUNICIPIOS_INTERVALO_RESPALDO segundos (ver `guardar_respaldo`). Con el motor 'servidor', mientras el
+backend no responde los conteos se resuelven con pandas sobre esa misma instantánea (ver `MotorConRespaldo`).
+
+Con MUNICIPIOS_ORIGEN=snapshot los datos se sirven desde la instantánea local vigente (ver `snapshots.py`)
+y el tejido empresarial se lee por departamento a medida que se consulta. Por eso `app.py` accede al
+tejido con `departamentos`, `municipios`, `codigo_municipio` y `tejido_municipio`, que funcionan igual
+en todos los orígenes. Con MUNICIPIOS_ORIGEN=compartido las tablas completas de la instantánea vigente se
+mapean en memoria de sólo lectura desde archivos Arrow, compartidas entre todos los procesos del servidor.
+
+Las agregaciones del tejido (conteos de empresas por categoría para un municipio, un departamento o todo
+el país) las resuelve un motor elegido con MUNICIPIOS_MOTOR: 'pandas' (por defecto, la implementación de
+referencia), 'duckdb' (ver `motor_duckdb.py`), 'polars' (ver `motor_polars.py`) o 'servidor' (ver
+`motor_servidor.py`), que envía cada agregación al backend y no descarga el tejido.
+
+Las coordenadas de DIVIPOLA se indexan en un KD-tree por instantánea (ver `vecinos.py`), que responde los
+municipios más cercanos a uno dado y las sumas de empresas en un radio para todos los municipios a la vez.
+`municipios_similares` lee los municipios de perfil más parecido, precalculados para todos (ver `similitud.py`).
+`coropleta` une los valores de un indicador con la geometría simplificada del mapa nacional (ver
+`geometria.py`).
+
+Al crear la instantánea se agrega a las tres tablas la columna 'Clave municipio', el código DIVIPOLA como
+int32 (ver `claves.py`). Los filtros por municipio, los índices de los derivados y las uniones entre tablas
+usan la clave; el código con ceros a la izquierda queda para mostrarlo, para la barra lateral y para las
+consultas al backend.
+"""
+import collections
+import hashlib
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from perf_utils import anotar, emitir_json, medido, medir, obtener_logger_json, registrar_cache, tamano_bytes, tamano_objeto
+from busqueda import IndiceBusqueda
+from claves import CLAVE, SIN_CLAVE, agregar_clave, clave_municipio, claves_municipio, departamento_clave
+from vecinos import IndiceEspacial
+from similitud import SimilitudMunicipios, matriz_caracteristicas
+import geometria
+from snowflake_utils import (ESPERA_INTERRUPTOR, calentar_backend, enviar_consulta, es_falla_disponibilidad,
+                             sf_obtener_marcadores_cambio)
+import snapshots
+
+logger = obtener_logger_json('municipios.datos')
+
+# Tablas del tablero y tipos esperados de sus columnas de códigos
+TABLAS = {
+    'TABLA_BASE_MUNICIPIOS': {'Cod. Municipio': str},
+    'TABLA_TEJIDO_MUNICIPIOS': {'Cod. Depto': str, 'Cod. Municipio': str, 'CIIU Rev 4 principal': str},
+    'TABLA_DIVIPOLA_MUNICIPIOS': {'Código .1': str},
+}
+
+# 'backend' (por defecto) carga las tablas desde el backend; 'snapshot' las lee de la instantánea local y
+# 'compartido' mapea los archivos Arrow de la instantánea local, compartidos entre procesos
+ORIGEN = os.environ.get('MUNICIPIOS_ORIGEN', 'backend')
+
+# Motor de agregación del tejido: 'pandas' (referencia), 'duckdb', 'polars' o 'servidor' (el backend
+# agrega y el tejido no se descarga)
+MOTOR = os.environ.get('MUNICIPIOS_MOTOR', 'pandas')
+
+# Segundos entre verificaciones de cambios en las tablas (ver `refrescar_si_vencido`)
+INTERVALO_REFRESCO = float(os.environ.get('MUNICIPIOS_INTERVALO_REFRESCO', 900))
+
+# Segundos mínimos entre dos instantáneas locales de respaldo guardadas tras un refresco (ver
+# `guardar_respaldo`); con un valor negativo no se guardan
+INTERVALO_RESPALDO = float(os.environ.get('MUNICIPIOS_INTERVALO_RESPALDO', 3600))
+
+
+def cargar_sf_config():
+    """
+    Devuelve la configuración de Snowflake de `st.secrets`. Si no hay llaves secretas (p. ej. al usar el
+    backend local con MUNICIPIOS_BACKEND=local), devuelve un diccionario vacío.
+    """
+    import streamlit as st
+
+    try:
+        return st.secrets['snowflake']
+    except (KeyError, FileNotFoundError):
+        return {}
+
+
+# Constructores de estructuras derivadas: nombre -> función que recibe la instantánea
+_CONSTRUCTORES = {}
+
+
+def derivado(nombre: str):
+    """
+    Decorador que registra una función como constructor de una estructura derivada de la instantánea.
+
+    La función recibe la instantánea y se ejecuta una sola vez por versión de los datos, la primera vez
+    que se pide con `Instantanea.derivado(nombre)`.
+    """
+    def decorador(funcion):
+        _CONSTRUCTORES[nombre] = funcion
+        return funcion
+    return decorador
+
+
+class Instantanea:
+    """
+    Conjunto inmutable de tablas cargadas, con sus marcadores de cambio y sus estructuras derivadas.
+
+    Args:
+        tablas (dict): Nombre de tabla -> DataFrame. Si el tejido está particionado, no incluye
+                       TABLA_TEJIDO_MUNICIPIOS.
+        marcadores (dict): Nombre de tabla -> marcador de cambio con el que se cargó.
+        version (str, optional): Versión de los datos. Por defecto se calcula a partir de los marcadores.
+        particiones (snapshots.CargadorParticiones, optional): Cargador del tejido particionado.
+        manifiesto (dict, optional): Manifiesto de la instantánea local de la que se leyeron los datos.
+        respaldo (bool, optional): True si es la instantánea local que se sirve mientras el backend no está
+                                   disponible (ver `refrescar`).
+    """
+
+    def __init__(self, tablas: dict, marcadores: dict, version: str = None, particiones=None, manifiesto: dict = None,
+                 respaldo: bool = False):
+        # Las tablas que ya traen la clave (las de `anterior` o de una instantánea local) no se copian
+        self.tablas = {tabla: agregar_clave(tabla, df) for tabla, df in tablas.items()}
+        self.marcadores = marcadores
+        self.particiones = particiones
+        self.manifiesto = manifiesto
+        self.respaldo = respaldo
+        self.cargada = time.time()
+        if version is None:
+            huella = '|'.join(f'{tabla}={marcadores.get(tabla)}' for tabla in sorted(TABLAS))
+            version = hashlib.sha1(huella.encode('utf-8')).hexdigest()[:12]
+        self.version = version
+        self._derivados = {}
+        self._lock = threading.RLock()
+
+    @property
+    def df_general(self):
+        return self.tablas['TABLA_BASE_MUNICIPIOS']
+
+    @property
+    def df_base(self):
+        # None cuando el tejido está particionado: usar `tejido_municipio`
+        return self.tablas.get('TABLA_TEJIDO_MUNICIPIOS')
+
+    @property
+    def df_ubicacion(self):
+        return self.tablas['TABLA_DIVIPOLA_MUNICIPIOS']
+
+    def dataframes(self):
+        """Devuelve (df_general, df_base, df_ubicacion) como los usa `app.py`."""
+        return self.df_general, self.df_base, self.df_ubicacion
+
+    def derivado(self, nombre: str):
+        """Devuelve la estructura derivada `nombre`, construyéndola la primera vez que se pide."""
+        try:
+            return self._derivados[nombre]
+        except KeyError:
+            pass
+        with self._lock:
+            if nombre not in self._derivados:
+                with medir(f'derivado {nombre}'):
+                    self._derivados[nombre] = _CONSTRUCTORES[nombre](self)
+            return self._derivados[nombre]
+
+    def medir_derivados(self) -> tuple:
+        """Devuelve (entradas, bytes) de las estructuras derivadas ya construidas."""
+        derivados = dict(self._derivados)
+        return len(derivados), tamano_objeto(derivados)
+
+
+_actual = None
+# Reentrante: `instantanea_actual` lo toma antes de llamar a `refrescar`, que lo vuelve a tomar
+_lock_refresco = threading.RLock()
+_ultima_verificacion = 0.0
+
+
+def _enviar_carga(tabla: str, sf_config: dict, marcador: str = None):
+    # Con el marcador de cambio en la llave, el caché en disco sólo sirve la tabla mientras no cambie
+    return enviar_consulta(f"""
+        SELECT * FROM {tabla}
+    """, sf_config, expected_types=TABLAS[tabla], marcador=marcador)
+
+
+def _obtener_marcadores(sf_config: dict) -> dict:
+    try:
+        return sf_obtener_marcadores_cambio(list(TABLAS), sf_config)
+    except Exception as e:
+        # Sin marcadores no se puede saber qué cambió: se recargan todas las tablas
+        emitir_json(logger, 'marcadores_no_disponibles', {'error': str(e)})
+        return {tabla: None for tabla in TABLAS}
+
+
+def tablas_en_memoria() -> list:
+    """Devuelve las tablas que se descargan del backend: todas, salvo el tejido con el motor 'servidor'."""
+    return [tabla for tabla in TABLAS if not (MOTOR == 'servidor' and tabla == 'TABLA_TEJIDO_MUNICIPIOS')]
+
+
+def cargar_desde_backend(sf_config: dict, anterior: Instantanea = None, forzar: bool = True) -> Instantanea:
+    """
+    Carga las tablas desde el backend configurado, reutilizando las de `anterior` que no cambiaron.
+
+    Returns:
+        Instantanea: La nueva instantánea, o None si ninguna tabla cambió.
+    """
+    marcadores = _obtener_marcadores(sf_config)
+    # Todos los marcadores entran en la versión, también el del tejido cuando no se descarga
+    cambiadas = [tabla for tabla in TABLAS
+                 if forzar or anterior is None or marcadores.get(tabla) is None
+                 or marcadores[tabla] != anterior.marcadores.get(tabla)]
+    if not cambiadas:
+        return None
+
+    tablas = dict(anterior.tablas) if anterior is not None else {}
+    # Las tablas que cambiaron se envían todas antes de esperar la primera: el warehouse las ejecuta a la vez
+    enviadas = {tabla: _enviar_carga(tabla, sf_config, marcadores.get(tabla))
+                for tabla in cambiadas if tabla in tablas_en_memoria()}
+    for tabla, enviada in enviadas.items():
+        with medir(f'carga {tabla}'):
+            tablas[tabla] = enviada.resultado()
+            anotar(filas=len(tablas[tabla]), bytes=tamano_bytes(tablas[tabla]))
+    emitir_json(logger, 'tablas_recargadas', {'tablas': cambiadas})
+    return Instantanea(tablas, marcadores)
+
+
+def cargar_desde_snapshot(anterior: Instantanea = None, directorio: str = snapshots.DIRECTORIO_POR_DEFECTO) -> Instantanea:
+    """
+    Abre la instantánea local vigente con el tejido particionado por departamento.
+
+    Returns:
+        Instantanea: La nueva instantánea, o None si la versión vigente es la de `anterior`.
+    """
+    version = snapshots.version_actual(directorio)
+    if anterior is not None and version == anterior.version:
+        return None
+    tablas, particiones, manifiesto = snapshots.abrir_instantanea(directorio, version)
+    return Instantanea(tablas, manifiesto['marcadores'], version=manifiesto['version'],
+                       particiones=particiones, manifiesto=manifiesto)
+
+
+def cargar_respaldo(anterior: Instantanea = None, directorio: str = snapshots.DIRECTORIO_POR_DEFECTO) -> Instantanea:
+    """
+    Abre la instantánea local vigente para servirla mientras el backend no está disponible.
+
+    Returns:
+        Instantanea: La instantánea de respaldo, o None si `anterior` ya es ese respaldo.
+
+    Raises:
+        FileNotFoundError: Si no hay ninguna instantánea local.
+    """
+    version = snapshots.version_actual(directorio)
+    if version is None:
+        raise FileNotFoundError(f"No hay instantáneas locales en '{directorio}' para usar como respaldo")
+    if anterior is not None and anterior.respaldo and version == anterior.version:
+        return None
+    tablas, particiones, manifiesto = snapshots.abrir_instantanea(directorio, version)
+    return Instantanea(tablas, manifiesto['marcadores'], version=manifiesto['version'],
+                       particiones=particiones, manifiesto=manifiesto, respaldo=True)
+
+
+def tablas_completas(inst: Instantanea, sf_config: dict) -> dict:
+    """
+    Devuelve las tres tablas de una instantánea cargada desde el backend. Las que no se descargaron (el
+    tejido con el motor 'servidor', ver `tablas_en_memoria`) se descargan ahora, con su marcador de cambio.
+    """
+    tablas = dict(inst.tablas)
+    enviadas = {tabla: _enviar_carga(tabla, sf_config, inst.marcadores.get(tabla)) for tabla in TABLAS if tabla not in tablas}
+    for tabla, enviada in enviadas.items():
+        with medir(f'carga {tabla}'):
+            tablas[tabla] = agregar_clave(tabla, enviada.resultado())
+            anotar(filas=len(tablas[tabla]), bytes=tamano_bytes(tablas[tabla]))
+    return tablas
+
+
+_lock_respaldo = threading.Lock()
+
+
+def guardar_respaldo(inst: Instantanea, sf_config: dict, directorio: str = snapshots.DIRECTORIO_POR_DEFECTO) -> bool:
+    """
+    Guarda una instantánea cargada desde el backend como la instantánea local vigente, la que `cargar_respaldo`
+    sirve si el backend deja de responder.
+
+    No se guarda si ya es la versión vigente del directorio, si la vigente se generó hace menos de
+    `INTERVALO_RESPALDO` segundos (también por otro proceso del servidor) o si este proceso ya está
+    guardando una.
+
+    Returns:
+        bool: True si se guardó.
+    """
+    if INTERVALO_RESPALDO < 0 or inst.respaldo or not _lock_respaldo.acquire(blocking=False):
+        return False
+    try:
+        vigente = snapshots.version_actual(directorio)
+        if vigente == inst.version:
+            return False
+        if vigente is not None:
+            creada = snapshots.leer_manifiesto(directorio, vigente).get('creada')
+            if creada and time.time() - pd.Timestamp(creada).timestamp() < INTERVALO_RESPALDO:
+                return False
+        with medir('respaldo local'):
+            ruta = snapshots.guardar_instantanea(tablas_completas(inst, sf_config), inst.version, inst.marcadores, directorio)
+        emitir_json(logger, 'respaldo_guardado', {'version': inst.version, 'ruta': ruta})
+        return True
+    finally:
+        _lock_respaldo.release()
+
+
+def _guardar_respaldo_en_fondo(inst: Instantanea, sf_config: dict) -> None:
+    try:
+        guardar_respaldo(inst, sf_config)
+    except Exception as e:
+        # Sin respaldo nuevo se conserva el anterior; el tablero sigue con los datos del backend
+        emitir_json(logger, 'respaldo_fallido', {'version': inst.version, 'error': f'{type(e).__name__}: {e}'})
+
+
+def fecha_respaldo(inst: Instantanea) -> str:
+    """Devuelve la fecha (AAAA-MM-DD HH:MM UTC) en que se generó la instantánea de respaldo, o None si no es respaldo."""
+    if not inst.respaldo:
+        return None
+    creada = inst.manifiesto.get('creada', '')
+    return f"{creada[:10]} {creada[11:16]} UTC" if creada else inst.version
+
+
+# Comienzo de una fecha ISO ('2024-05-01 12:34' o '2024-05-01T12:34')
+_FECHA_ISO = re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}')
+
+
+def _fecha_marcador(marcador) -> float:
+    # Marcadores de `marcadores_cambio`: 'LAST_ALTERED|ROW_COUNT' de las tablas de Snowflake,
+    # 'filas=...|hash=...' de las vistas de Snowflake y 'ruta:st_mtime_ns:st_size' en el backend local.
+    # Devuelve None si el marcador no trae una fecha.
+    texto = str(marcador or '')
+    if '|' in texto:
+        fecha = texto.split('|', 1)[0]
+        if not _FECHA_ISO.match(fecha):
+            return None
+        try:
+            return pd.Timestamp(fecha).timestamp()
+        except ValueError:
+            return None
+    partes = texto.rsplit(':', 2)
+    if len(partes) == 3 and partes[1].isdigit():
+        return int(partes[1]) / 1e9
+    return None
+
+
+def fecha_modificacion(inst: Instantanea) -> float:
+    """
+    Devuelve el instante (segundos desde la época) del último cambio de las tablas de la instantánea según
+    sus marcadores de cambio: LAST_ALTERED en Snowflake o la fecha de modificación de los archivos locales.
+    Si ningún marcador trae la fecha, devuelve el instante en que se cargó la instantánea.
+    """
+    fechas = [fecha for fecha in map(_fecha_marcador, inst.marcadores.values()) if fecha is not None]
+    return max(fechas) if fechas else inst.cargada
+
+
+def cargar_desde_compartida(anterior: Instantanea = None, directorio: str = snapshots.DIRECTORIO_POR_DEFECTO) -> Instantanea:
+    """
+    Mapea las tablas Arrow de la instantánea local vigente, compartidas entre los procesos del servidor.
+
+    Returns:
+        Instantanea: La nueva instantánea, o None si la versión vigente es la de `anterior`.
+    """
+    version = snapshots.version_actual(directorio)
+    if anterior is not None and version == anterior.version:
+        return None
+    tablas, manifiesto = snapshots.abrir_compartida(directorio, version)
+    return Instantanea(tablas, manifiesto['marcadores'], version=manifiesto['version'], manifiesto=manifiesto)
+
+
+def refrescar(forzar: bool = False, sf_config: dict = None) -> bool:
+    """
+    Vuelve a cargar las tablas que cambiaron desde la última carga y publica una nueva instantánea.
+
+    Las tablas sin cambios se reutilizan sin consultarlas. La nueva instantánea reemplaza a la anterior en
+    una sola asignación, así que ninguna sesión ve un estado a medio actualizar.
+
+    Si el backend no está disponible y todavía no hay datos del backend, se publica la última instantánea
+    local como respaldo (ver `cargar_respaldo`); con datos del backend ya cargados, se siguen sirviendo y
+    el error se propaga.
+
+    Args:
+        forzar (bool, optional): Si es True, recarga todas las tablas sin mirar los marcadores.
+        sf_config (dict, optional): Configuración de conexión. Por defecto se lee de `st.secrets`.
+
+    Returns:
+        bool: True si se publicó una nueva instantánea.
+    """
+    global _actual, _ultima_verificacion
+
+    with _lock_refresco:
+        anterior = None if forzar else _actual
+        if ORIGEN == 'snapshot':
+            nueva = cargar_desde_snapshot(anterior)
+        elif ORIGEN == 'compartido':
+            nueva = cargar_desde_compartida(anterior)
+        else:
+            if anterior is not None and anterior.respaldo:
+                # Las tablas del respaldo vienen de la instantánea local: al volver el backend se recargan todas
+                anterior, forzar = None, True
+            sf_config = cargar_sf_config() if sf_config is None else sf_config
+            try:
+                nueva = cargar_desde_backend(sf_config, anterior, forzar)
+            except Exception as e:
+                # Si ya se sirven datos del backend, se conservan; si no, se sirve la última instantánea local
+                if not es_falla_disponibilidad(e) or (_actual is not None and not _actual.respaldo):
+                    raise
+                try:
+                    nueva = cargar_respaldo(_actual)
+                except FileNotFoundError:
+                    raise e
+                if nueva is not None:
+                    emitir_json(logger, 'respaldo_local', {'version': nueva.version, 'error': f'{type(e).__name__}: {e}'})
+        _ultima_verificacion = time.time()
+        if nueva is None:
+            return False
+
+        _actual = nueva
+        emitir_json(logger, 'refresco', {'version': nueva.version, 'origen': ORIGEN, 'respaldo': nueva.respaldo})
+    if ORIGEN == 'backend' and not nueva.respaldo:
+        # Fuera del candado: guardar la instantánea puede tardar (con el motor 'servidor' descarga el tejido)
+        threading.Thread(target=_guardar_respaldo_en_fondo, args=(nueva, sf_config), daemon=True).start()
+    return True
+
+
+def instantanea_actual() -> Instantanea:
+    """Devuelve la instantánea vigente, cargando las tablas la primera vez."""
+    if _actual is None:
+        with _lock_refresco:
+            # Si otra sesión ya cargó los datos mientras se esperaba el candado, no se vuelve a consultar el backend
+            if _actual is None:
+                refrescar()
+    return _actual
+
+
+def calentar() -> None:
+    """
+    Deja el proceso listo antes de atender usuarios: calienta las conexiones del backend (ver
+    `snowflake_utils.calentar_backend`) y carga la instantánea vigente. Si el calentamiento falla, la carga
+    sigue su curso normal (con sus reintentos y el respaldo local).
+    """
+    if ORIGEN == 'backend':
+        try:
+            emitir_json(logger, 'calentamiento', calentar_backend(cargar_sf_config()))
+        except Exception as e:
+            emitir_json(logger, 'calentamiento_fallido', {'error': f'{type(e).__name__}: {e}'})
+    instantanea_actual()
+
+
+def refrescar_si_vencido(intervalo: float = None) -> None:
+    """
+    Lanza `refrescar` en un hilo de fondo si pasaron más de `intervalo` segundos desde la última
+    verificación. La ejecución actual no espera: sigue con la instantánea vigente.
+    """
+    global _ultima_verificacion
+    intervalo = INTERVALO_REFRESCO if intervalo is None else intervalo
+    if _actual is not None and _actual.respaldo:
+        # Sirviendo el respaldo, se vuelve a intentar el backend cuando el interruptor permite una prueba
+        intervalo = min(intervalo, ESPERA_INTERRUPTOR)
+    if _actual is None or time.time() - _ultima_verificacion < intervalo:
+        return
+    # Si el candado está tomado hay un refresco en curso y no hace falta otro
+    if not _lock_refresco.acquire(blocking=False):
+        return
+    try:
+        # Se verifica y se marca con el candado tomado, antes de lanzar el hilo, para que otras sesiones
+        # no lancen una verificación en paralelo
+        if time.time() - _ultima_verificacion < intervalo:
+            return
+        _ultima_verificacion = time.time()
+    finally:
+        _lock_refresco.release()
+    sf_config = cargar_sf_config()
+    threading.Thread(target=_refrescar_en_fondo, args=(sf_config,), daemon=True).start()
+
+
+def _refrescar_en_fondo(sf_config: dict) -> None:
+    try:
+        refrescar(sf_config=sf_config)
+    except Exception as e:
+        # Si el refresco falla, se sigue sirviendo la instantánea vigente
+        emitir_json(logger, 'refresco_fallido', {'error': f'{type(e).__name__}: {e}'})
+
+
+registrar_cache('derivados de la instantánea', lambda: _actual.medir_derivados() if _actual is not None else (0, 0))
+
+
+@derivado('ubicacion')
+def _ubicacion(inst):
+    # Columnas de DIVIPOLA que usa el tablero, con los nombres de las demás tablas
+    df_ubicacion = inst.df_ubicacion[[CLAVE, 'Código .1', 'Nombre', 'Nombre.1', 'LATITUD', 'LONGITUD']]
+    df_ubicacion = df_ubicacion[df_ubicacion[CLAVE] != SIN_CLAVE]
+    return df_ubicacion.rename(columns={'Código .1': 'Cod. Municipio', 'Nombre': 'Departamento', 'Nombre.1': 'Municipio'})
+
+
+@derivado('indice_territorial')
+def _indice_territorial(inst):
+    if inst.manifiesto is not None:
+        return inst.manifiesto['indice_territorial']
+    if inst.df_base is None:
+        # Tejido sin descargar (motor 'servidor'): el backend entrega sólo los pares distintos
+        return snapshots.indice_territorial(motor(inst).territorios())
+    return snapshots.indice_territorial(inst.df_base)
+
+
+@derivado('indice_busqueda')
+def _indice_busqueda(inst):
+    return IndiceBusqueda(inst.derivado('indice_territorial')['codigos'])
+
+
+def buscar_municipios(inst: Instantanea, texto: str, limite: int = 10) -> list:
+    """
+    Busca municipios de todos los departamentos por nombre, sin distinguir mayúsculas ni tildes y
+    tolerando errores de digitación (ver `busqueda.py`).
+
+    Returns:
+        list: Diccionarios con 'departamento', 'municipio', 'cod_municipio' y 'puntaje', del mejor al peor.
+    """
+    return inst.derivado('indice_busqueda').buscar(texto, limite)
+
+
+# Indicadores generales que acompañan a cada municipio cercano
+INDICADORES_CERCANOS = ['Población municipio', '% pobreza municipio', '% informalidad municipio', 'Valor agregado municipio']
+
+_lock_radios = threading.Lock()
+
+
+@derivado('indice_espacial')
+def _indice_espacial(inst):
+    return IndiceEspacial(inst.derivado('ubicacion'))
+
+
+@derivado('empresas_por_municipio')
+def _empresas_por_municipio(inst):
+    conteo = motor(inst).conteo(CLAVE)
+    return conteo.set_index(CLAVE)['Número de empresas']
+
+
+@derivado('empresas_en_radio')
+def _empresas_en_radio(inst):
+    return {}
+
+
+def municipios_cercanos(inst: Instantanea, cod_mpio, k: int = 5) -> pd.DataFrame:
+    """
+    Devuelve los `k` municipios más cercanos a uno dado, con sus indicadores generales y su número de
+    empresas (ver `vecinos.py`).
+
+    Returns:
+        pd.DataFrame: Columnas `CLAVE`, 'Cod. Municipio', 'Departamento', 'Municipio', 'LATITUD', 'LONGITUD',
+                      'Distancia (km)', los `INDICADORES_CERCANOS` y 'Número de empresas'.
+    """
+    cercanos = inst.derivado('indice_espacial').vecinos(clave_municipio(cod_mpio), k)
+    indicadores = inst.df_general[[CLAVE] + INDICADORES_CERCANOS].drop_duplicates(CLAVE)
+    cercanos = cercanos.merge(indicadores, on=CLAVE, how='left')
+    empresas = inst.derivado('empresas_por_municipio')
+    return cercanos.assign(**{'Número de empresas': cercanos[CLAVE].map(empresas).fillna(0)})
+
+
+@derivado('similitud')
+def _similitud(inst):
+    # Participación de cada cadena productiva en las empresas de cada municipio
+    conteo = motor(inst).conteo([CLAVE, 'Cadena productiva'])
+    empresas = conteo.pivot_table(index=CLAVE, columns='Cadena productiva', values='Número de empresas',
+                                  aggfunc='sum', fill_value=0)
+    mezcla = empresas.div(empresas.sum(axis=1).replace(0, 1), axis=0)
+    return SimilitudMunicipios(matriz_caracteristicas(inst.df_general, mezcla))
+
+
+def municipios_similares(inst: Instantanea, cod_mpio, k: int = 5) -> pd.DataFrame:
+    """
+    Devuelve los `k` municipios cuyo perfil (indicadores porcentuales y mezcla de cadenas productivas) más
+    se parece al de un municipio dado (ver `similitud.py`).
+
+    Returns:
+        pd.DataFrame: Columnas `CLAVE`, 'Cod. Municipio', 'Departamento', 'Municipio', 'Similitud' y los
+                      `INDICADORES_CERCANOS`, del más al menos similar.
+    """
+    claves, puntajes = inst.derivado('similitud').similares(clave_municipio(cod_mpio), k)
+    similares = pd.DataFrame({CLAVE: claves, 'Similitud': puntajes.round(3)})
+    nombres = inst.derivado('ubicacion')[[CLAVE, 'Cod. Municipio', 'Departamento', 'Municipio']].drop_duplicates(CLAVE)
+    indicadores = inst.df_general[[CLAVE] + INDICADORES_CERCANOS].drop_duplicates(CLAVE)
+    similares = similares.merge(nombres, on=CLAVE, how='left').merge(indicadores, on=CLAVE, how='left')
+    return similares[[CLAVE, 'Cod. Municipio', 'Departamento', 'Municipio', 'Similitud'] + INDICADORES_CERCANOS]
+
+
+@medido(lambda inst, radio_km=50: f'empresas a menos de {radio_km} km')
+def empresas_en_radio(inst: Instantanea, radio_km: float = 50) -> pd.Series:
+    """
+    Suma las empresas de todos los municipios a menos de `radio_km` de cada municipio, incluido él mismo.
+
+    Los pares de municipios cercanos los da el KD-tree de una sola vez, sin comparar todos contra todos,
+    y el resultado se guarda en la instantánea por radio.
+
+    Returns:
+        pd.Series: 'Número de empresas' indexado por `CLAVE`.
+    """
+    radios = inst.derivado('empresas_en_radio')
+    with _lock_radios:
+        if radio_km in radios:
+            return radios[radio_km]
+
+    pares = inst.derivado('indice_espacial').pares_en_radio(radio_km)
+    empresas = pares[f'{CLAVE} vecino'].map(inst.derivado('empresas_por_municipio')).fillna(0)
+    totales = empresas.groupby(pares[CLAVE]).sum().rename('Número de empresas')
+    anotar(filas=len(pares))
+    with _lock_radios:
+        radios[radio_km] = totales
+    return totales
+
+
+# Indicadores del mapa coroplético nacional: columna -> nombre en el selector
+INDICADORES_MAPA = {
+    '% pobreza municipio': '% pobreza',
+    '% informalidad municipio': '% informalidad',
+    'Valor agregado municipio': 'Valor agregado (COP miles de millones)',
+    'Número de empresas': 'Número de empresas',
+}
+
+
+@derivado('puntos_coropleta')
+def _puntos_coropleta(inst):
+    # Un punto por municipio cuando no hay archivo de límites (ver `geometria.py`)
+    municipios = inst.derivado('indice_espacial').municipios
+    return [{'type': 'Feature', 'id': cod_mpio, 'geometry': {'type': 'Point', 'coordinates': [round(lon, 4), round(lat, 4)]}}
+            for cod_mpio, lat, lon in municipios[['Cod. Municipio', 'LATITUD', 'LONGITUD']].itertuples(index=False)]
+
+
+def valores_indicador(inst: Instantanea, indicador: str) -> pd.Series:
+    """Devuelve un indicador de `INDICADORES_MAPA` para todos los municipios, indexado por `CLAVE`."""
+    if indicador == 'Número de empresas':
+        return inst.derivado('empresas_por_municipio')
+    return inst.df_general.drop_duplicates(CLAVE).set_index(CLAVE)[indicador]
+
+
+@medido(lambda inst, indicador, *args, **kwargs: f'coropleta {indicador}')
+def coropleta(inst: Instantanea, indicador: str, nivel: str = 'nacional', cod_depto: str = None) -> tuple:
+    """
+    Reúne la geometría simplificada de un nivel de zoom y los valores de un indicador para el mapa
+    coroplético. La geometría es la misma para todos los indicadores y todas las versiones de los datos;
+    los valores se unen por código de una sola vez, sin recorrer los municipios.
+
+    Args:
+        indicador (str): Columna de `INDICADORES_MAPA`.
+        nivel (str): Nivel de zoom de `geometria.NIVELES_ZOOM`.
+        cod_depto (str, optional): Si se indica, sólo los municipios de ese departamento (los dos primeros
+                                   dígitos del código DIVIPOLA).
+
+    Returns:
+        tuple: (features de GeoJSON con 'id' = Cod. Municipio, DataFrame con 'Cod. Municipio', 'Municipio'
+               y 'Valor' en el mismo orden de las features).
+    """
+    features = geometria.features_simplificadas(nivel)
+    if features is None:
+        features = inst.derivado('puntos_coropleta')
+    if cod_depto is not None:
+        features = [feature for feature in features if feature['id'].startswith(cod_depto)]
+
+    codigos = pd.Series([feature['id'] for feature in features], name='Cod. Municipio')
+    claves = claves_municipio(codigos)
+    nombres = inst.derivado('ubicacion').drop_duplicates(CLAVE).set_index(CLAVE)
+    nombres = nombres['Municipio'] + ' - ' + nombres['Departamento']
+    valores = pd.DataFrame({'Cod. Municipio': codigos, 'Municipio': nombres.reindex(claves).to_numpy(),
+                            'Valor': valores_indicador(inst, indicador).reindex(claves).to_numpy()})
+    anotar(filas=len(valores))
+    return features, valores
+
+
+def departamentos(inst: Instantanea) -> list:
+    """Devuelve la lista ordenada de departamentos de la barra lateral."""
+    return motor(inst).departamentos()
+
+
+def municipios(inst: Instantanea, departamento: str) -> list:
+    """Devuelve la lista ordenada de municipios de un departamento."""
+    return motor(inst).municipios(departamento)
+
+
+def codigo_municipio(inst: Instantanea, departamento: str, municipio: str):
+    """Devuelve el Cod. Municipio de un municipio de un departamento."""
+    return motor(inst).codigo_municipio(departamento, municipio)
+
+
+def tejido_municipio(inst: Instantanea, cod_mpio):
+    """Devuelve las filas del tejido empresarial de un municipio, vacío si el código no es válido."""
+    if inst.particiones is not None:
+        return inst.particiones.tejido_municipio(cod_mpio)
+    clave = clave_municipio(cod_mpio)
+    if clave == SIN_CLAVE:
+        # Comparar con SIN_CLAVE devolvería todas las filas sin código de municipio
+        return inst.df_base.iloc[0:0]
+    return inst.df_base[inst.df_base[CLAVE] == clave]
+
+
+def datos_municipio(inst: Instantanea, cod_mpio):
+    """Devuelve la fila de indicadores generales (TABLA_BASE_MUNICIPIOS) de un municipio, vacía si no es válido."""
+    clave = clave_municipio(cod_mpio)
+    if clave == SIN_CLAVE:
+        return inst.df_general.iloc[0:0]
+    return inst.df_general[inst.df_general[CLAVE] == clave]
+
+
+# Columnas numéricas de TABLA_BASE_MUNICIPIOS que son etiquetas y no indicadores
+COLUMNAS_SIN_PERCENTIL = ['ZOMAC']
+
+
+@derivado('percentiles')
+def _percentiles(inst):
+    # Todos los indicadores en una sola pasada por versión de los datos; el departamento sale de la clave
+    df_general = inst.df_general.drop_duplicates(CLAVE).set_index(CLAVE)
+    indicadores = df_general.select_dtypes('number').drop(columns=COLUMNAS_SIN_PERCENTIL, errors='ignore')
+    with medir('percentiles'):
+        nacional = indicadores.rank(pct=True).mul(100)
+        departamental = indicadores.groupby(departamento_clave(indicadores.index)).rank(pct=True).mul(100)
+        anotar(filas=indicadores.size)
+    return pd.concat({'nacional': nacional, 'departamental': departamental}, axis=1).astype('float32')
+
+
+def percentiles_municipio(inst: Instantanea, cod_mpio) -> pd.DataFrame:
+    """
+    Devuelve el percentil de un municipio en cada indicador numérico de TABLA_BASE_MUNICIPIOS, entre todos
+    los municipios del país y entre los de su departamento. 100 es el valor más alto.
+
+    Returns:
+        pd.DataFrame: Índice con los indicadores y columnas 'nacional' y 'departamental'. Vacío si el
+                      municipio no está en la tabla.
+    """
+    percentiles = inst.derivado('percentiles')
+    clave = clave_municipio(cod_mpio)
+    if clave not in percentiles.index:
+        return pd.DataFrame(columns=['nacional', 'departamental'])
+    return percentiles.loc[clave].unstack(0)
+
+
+def metricas_pdet_zomac(df_datos_mun):
+    """
+    Devuelve las etiquetas PDET y ZOMAC de un municipio a partir de su fila de indicadores generales.
+
+    Returns:
+        tuple: (etiqueta PDET, etiqueta ZOMAC).
+    """
+    # Asegurarse de que se está trabajando con una copia del DataFrame para evitar advertencias
+    df_datos_mun = df_datos_mun.copy()
+    
+    # Usar .loc para asignaciones seguras
+    df_datos_mun.loc[:, 'PDET'] = 'Es territorio PDET'
+    df_datos_mun.loc[:, 'Subregión PDET'] = df_datos_mun['Subregión PDET'].str.title()
+    df_datos_mun.loc[:, 'Metrica PDET'] = np.where(df_datos_mun['Subregión PDET'].notna(), df_datos_mun['PDET'] + ' - Subregión ' + df_datos_mun['Subregión PDET'], 'No es territorio PDET')
+    df_datos_mun.loc[:, 'Metrica ZOMAC'] = np.where(df_datos_mun['ZOMAC'] == 1, 'Es territorio ZOMAC', 'No es territorio ZOMAC')
+    
+    return df_datos_mun['Metrica PDET'].values[0], df_datos_mun['Metrica ZOMAC'].values[0]
+
+
+# Subconjuntos del tejido que muestra el tablero: nombre -> (columna, operador, valor). El operador '!='
+# conserva los valores nulos, igual que la comparación de pandas.
+FILTROS = {
+    'exportadoras': ('Tipo* ult 10 años', '!=', "No exportó ult. 10 años"),
+    'ied': ('Sucursal sociedad extranjera', '==', "Si"),
+    'turismo': ('Cadena productiva', '==', "Turismo"),
+}
+
+
+# Distribuciones de empresas del perfil de un municipio: nombre -> argumentos de `serie_barras`
+DISTRIBUCIONES_EMPRESAS = {
+    'tamano': {'columnas': 'Tamaño'},
+    'cadena_productiva': {'columnas': 'Cadena productiva'},
+    'valor_agregado': {'columnas': 'Valor agregado empresa'},
+    'exportadoras': {'columnas': 'Cadena* ult 10 años', 'filtro': 'exportadoras'},
+    'ied': {'columnas': 'Cadena productiva', 'filtro': 'ied'},
+    'turismo': {'columnas': ['CIIU Rev 4 principal', 'Descripción CIIU principal'],
+                'columna_etiqueta': 'Descripción CIIU principal', 'filtro': 'turismo'},
+}
+
+
+class MotorPandas:
+    """
+    Motor de agregación de referencia, con pandas sobre las tablas en memoria o las particiones locales.
+
+    Los cortes del tejido por municipio se conservan en un caché LRU, por clave entera, para que los
+    gráficos de un mismo municipio no vuelvan a filtrar la tabla completa.
+
+    Args:
+        inst (Instantanea): Instantánea de la que se leen los datos.
+    """
+    nombre = 'pandas'
+    MAXIMO_CORTES = 64
+
+    def __init__(self, inst: Instantanea):
+        self.inst = inst
+        self._cortes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def departamentos(self) -> list:
+        return self.inst.derivado('indice_territorial')['departamentos']
+
+    def municipios(self, departamento: str) -> list:
+        return self.inst.derivado('indice_territorial')['municipios'].get(departamento, [])
+
+    def codigo_municipio(self, departamento: str, municipio: str):
+        return self.inst.derivado('indice_territorial')['codigos'][departamento][municipio]
+
+    def _tejido(self, cod_mpio=None, cod_depto=None) -> pd.DataFrame:
+        if cod_mpio is not None:
+            clave = clave_municipio(cod_mpio)
+            with self._lock:
+                if clave in self._cortes:
+                    self._cortes.move_to_end(clave)
+                    return self._cortes[clave]
+            corte = tejido_municipio(self.inst, cod_mpio)
+            with self._lock:
+                self._cortes[clave] = corte
+                if len(self._cortes) > self.MAXIMO_CORTES:
+                    self._cortes.popitem(last=False)
+            return corte
+
+        particiones = self.inst.particiones
+        if particiones is not None:
+            claves = [cod_depto] if cod_depto is not None else list(particiones.manifiesto['particiones'])
+            return pd.concat([particiones.obtener(clave) for clave in claves], ignore_index=True)
+        if cod_depto is not None:
+            return self.inst.df_base[self.inst.df_base['Cod. Depto'] == cod_depto]
+        return self.inst.df_base
+
+    @medido(lambda self, columnas, *args, **kwargs: f'conteo {columnas}')
+    def conteo(self, columnas, cod_mpio=None, cod_depto=None, filtro: str = None) -> pd.DataFrame:
+        """
+        Suma el 'Número de empresas' por categoría en un municipio, un departamento o todo el país.
+
+        Args:
+            columnas (str | list): Columna o columnas de categoría.
+            cod_mpio (optional): Cod. Municipio para restringir el conteo a un municipio.
+            cod_depto (str, optional): Cod. Depto para restringir el conteo a un departamento.
+            filtro (str, optional): Nombre de un subconjunto de `FILTROS`.
+
+        Returns:
+            pd.DataFrame: Columnas de categoría y 'Número de empresas', ordenado por las categorías. Las filas
+                          con alguna categoría nula se descartan.
+        """
+        columnas = [columnas] if isinstance(columnas, str) else list(columnas)
+        df = self._tejido(cod_mpio, cod_depto)
+        if filtro is not None:
+            columna, operador, valor = FILTROS[filtro]
+            df = df[df[columna] != valor] if operador == '!=' else df[df[columna] == valor]
+        vacio = pd.DataFrame(columns=columnas + ['Número de empresas'])
+        if df.empty:
+            return vacio
+        conteo = pd.pivot_table(df, index=columnas, values='Número de empresas', aggfunc='sum').reset_index()
+        anotar(filas=len(conteo))
+        # pivot_table pierde la columna de valores si todas las categorías son nulas
+        return vacio if conteo.empty else conteo
+
+    def medir_memoria(self) -> tuple:
+        """Devuelve (cortes en caché, bytes)."""
+        with self._lock:
+            cortes = list(self._cortes.values())
+        return len(cortes), sum(tamano_objeto(corte) for corte in cortes)
+
+
+def _crear_motor_duckdb(inst):
+    # Importación diferida: DuckDB sólo se necesita si se elige este motor
+    from motor_duckdb import MotorDuckDB
+    return MotorDuckDB(inst)
+
+
+def _crear_motor_polars(inst):
+    # Importación diferida: Polars sólo se necesita si se elige este motor
+    from motor_polars import MotorPolars
+    return MotorPolars(inst)
+
+
+def _crear_motor_servidor(inst):
+    from motor_servidor import MotorServidor
+    return MotorServidor(inst)
+
+
+_FABRICAS_MOTOR = {
+    'pandas': MotorPandas,
+    'duckdb': _crear_motor_duckdb,
+    'polars': _crear_motor_polars,
+    'servidor': _crear_motor_servidor,
+}
+
+
+def crear_motor(inst: Instantanea, nombre: str):
+    """Crea un motor de agregación por nombre sobre una instantánea."""
+    if nombre not in _FABRICAS_MOTOR:
+        raise ValueError(f"Motor desconocido: {nombre}. Opciones: {', '.join(_FABRICAS_MOTOR)}")
+    return _FABRICAS_MOTOR[nombre](inst)
+
+
+class MotorConRespaldo:
+    """
+    Motor 'servidor' que, cuando el backend no está disponible (plazo vencido, error de red o interruptor
+    abierto), resuelve los conteos con `MotorPandas` sobre la instantánea local vigente (ver
+    `guardar_respaldo`). Si no hay instantánea local, propaga el error del backend.
+
+    Args:
+        principal (motor_servidor.MotorServidor): Motor que envía los conteos al backend.
+    """
+
+    def __init__(self, principal):
+        self.principal = principal
+        self.nombre = principal.nombre
+
+    def __getattr__(self, nombre):
+        # Índice territorial y memoria: no consultan el backend
+        return getattr(self.principal, nombre)
+
+    def _resolver(self, metodo: str, *args, **kwargs):
+        try:
+            return getattr(self.principal, metodo)(*args, **kwargs)
+        except Exception as e:
+            if not es_falla_disponibilidad(e):
+                raise
+            respaldo = _motor_respaldo()
+            if respaldo is None:
+                raise
+            emitir_json(logger, 'conteo_desde_respaldo', {'version': respaldo.inst.version, 'error': f'{type(e).__name__}: {e}'})
+            return getattr(respaldo, metodo)(*args, **kwargs)
+
+    def territorios(self) -> pd.DataFrame:
+        return self._resolver('territorios')
+
+    def precargar(self, consultas: list) -> None:
+        try:
+            self.principal.precargar(consultas)
+        except Exception as e:
+            # `MotorPandas` calcula cada conteo a medida que se pide: no hay nada que precargar
+            if not es_falla_disponibilidad(e) or _motor_respaldo() is None:
+                raise
+
+    def conteo(self, columnas, cod_mpio=None, cod_depto=None, filtro: str = None) -> pd.DataFrame:
+        return self._resolver('conteo', columnas, cod_mpio=cod_mpio, cod_depto=cod_depto, filtro=filtro)
+
+
+# Instantánea local que respalda al motor 'servidor': se abre la primera vez que el backend falla y se
+# vuelve a abrir si cambia la versión vigente
+_respaldo_servidor = None
+_lock_respaldo_servidor = threading.Lock()
+
+
+def _motor_respaldo():
+    global _respaldo_servidor
+    with _lock_respaldo_servidor:
+        try:
+            nueva = cargar_respaldo(_respaldo_servidor)
+        except FileNotFoundError:
+            return None
+        if nueva is not None:
+            _respaldo_servidor = nueva
+        return _respaldo_servidor.derivado('motor')
+
+
+@derivado('motor')
+def _motor(inst):
+    # El respaldo tiene el tejido en la instantánea local: no tiene sentido enviar los conteos al backend
+    if MOTOR == 'servidor':
+        return crear_motor(inst, 'pandas') if inst.respaldo else MotorConRespaldo(crear_motor(inst, MOTOR))
+    return crear_motor(inst, MOTOR)
+
+
+def motor(inst: Instantanea):
+    """Devuelve el motor de agregación configurado (MUNICIPIOS_MOTOR) para la instantánea."""
+    return inst.derivado('motor')
+
+
+def comparar_motores(referencia, candidato, consultas) -> list:
+    """
+    Compara los resultados de dos motores de agregación sobre una lista de consultas.
+
+    Args:
+        referencia: Motor de referencia (normalmente `MotorPandas`).
+        candidato: Motor a validar.
+        consultas (list): Diccionarios con los argumentos de `conteo` (columnas, cod_mpio, cod_depto, filtro).
+
+    Returns:
+        list: Descripción de cada diferencia encontrada; vacía si los motores coinciden.
+    """
+    diferencias = []
+    for consulta in consultas:
+        columnas = [consulta['columnas']] if isinstance(consulta['columnas'], str) else list(consulta['columnas'])
+        esperado = referencia.conteo(**consulta).sort_values(columnas).reset_index(drop=True)
+        obtenido = candidato.conteo(**consulta).sort_values(columnas).reset_index(drop=True)
+        try:
+            pd.testing.assert_frame_equal(esperado, obtenido, check_dtype=False, check_exact=False)
+        except AssertionError as e:
+            diferencias.append(f"{consulta}: {e}")
+    return diferencias
+
+
+def precargar_perfil(inst: Instantanea, cod_mpio=None, cod_depto=None) -> None:
+    """
+    Pide de una sola vez los conteos de todas las distribuciones del perfil de un municipio o un
+    departamento, si el motor lo permite (el motor 'servidor' los resuelve en un solo viaje al backend).
+    Los demás motores los calculan a medida que se piden.
+    """
+    motor_actual = motor(inst)
+    if not hasattr(motor_actual, 'precargar'):
+        return
+    motor_actual.precargar([{'columnas': argumentos['columnas'], 'filtro': argumentos.get('filtro'),
+                             'cod_mpio': cod_mpio, 'cod_depto': cod_depto}
+                            for argumentos in DISTRIBUCIONES_EMPRESAS.values()])
+
+
+# Series listas para graficar, por instantánea: se calculan una vez por versión de los datos
+MAXIMO_SERIES = 256
+_lock_series = threading.Lock()
+
+
+@derivado('series_barras')
+def _series_barras(inst):
+    return collections.OrderedDict()
+
+
+def formatear_miles(valores) -> pd.Series:
+    """Formatea un arreglo de números como enteros con separador de miles (1234567 -> '1,234,567')."""
+    enteros = pd.Series(np.char.mod('%.0f', np.asarray(valores, dtype=float)))
+    return enteros.str.replace(r'\B(?=(\d{3})+(?!\d))', ',', regex=True)
+
+
+def serie_barras(inst: Instantanea, columnas, columna_etiqueta: str = None, cod_mpio=None, cod_depto=None,
+                 filtro: str = None) -> dict:
+    """
+    Devuelve un conteo de empresas listo para un gráfico de barras horizontales.
+
+    Las categorías quedan ordenadas de menor a mayor número de empresas, y la participación y las
+    etiquetas ('1,234<br>12.3%') se calculan con operaciones vectorizadas. El resultado se guarda en la
+    instantánea, de modo que cada serie se calcula una sola vez por versión de los datos.
+
+    Args:
+        inst (Instantanea): Instantánea de la que se leen los datos.
+        columnas (str | list): Columna o columnas de categoría (ver `conteo` de los motores).
+        columna_etiqueta (str, optional): Columna que se muestra en el eje de categorías. Por defecto es
+                                          la primera de `columnas`.
+        cod_mpio, cod_depto, filtro (optional): Ámbito y subconjunto del conteo (ver `MotorPandas.conteo`).
+
+    Returns:
+        dict: 'columna' (columna_etiqueta), 'categorias', 'valores', 'participacion' (en porcentaje) y
+              'etiquetas' (arreglos en el orden del gráfico) y 'total' (número total de empresas).
+    """
+    columnas = [columnas] if isinstance(columnas, str) else list(columnas)
+    columna_etiqueta = columna_etiqueta or columnas[0]
+    clave = (tuple(columnas), columna_etiqueta, cod_mpio, cod_depto, filtro)
+    series = inst.derivado('series_barras')
+    with _lock_series:
+        if clave in series:
+            series.move_to_end(clave)
+            return series[clave]
+
+    motor_actual = motor(inst)
+    if hasattr(motor_actual, 'barras'):
+        # El motor ordena y calcula la participación sin pasar por pandas (motor 'polars')
+        categorias, valores, participacion = motor_actual.barras(columnas, columna_etiqueta, cod_mpio=cod_mpio,
+                                                                 cod_depto=cod_depto, filtro=filtro)
+        total = valores.sum()
+    else:
+        conteo = motor_actual.conteo(columnas, cod_mpio=cod_mpio, cod_depto=cod_depto, filtro=filtro)
+        conteo = conteo.sort_values('Número de empresas', kind='stable')
+        categorias = conteo[columna_etiqueta].to_numpy()
+        valores = conteo['Número de empresas'].to_numpy()
+        total = valores.sum()
+        participacion = valores / total * 100 if total else valores.astype(float)
+    serie = {
+        'columna': columna_etiqueta,
+        'categorias': categorias,
+        'valores': valores,
+        'participacion': participacion,
+        'etiquetas': (formatear_miles(valores) + '<br>' + pd.Series(np.char.mod('%.1f%%', participacion))).to_numpy(),
+        'total': total,
+    }
+
+    with _lock_series:
+        series[clave] = serie
+        if len(series) > MAXIMO_SERIES:
+            series.popitem(last=False)
+    return serie
@@ -1,54 +1,204 @@
-import plotly.graph_objs as go
-import pandas as pd
 import numpy as np
+import pandas as pd
 import streamlit as st
+import streamlit.components.v1 as components
 
 # import docx
 
-from snowflake_utils import sf_check_snowflake_connection, st_query_to_snowflake_and_return_dataframe
+from perf_utils import ejecucion, medido, medir, anotar, tamano_bytes
+import datos
+import geometria
 # from snowflake_config import sf_config
 
 def cargar_contraseñas(nombre_archivo):
     return st.secrets
 
-sf_config = st.secrets['snowflake'] # Carga las llaves secretas
+# Los dataframes se cargan una sola vez por proceso en `datos.py` y se comparten entre sesiones. Allí
+# también se refrescan cuando cambian las tablas en Snowflake.
+
+# Devolver los dataframes cargados. Esto es para llamarlos en el principal app.py
+def get_dataframes():
+    return datos.instantanea_actual().dataframes()
 
-# Cargar dataframes desde Snowflake. Como están en funciones, sólo se cargan una vez y optimiza el consumo. 
-# Si se dejan en el app.py cada vez que se consulta un departamento nuevo, se hace la conexión a Snowflake. 
-expected_types = {'Cod. Municipio': str}
-df_general = st_query_to_snowflake_and_return_dataframe("""
-    SELECT * FROM TABLA_BASE_MUNICIPIOS
-""", sf_config, expected_types=expected_types)
+# Fragmentos: un widget dentro de un fragmento sólo vuelve a ejecutar esa función y no toda la página.
+# En versiones de Streamlit sin fragmentos la función se ejecuta como parte de la página completa.
+fragmento = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda funcion: funcion)
+# `st.rerun(scope=...)` llegó junto con `st.fragment`; antes, `st.rerun()` siempre ejecutaba la página completa
+_RERUN_PAGINA = {'scope': 'app'} if hasattr(st, 'fragment') else {}
 
-expected_types = {'Cod. Depto':str,'Cod. Municipio':str, 'CIIU Rev 4 principal':str}
-df_base = st_query_to_snowflake_and_return_dataframe("""
-    SELECT * FROM TABLA_TEJIDO_MUNICIPIOS
-""", sf_config, expected_types=expected_types)
+def _elegir_resultado_busqueda(resultados, opciones):
+    # Se ejecuta antes que el fragmento, así que los selectores ya se muestran con el territorio elegido
+    eleccion = st.session_state.get('resultado_busqueda')
+    if eleccion in opciones:
+        resultado = resultados[opciones.index(eleccion)]
+        st.session_state['territorio'] = (resultado['departamento'], resultado['municipio'])
+        st.session_state['territorio_por_busqueda'] = True
 
-expected_types = {'Código .1':str}
-df_ubicacion = st_query_to_snowflake_and_return_dataframe("""
-    SELECT * FROM TABLA_DIVIPOLA_MUNICIPIOS
-""", sf_config, expected_types=expected_types)
+@fragmento
+@ejecucion('fragmento filtro_territorio')
+def filtro_territorio(departamentos, municipios_de, departamento_inicial, buscar=None):
+    """
+    Muestra el buscador y los selectores de departamento y municipio y guarda el territorio elegido en
+    `st.session_state['territorio']` como (departamento, municipio).
 
-# Devolver los dataframes cargados. Esto es para llamarlos en el principal app.py
-def get_dataframes():
-    return df_general, df_base, df_ubicacion
+    Es un fragmento: cambiar sólo el departamento actualiza la lista de municipios sin volver a dibujar la
+    página, que sigue mostrando el municipio anterior hasta que se elige uno nuevo. Elegir un municipio
+    vuelve a ejecutar la página completa.
+
+    Args:
+        departamentos (list): Departamentos disponibles.
+        municipios_de (callable): Devuelve la lista de municipios de un departamento.
+        departamento_inicial (str): Departamento seleccionado al abrir el tablero.
+        buscar (callable, optional): Recibe un texto y devuelve los municipios que coinciden (ver
+                                     `datos.buscar_municipios`). Si se indica, se muestra el buscador.
+    """
+    if buscar is not None:
+        consulta = st.text_input("Buscar municipio", placeholder="p. ej. cucuta, san andres")
+        if consulta:
+            resultados = [r for r in buscar(consulta) if r['departamento'] in departamentos]
+            if resultados:
+                opciones = [f"{r['municipio']} - {r['departamento']}" for r in resultados]
+                st.selectbox("Resultados", opciones, index=None, key='resultado_busqueda',
+                             placeholder=f"{len(opciones)} municipios encontrados",
+                             on_change=_elegir_resultado_busqueda, args=(resultados, opciones))
+            else:
+                st.caption("No se encontraron municipios")
+
+    aplicado = st.session_state.get('territorio')
+    depto_seleccionado = st.selectbox("Seleccione el departamento", departamentos,
+                                      index=departamentos.index(aplicado[0] if aplicado else departamento_inicial))
+    mpio = municipios_de(depto_seleccionado)
+    if aplicado is None:
+        indice = 0
+    elif aplicado[0] == depto_seleccionado and aplicado[1] in mpio:
+        indice = mpio.index(aplicado[1])
+    else:
+        indice = None
+    mpio_seleccionado = st.selectbox("Seleccione el municipio", mpio, index=indice, placeholder="Seleccione el municipio")
+
+    cambio = st.session_state.pop('territorio_por_busqueda', False)
+    if mpio_seleccionado is not None and (depto_seleccionado, mpio_seleccionado) != aplicado:
+        st.session_state['territorio'] = (depto_seleccionado, mpio_seleccionado)
+        cambio = True
+    # Durante la ejecución completa la página lee el territorio justo después; en una ejecución del
+    # fragmento hay que pedir la de la página
+    if cambio and not st.session_state.get('pagina_en_ejecucion'):
+        st.rerun(**_RERUN_PAGINA)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def html_mapa(latitud, longitud, etiqueta, cercanos=()):
+    """
+    Genera el HTML del mapa de Colombia con un marcador en el municipio y uno más pequeño en cada municipio
+    cercano. Se guarda en caché por municipio para no volver a construir el mapa de folium en cada ejecución.
+
+    Args:
+        cercanos (tuple): Tuplas (latitud, longitud, etiqueta) de los municipios cercanos.
+    """
+    # Importación diferida: folium es de los módulos que más tardan en importarse
+    import folium
+
+    colombia_center = [4.5709, -74.2973]
+    m = folium.Map(location=colombia_center, zoom_start=5)
+    folium.Marker(location=[latitud, longitud], popup=etiqueta).add_to(m)
+    for latitud_cercano, longitud_cercano, etiqueta_cercano in cercanos:
+        folium.CircleMarker(location=[latitud_cercano, longitud_cercano], radius=6, color='rgb(252, 0, 81)',
+                            fill=True, popup=etiqueta_cercano).add_to(m)
+    return folium.Figure().add_child(m).render()
+
+# Colores del mapa coroplético, del quintil más bajo al más alto, y de los municipios sin dato
+COLORES_COROPLETA = ['#ffffcc', '#a1dab4', '#41b6c4', '#2c7fb8', '#253494']
+COLOR_SIN_DATO = '#d9d9d9'
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def html_coropleta(version, indicador, nivel, cod_depto, _features, _valores):
+    """
+    Genera el HTML del mapa coroplético de un indicador. Se guarda en caché por versión de los datos,
+    indicador, nivel de zoom y departamento; la geometría y los valores (que no se usan como llave del
+    caché) los entrega `datos.coropleta`.
+    """
+    # Importación diferida: folium es de los módulos que más tardan en importarse
+    import folium
+    from branca.colormap import StepColormap
+
+    # Clases por quintiles: el color de cada municipio se calcula para todos a la vez
+    valores = _valores['Valor'].to_numpy(dtype=float)
+    con_dato = ~np.isnan(valores)
+    cortes = np.unique(np.nanquantile(valores, [0.2, 0.4, 0.6, 0.8])) if con_dato.any() else np.array([])
+    colores = np.where(con_dato, np.array(COLORES_COROPLETA)[np.digitize(valores, cortes)], COLOR_SIN_DATO)
+    colores = dict(zip(_valores['Cod. Municipio'], colores))
+    textos = ['Sin dato' if np.isnan(valor) else f'{valor:,.1f}' for valor in valores]
+    features = [{**feature, 'properties': {'municipio': municipio, 'valor': texto}}
+                for feature, municipio, texto in zip(_features, _valores['Municipio'], textos)]
+
+    def estilo(feature):
+        color = colores.get(feature['id'], COLOR_SIN_DATO)
+        return {'fillColor': color, 'color': color if feature['geometry']['type'] == 'Point' else '#555555',
+                'weight': 0.3, 'fillOpacity': 0.8}
+
+    etiqueta = datos.INDICADORES_MAPA[indicador]
+    m = folium.Map(location=[4.5709, -74.2973], zoom_start=geometria.NIVELES_ZOOM[nivel][2])
+    capa = folium.GeoJson({'type': 'FeatureCollection', 'features': features},
+                          style_function=estilo,
+                          marker=folium.CircleMarker(radius=5, fill=True),
+                          tooltip=folium.GeoJsonTooltip(fields=['municipio', 'valor'], aliases=['Municipio', etiqueta]))
+    capa.add_to(m)
+    if cod_depto is not None and features:
+        m.fit_bounds(capa.get_bounds())
+    if con_dato.any():
+        indice = [np.nanmin(valores), *cortes, np.nanmax(valores)]
+        StepColormap(COLORES_COROPLETA[:len(cortes) + 1], index=indice, vmin=indice[0], vmax=indice[-1],
+                     caption=etiqueta).add_to(m)
+    return folium.Figure().add_child(m).render()
+
+@fragmento
+@ejecucion('fragmento mapa_coropletico')
+def mapa_coropletico(instantanea, cod_depto):
+    """
+    Muestra el mapa de todos los municipios coloreados por el indicador elegido. Es un fragmento: cambiar
+    el indicador o el nivel de zoom sólo vuelve a dibujar este mapa.
+    """
+    c1, c2 = st.columns(2)
+    with c1:
+        indicador = st.selectbox('Indicador', list(datos.INDICADORES_MAPA), format_func=datos.INDICADORES_MAPA.get,
+                                 key='indicador_coropleta')
+    with c2:
+        nivel = st.radio('Nivel', list(geometria.NIVELES_ZOOM), format_func=str.capitalize, horizontal=True,
+                         key='nivel_coropleta')
+
+    with medir(f'mapa coroplético {nivel}'):
+        depto = cod_depto if nivel == 'departamental' else None
+        features, valores = datos.coropleta(instantanea, indicador, nivel, depto)
+        html = html_coropleta(instantanea.version, indicador, nivel, depto, features, valores)
+        components.html(html, width=1300, height=600)
+        anotar(filas=len(features), bytes=tamano_bytes(html))
+
+def mostrar_percentil(percentiles, columna, etiqueta=None):
+    """
+    Muestra debajo de una métrica el percentil del municipio en el país y en su departamento.
+
+    Args:
+        percentiles (pd.DataFrame): Resultado de `datos.percentiles_municipio`.
+        columna (str): Indicador de TABLA_BASE_MUNICIPIOS.
+        etiqueta (str, optional): Nombre del indicador, cuando la métrica agrupa varios.
+    """
+    if columna not in percentiles.index or percentiles.loc[columna].isna().any():
+        return
+    nacional, departamental = percentiles.loc[columna, ['nacional', 'departamental']]
+    prefijo = f'{etiqueta}: p' if etiqueta else 'P'
+    st.caption(f'{prefijo}ercentil {nacional:.0f} en el país · {departamental:.0f} en el departamento')
 
 def crear_metricas_pdet_zomac(df_datos_mun):
-    # Asegurarse de que se está trabajando con una copia del DataFrame para evitar advertencias
-    df_datos_mun = df_datos_mun.copy()
-    
-    # Usar .loc para asignaciones seguras
-    df_datos_mun.loc[:, 'PDET'] = 'Es territorio PDET'
-    df_datos_mun.loc[:, 'Subregión PDET'] = df_datos_mun['Subregión PDET'].str.title()
-    df_datos_mun.loc[:, 'Metrica PDET'] = np.where(df_datos_mun['Subregión PDET'].notna(), df_datos_mun['PDET'] + ' - Subregión ' + df_datos_mun['Subregión PDET'], 'No es territorio PDET')
-    df_datos_mun.loc[:, 'Metrica ZOMAC'] = np.where(df_datos_mun['ZOMAC'] == 1, 'Es territorio ZOMAC', 'No es territorio ZOMAC')
-    
-    return df_datos_mun['Metrica PDET'].values[0], df_datos_mun['Metrica ZOMAC'].values[0]
+    # El cálculo vive en `datos.py` para que también lo use el servicio de perfiles (`api.py`)
+    return datos.metricas_pdet_zomac(df_datos_mun)
+
+# Las figuras de plotly se guardan en caché por los datos que grafican, que para una versión de los datos y
+# un municipio son siempre los mismos: volver a ejecutar la página no vuelve a construirlas. Se usa
+# `cache_resource` porque `st.plotly_chart` no modifica la figura y así no se copia en cada ejecución.
+@st.cache_resource(max_entries=256, show_spinner=False)
+def figura_torta(etiquetas, valores, colores, texto_central):
+    # Importación diferida: plotly se carga con el primer gráfico y no al arrancar el proceso
+    import plotly.graph_objs as go
 
-def mostrar_grafico_torta_datos(df_datos_mun, titulo, etiquetas, valores, colores, texto_central):
-    st.subheader(titulo)
-    
     fig = go.Figure(data=[go.Pie(labels=etiquetas,
                                  values=valores,
                                  hole=0.5,
@@ -69,20 +219,47 @@ def mostrar_grafico_torta_datos(df_datos_mun, titulo, etiquetas, valores, colore
             'showarrow': False,
             'font': {'size': 20}
         }])
-    
+    return fig
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def figura_barras(categorias, valores, etiquetas, color_barras, titulo_grafico, height=None, width=None):
+    import plotly.graph_objs as go
+
+    fig = go.Figure([go.Bar(y=categorias,
+                            x=valores,
+                            text=etiquetas,
+                            hoverinfo='text',
+                            orientation='h',
+                            textangle=0,
+                            marker=dict(color=color_barras),
+                            textposition='outside')])
+    fig.update_layout(title=titulo_grafico, xaxis_title='Número de empresas', height=height, width=width, font=dict(size=16), xaxis=dict(tickfont=dict(size=16)), yaxis=dict(tickfont=dict(size=16)), title_font=dict(size=20))
+    return fig
+
+def _figura_serie(serie, color_barras, titulo_grafico, height=None, width=None):
+    # Tuplas de valores de Python: son la llave del caché de `figura_barras`
+    return figura_barras(tuple(serie['categorias'].tolist()), tuple(serie['valores'].tolist()),
+                         tuple(serie['etiquetas'].tolist()), color_barras, titulo_grafico, height, width)
+
+@medido(lambda df_datos_mun, titulo, etiquetas, *args: f'torta {titulo or etiquetas[0]}')
+def mostrar_grafico_torta_datos(df_datos_mun, titulo, etiquetas, valores, colores, texto_central):
+    st.subheader(titulo)
+
+    fig = figura_torta(tuple(etiquetas), tuple(float(valor) for valor in valores), tuple(colores), texto_central)
     st.plotly_chart(fig, use_container_width=True)
+    anotar(bytes=tamano_bytes(fig))
 
-def mostrar_empresas_por_categoria_unificada(df, columna_categoria, titulo_seccion, titulo_grafico, color_barras, df_filtrado=None, height=None):
+@medido(lambda serie, *args, **kwargs: f"barras {serie['columna']}")
+def mostrar_empresas_por_categoria_unificada(serie, titulo_seccion, titulo_grafico, color_barras, height=None):
     """
-    Muestra información sobre empresas categorizadas por una columna específica, con la opción de utilizar un DataFrame filtrado.
+    Muestra información sobre empresas categorizadas por una columna específica.
 
     Args:
-        df (pandas.DataFrame): DataFrame que contiene los datos de las empresas.
-        columna_categoria (str): Nombre de la columna que se utilizará para categorizar las empresas.
+        serie (dict): Conteo de empresas listo para graficar, con categorías, valores, etiquetas y total
+                      (ver `datos.serie_barras`).
         titulo_seccion (str): Título de la sección que se mostrará en Streamlit.
         titulo_grafico (str): Título del gráfico que se mostrará.
         color_barras (str): Color de las barras en el gráfico.
-        df_filtrado (pandas.DataFrame, optional): DataFrame filtrado que contiene las empresas de interés. Por defecto es None.
         height (int, optional): Altura del gráfico en píxeles. Por defecto es None.
 
     Returns:
@@ -90,74 +267,48 @@ def mostrar_empresas_por_categoria_unificada(df, columna_categoria, titulo_secci
     """
     st.subheader(titulo_seccion)
     
-    if df_filtrado is not None:
-        empresas_filtradas = df_filtrado
-    else:
-        empresas_filtradas = df
-    
-    if not empresas_filtradas['Cod. Municipio'].isnull().all():
+    if len(serie['valores']):
         c1, c2 = st.columns([20, 80])
 
         with c1:
-            conteo_empresas = pd.pivot_table(empresas_filtradas, index=columna_categoria, values='Número de empresas', aggfunc='sum').reset_index()
-            total_empresas = conteo_empresas['Número de empresas'].sum()
             st.markdown('##')
             st.markdown("##### **Cantidad total de empresas**")
-            st.subheader(f'{total_empresas:,.0f}')
+            st.subheader(f"{serie['total']:,.0f}")
 
         with c2:
-            conteo_empresas = conteo_empresas.sort_values(by='Número de empresas', ascending=True)
-            conteo_empresas['Participación'] = conteo_empresas['Número de empresas'] / conteo_empresas['Número de empresas'].sum() * 100
-            text_labels = [f"{num_empresas:,.0f}<br>{participacion:.1f}%"
-                           for num_empresas, participacion in zip(conteo_empresas['Número de empresas'], conteo_empresas['Participación'])]
-
-            fig = go.Figure([go.Bar(y=conteo_empresas[columna_categoria],
-                                    x=conteo_empresas['Número de empresas'],
-                                    text=text_labels,
-                                    hoverinfo='text',
-                                    orientation='h',
-                                    textangle=0,
-                                    marker=dict(color=color_barras),
-                                    textposition='outside')])
-            fig.update_layout(title=titulo_grafico, xaxis_title='Número de empresas', height=height, font=dict(size=16), xaxis=dict(tickfont=dict(size=16)), yaxis=dict(tickfont=dict(size=16)), title_font=dict(size=20))
+            fig = _figura_serie(serie, color_barras, titulo_grafico, height=height)
             st.plotly_chart(fig, use_container_width=True)
+            anotar(filas=len(serie['valores']), bytes=tamano_bytes(fig))
     else:
         st.markdown('##')
         st.markdown("##### **Cantidad total de empresas**")
         st.subheader(f'0')
 
-def mostrar_empresas_turismo(tejido):
+@medido('barras turismo')
+def mostrar_empresas_turismo(serie_turismo):
+    """
+    Muestra las empresas relacionadas con actividades de turismo.
+
+    Args:
+        serie_turismo (dict): Empresas de la cadena de turismo por 'Descripción CIIU principal', listas para
+                              graficar (ver `datos.serie_barras`).
+    """
     st.subheader('Empresas ubicadas en el territorio relacionadas con actividades de turismo')
-    turismo = tejido[tejido['Cadena productiva'] == "Turismo"]
 
-    if not turismo['Cod. Municipio'].isnull().all():
+    if len(serie_turismo['valores']):
         c1, c2 = st.columns([20, 80])
 
         with c1:
-            conteo_empresas6 = pd.pivot_table(turismo, index=['CIIU Rev 4 principal', 'Descripción CIIU principal'], values=['Número de empresas'], aggfunc='sum').reset_index()
-            total_tur = conteo_empresas6['Número de empresas'].sum()
             st.markdown('##')
             st.markdown("##### **Cantidad total de empresas**")
-            st.subheader(f'{total_tur:,.0f}')
+            st.subheader(f"{serie_turismo['total']:,.0f}")
 
         with c2:
-            conteo_empresas6 = conteo_empresas6.sort_values(by='Número de empresas', ascending=True)
-            conteo_empresas6['Participación'] = conteo_empresas6['Número de empresas'] / conteo_empresas6['Número de empresas'].sum() * 100
-            text_labels = [f"{num_empresas6:,.0f}<br>{participacion6:.1f}%"
-                           for num_empresas6, participacion6 in zip(conteo_empresas6['Número de empresas'], conteo_empresas6['Participación'])]
-
-            fig_tur = go.Figure([go.Bar(y=conteo_empresas6['Descripción CIIU principal'],
-                                        x=conteo_empresas6['Número de empresas'],
-                                        text=text_labels,
-                                        hoverinfo='text',
-                                        orientation='h',
-                                        textangle=0,
-                                        marker=dict(color='rgb(255, 218, 0)'),
-                                        textposition='outside')])
-            fig_tur.update_layout(title='Distribución según CIIU principal', xaxis_title='Número de empresas', height=700, width=800, font=dict(size=16), xaxis=dict(tickfont=dict(size=16)), yaxis=dict(tickfont=dict(size=16)), title_font=dict(size=20))
+            fig_tur = _figura_serie(serie_turismo, 'rgb(255, 218, 0)', 'Distribución según CIIU principal',
+                                    height=700, width=800)
             st.plotly_chart(fig_tur, use_container_width=True)
+            anotar(filas=len(serie_turismo['valores']), bytes=tamano_bytes(fig_tur))
     else:
         st.markdown('##')
         st.markdown("##### **Cantidad total de empresas**")
         st.subheader(f'0')    
-
@@ -0,0 +1,160 @@
+"""
+Geometría de los límites municipales para el mapa coroplético nacional.
+
+Los límites se leen de un archivo GeoJSON (MUNICIPIOS_GEOMETRIA, p. ej. el marco geoestadístico del DANE)
+en el que cada municipio tiene su código DIVIPOLA en la propiedad MUNICIPIOS_GEOMETRIA_CODIGO. Los
+polígonos a resolución completa pesan varios megabytes, así que se simplifican con Douglas-Peucker y se
+redondean sus coordenadas una sola vez por nivel de zoom, y se guardan como GeoJSON compacto: cada
+municipio queda sólo con su geometría y su código como `id`. Los valores de los indicadores no se guardan
+en la geometría; se unen por código al dibujar el mapa (ver `funciones.html_coropleta`).
+
+Si no hay archivo de límites, `datos.coropleta` usa en su lugar el derivado 'puntos_coropleta': un punto
+por municipio con las coordenadas de DIVIPOLA.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+from perf_utils import anotar, medir, registrar_cache, tamano_objeto
+
+RUTA_GEOMETRIA = os.environ.get('MUNICIPIOS_GEOMETRIA', 'geometria/municipios.geojson')
+PROPIEDAD_CODIGO = os.environ.get('MUNICIPIOS_GEOMETRIA_CODIGO', 'MPIO_CDPMP')
+
+# Niveles de zoom: nombre -> (tolerancia de simplificación en grados, decimales de las coordenadas, zoom inicial).
+# 0.01 grados son poco más de un kilómetro en Colombia
+NIVELES_ZOOM = {
+    'nacional': (0.02, 2, 5),
+    'departamental': (0.003, 3, 7),
+}
+
+# Geometrías simplificadas: (ruta, nivel) -> lista de features
+_simplificadas = {}
+_lock = threading.Lock()
+
+registrar_cache('geometría simplificada', lambda: (len(_simplificadas), tamano_objeto(_simplificadas)))
+
+
+def simplificar_linea(puntos: np.ndarray, tolerancia: float) -> np.ndarray:
+    """
+    Simplifica una línea o un anillo con el algoritmo de Douglas-Peucker.
+
+    Args:
+        puntos (np.ndarray): Arreglo (n, 2) de coordenadas (longitud, latitud).
+        tolerancia (float): Distancia máxima, en grados, entre la línea original y la simplificada.
+
+    Returns:
+        np.ndarray: Los puntos que se conservan, incluidos siempre el primero y el último.
+    """
+    if len(puntos) < 3:
+        return puntos
+    conservar = np.zeros(len(puntos), dtype=bool)
+    conservar[[0, -1]] = True
+    pendientes = [(0, len(puntos) - 1)]
+    while pendientes:
+        inicio, fin = pendientes.pop()
+        if fin - inicio < 2:
+            continue
+        segmento = puntos[fin] - puntos[inicio]
+        relativos = puntos[inicio + 1:fin] - puntos[inicio]
+        longitud = np.hypot(segmento[0], segmento[1])
+        if longitud == 0:
+            # Anillo cerrado: el primer y el último punto coinciden
+            distancias = np.hypot(relativos[:, 0], relativos[:, 1])
+        else:
+            distancias = np.abs(segmento[0] * relativos[:, 1] - segmento[1] * relativos[:, 0]) / longitud
+        mayor = int(np.argmax(distancias))
+        if distancias[mayor] > tolerancia:
+            medio = inicio + 1 + mayor
+            conservar[medio] = True
+            pendientes += [(inicio, medio), (medio, fin)]
+    return puntos[conservar]
+
+
+def _simplificar_anillo(anillo, tolerancia: float, decimales: int, exterior: bool):
+    puntos = np.asarray(anillo, dtype=float)[:, :2]
+    simplificado = np.round(simplificar_linea(puntos, tolerancia), decimales)
+    # El redondeo puede dejar puntos consecutivos repetidos
+    repetidos = np.r_[False, (np.diff(simplificado, axis=0) == 0).all(axis=1)]
+    simplificado = simplificado[~repetidos]
+    if len(simplificado) >= 4:
+        return simplificado.tolist()
+    if not exterior or len(puntos) < 4:
+        # Huecos e islas más pequeños que la tolerancia desaparecen
+        return None
+    # El contorno de un municipio pequeño se reduce a un triángulo para que no desaparezca del mapa
+    triangulo = puntos[np.linspace(0, len(puntos) - 1, 4).astype(int)]
+    return np.round(triangulo, max(decimales, 4)).tolist()
+
+
+def _area_anillo(anillo) -> float:
+    # Fórmula del área de Gauss (shoelace), en grados al cuadrado; sólo sirve para comparar anillos
+    puntos = np.asarray(anillo, dtype=float)[:, :2]
+    x, y = puntos[:, 0], puntos[:, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def simplificar_geometria(geometria: dict, tolerancia: float, decimales: int) -> dict:
+    """
+    Simplifica un Polygon o MultiPolygon de GeoJSON.
+
+    Si todos los polígonos de un MultiPolygon son menores que la tolerancia (un municipio de islas pequeñas),
+    se conserva el más grande reducido a un triángulo, igual que el contorno de un Polygon pequeño.
+
+    Returns:
+        dict: La geometría simplificada, o None si ningún contorno tiene los puntos para formar un triángulo.
+    """
+    poligonos = [geometria['coordinates']] if geometria['type'] == 'Polygon' else geometria['coordinates']
+    resultado = []
+    for poligono in poligonos:
+        exterior = _simplificar_anillo(poligono[0], tolerancia, decimales, exterior=len(poligonos) == 1)
+        if exterior is None:
+            continue
+        huecos = [_simplificar_anillo(hueco, tolerancia, decimales, exterior=False) for hueco in poligono[1:]]
+        resultado.append([exterior] + [hueco for hueco in huecos if hueco is not None])
+    if not resultado and len(poligonos) > 1:
+        mayor = max(poligonos, key=lambda poligono: _area_anillo(poligono[0]))
+        exterior = _simplificar_anillo(mayor[0], tolerancia, decimales, exterior=True)
+        if exterior is not None:
+            resultado.append([exterior])
+    if not resultado:
+        return None
+    if len(resultado) == 1:
+        return {'type': 'Polygon', 'coordinates': resultado[0]}
+    return {'type': 'MultiPolygon', 'coordinates': resultado}
+
+
+def features_simplificadas(nivel: str, ruta: str = RUTA_GEOMETRIA) -> list:
+    """
+    Devuelve los municipios del archivo de límites simplificados para un nivel de zoom, leyendo y
+    simplificando el archivo sólo la primera vez que se pide cada nivel.
+
+    Returns:
+        list: Features de GeoJSON con 'id' (Cod. Municipio) y 'geometry', o None si el archivo no existe.
+    """
+    clave = (ruta, nivel)
+    with _lock:
+        if clave in _simplificadas:
+            return _simplificadas[clave]
+        if not os.path.exists(ruta):
+            return None
+
+        tolerancia, decimales, _ = NIVELES_ZOOM[nivel]
+        with medir(f'geometría {nivel}'):
+            with open(ruta, encoding='utf-8') as archivo:
+                coleccion = json.load(archivo)
+            features = []
+            for feature in coleccion['features']:
+                geometria = simplificar_geometria(feature['geometry'], tolerancia, decimales)
+                if geometria is not None:
+                    codigo = str(feature['properties'][PROPIEDAD_CODIGO]).zfill(5)
+                    features.append({'type': 'Feature', 'id': codigo, 'geometry': geometria})
+            anotar(filas=len(features), bytes=len(geojson_compacto(features)))
+        _simplificadas[clave] = features
+        return features
+
+
+def geojson_compacto(features: list) -> str:
+    """Serializa una lista de features como FeatureCollection, sin espacios."""
+    return json.dumps({'type': 'FeatureCollection', 'features': features}, separators=(',', ':'))
@@ -0,0 +1,126 @@
+"""
+Motor de agregación con DuckDB embebido.
+
+Registra el tejido empresarial de la instantánea en una base DuckDB en memoria y resuelve los conteos de
+empresas y las listas de la barra lateral con SQL vectorizado. El DataFrame en memoria se registra sin
+copiarlo (DuckDB lo recorre directamente) y, si la instantánea es local, las particiones Parquet se leen
+directamente desde el disco. Sólo el resultado agregado, que es pequeño, se convierte a pandas. Los
+filtros por municipio comparan la clave entera (ver `claves.py`), no el código de texto.
+
+Se elige con MUNICIPIOS_MOTOR=duckdb. `MotorPandas` (en `datos.py`) es la implementación de referencia;
+`datos.comparar_motores` verifica que ambos den los mismos resultados (ver `benchmark.py --motor duckdb`).
+"""
+import os
+import threading
+
+import duckdb
+import pandas as pd
+
+from claves import CLAVE, SIN_CLAVE, clave_municipio
+from datos import FILTROS
+from perf_utils import anotar, medido
+
+
+def _identificador(nombre: str) -> str:
+    return '"' + nombre.replace('"', '""') + '"'
+
+
+class MotorDuckDB:
+    """
+    Motor de agregación que ejecuta los conteos del tejido en DuckDB.
+
+    Args:
+        inst (datos.Instantanea): Instantánea de la que se leen los datos.
+    """
+    nombre = 'duckdb'
+
+    def __init__(self, inst):
+        self.inst = inst
+        self._con = duckdb.connect(':memory:')
+        # Una conexión de DuckDB no admite consultas concurrentes desde varios hilos
+        self._lock = threading.Lock()
+        self._listas = {}
+
+        if inst.particiones is not None:
+            ruta = os.path.join(inst.manifiesto['ruta'], 'tejido', '*.parquet').replace("'", "''")
+            seleccion = '*'
+            if CLAVE not in inst.manifiesto['columnas_tejido']:
+                # Las instantáneas anteriores a la clave entera no la guardan en las particiones
+                seleccion = f'*, COALESCE(TRY_CAST("Cod. Municipio" AS INTEGER), {SIN_CLAVE}) AS {_identificador(CLAVE)}'
+            self._con.execute(f"CREATE VIEW tejido AS SELECT {seleccion} FROM read_parquet('{ruta}', union_by_name = true)")
+        else:
+            self._con.register('tejido', inst.df_base)
+
+    def _consultar(self, sql: str, parametros: list = None) -> pd.DataFrame:
+        with self._lock:
+            return self._con.execute(sql, parametros or []).df()
+
+    def departamentos(self) -> list:
+        if 'departamentos' not in self._listas:
+            df = self._consultar("""
+                SELECT DISTINCT "Departamento" FROM tejido
+                WHERE "Departamento" IS NOT NULL AND "Municipio" IS NOT NULL AND "Departamento" <> 'No determinado'
+                ORDER BY 1
+            """)
+            self._listas['departamentos'] = df['Departamento'].tolist()
+        return self._listas['departamentos']
+
+    def municipios(self, departamento: str) -> list:
+        clave = ('municipios', departamento)
+        if clave not in self._listas:
+            df = self._consultar("""
+                SELECT DISTINCT "Municipio" FROM tejido
+                WHERE "Departamento" = ? AND "Municipio" IS NOT NULL
+                ORDER BY 1
+            """, [departamento])
+            self._listas[clave] = df['Municipio'].tolist()
+        return self._listas[clave]
+
+    def codigo_municipio(self, departamento: str, municipio: str):
+        df = self._consultar("""
+            SELECT "Cod. Municipio" FROM tejido WHERE "Departamento" = ? AND "Municipio" = ? LIMIT 1
+        """, [departamento, municipio])
+        return df['Cod. Municipio'].iloc[0]
+
+    @medido(lambda self, columnas, *args, **kwargs: f'conteo {columnas}')
+    def conteo(self, columnas, cod_mpio=None, cod_depto=None, filtro: str = None) -> pd.DataFrame:
+        """
+        Suma el 'Número de empresas' por categoría en un municipio, un departamento o todo el país.
+
+        Devuelve lo mismo que `datos.MotorPandas.conteo`.
+        """
+        columnas = [columnas] if isinstance(columnas, str) else list(columnas)
+        if cod_mpio is not None and clave_municipio(cod_mpio) == SIN_CLAVE:
+            # Un código inválido no corresponde a ningún municipio (ni a las filas sin código)
+            return pd.DataFrame(columns=columnas + ['Número de empresas'])
+        seleccion = ', '.join(_identificador(columna) for columna in columnas)
+        condiciones = [f'{_identificador(columna)} IS NOT NULL' for columna in columnas]
+        parametros = []
+        if cod_mpio is not None:
+            condiciones.append(f'{_identificador(CLAVE)} = ?')
+            parametros.append(clave_municipio(cod_mpio))
+        if cod_depto is not None:
+            condiciones.append('"Cod. Depto" = ?')
+            parametros.append(cod_depto)
+        if filtro is not None:
+            columna, operador, valor = FILTROS[filtro]
+            # IS DISTINCT FROM conserva los nulos, igual que la comparación '!=' de pandas
+            comparacion = 'IS DISTINCT FROM' if operador == '!=' else '='
+            condiciones.append(f'{_identificador(columna)} {comparacion} ?')
+            parametros.append(valor)
+
+        conteo = self._consultar(f"""
+            SELECT {seleccion}, SUM("Número de empresas") AS "Número de empresas"
+            FROM tejido
+            WHERE {' AND '.join(condiciones)}
+            GROUP BY {seleccion}
+            ORDER BY {seleccion}
+        """, parametros)
+        anotar(filas=len(conteo))
+        return conteo
+
+    def medir_memoria(self) -> tuple:
+        """Devuelve (listas en caché, bytes usados por la base DuckDB)."""
+        with self._lock:
+            uso = self._con.execute("SELECT SUM(memory_usage_bytes) FROM duckdb_memory()").fetchone()[0]
+        return len(self._listas), int(uso or 0)
@@ -0,0 +1,157 @@
+"""
+Motor de agregación con Polars.
+
+Convierte el tejido empresarial de la instantánea a un DataFrame de Polars (memoria Arrow) una sola vez,
+compactando las columnas de texto como categóricas, y resuelve los conteos de empresas con consultas
+perezosas que Polars ejecuta en paralelo. Si la instantánea es local, las particiones Parquet se leen con
+`scan_parquet`, limitadas a la del departamento consultado cuando se conoce. Sólo el resultado agregado,
+que es pequeño, se convierte a pandas; las series de los gráficos de barras (`barras`) se ordenan y
+calculan su participación en Polars y se convierten una sola vez, directo a NumPy. Los filtros por
+municipio comparan la clave entera (ver `claves.py`).
+
+Se elige con MUNICIPIOS_MOTOR=polars. `MotorPandas` (en `datos.py`) es la implementación de referencia;
+`benchmark.py --motor polars` verifica que ambos den los mismos resultados.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from claves import CLAVE, SIN_CLAVE, clave_municipio
+from datos import FILTROS
+from perf_utils import anotar, medido
+
+# Columnas de códigos: se dejan como texto para comparar con los valores que llegan de la barra lateral
+COLUMNAS_CODIGO = ('Cod. Depto', 'Cod. Municipio', 'CIIU Rev 4 principal')
+
+
+def compactar(df: pl.DataFrame) -> pl.DataFrame:
+    """Convierte a categóricas las columnas de texto que no son códigos, que se repiten mucho en el tejido."""
+    return df.with_columns(
+        pl.col(columna).cast(pl.Categorical)
+        for columna, tipo in df.schema.items()
+        if tipo == pl.String and columna not in COLUMNAS_CODIGO
+    )
+
+
+class MotorPolars:
+    """
+    Motor de agregación que ejecuta los conteos del tejido con Polars.
+
+    Args:
+        inst (datos.Instantanea): Instantánea de la que se leen los datos.
+    """
+    nombre = 'polars'
+
+    def __init__(self, inst):
+        self.inst = inst
+        self._tejido = None
+        if inst.particiones is None:
+            self._tejido = compactar(pl.from_pandas(inst.df_base))
+
+    def departamentos(self) -> list:
+        return self.inst.derivado('indice_territorial')['departamentos']
+
+    def municipios(self, departamento: str) -> list:
+        return self.inst.derivado('indice_territorial')['municipios'].get(departamento, [])
+
+    def codigo_municipio(self, departamento: str, municipio: str):
+        return self.inst.derivado('indice_territorial')['codigos'][departamento][municipio]
+
+    def _consulta(self, cod_mpio=None, cod_depto=None) -> pl.LazyFrame:
+        if self._tejido is not None:
+            return self._tejido.lazy()
+
+        # Instantánea local: sólo se leen las particiones del departamento consultado
+        particiones = self.inst.particiones
+        if cod_mpio is not None:
+            cod_depto = particiones.departamento_de(cod_mpio)
+        claves = list(particiones.manifiesto['particiones']) if cod_depto is None else [cod_depto]
+        archivos = [os.path.join(particiones.manifiesto['ruta'], particiones.manifiesto['particiones'][clave]['archivo'])
+                    for clave in claves if clave in particiones.manifiesto['particiones']]
+        if not archivos:
+            return None
+        consulta = pl.scan_parquet(archivos)
+        if CLAVE not in particiones.manifiesto['columnas_tejido']:
+            # Las instantáneas anteriores a la clave entera no la guardan en las particiones
+            consulta = consulta.with_columns(
+                pl.col('Cod. Municipio').cast(pl.Int32, strict=False).fill_null(SIN_CLAVE).alias(CLAVE))
+        return consulta
+
+    @medido(lambda self, columnas, *args, **kwargs: f'conteo {columnas}')
+    def conteo(self, columnas, cod_mpio=None, cod_depto=None, filtro: str = None) -> pd.DataFrame:
+        """
+        Suma el 'Número de empresas' por categoría en un municipio, un departamento o todo el país.
+
+        Devuelve lo mismo que `datos.MotorPandas.conteo`.
+        """
+        columnas = [columnas] if isinstance(columnas, str) else list(columnas)
+        vacio = pd.DataFrame(columns=columnas + ['Número de empresas'])
+        consulta = self._agregacion(columnas, cod_mpio, cod_depto, filtro)
+        if consulta is None:
+            return vacio
+        conteo = consulta.collect()
+        anotar(filas=conteo.height)
+        return conteo.to_pandas() if conteo.height else vacio
+
+    @medido(lambda self, columnas, columna_etiqueta, *args, **kwargs: f'barras {columnas}')
+    def barras(self, columnas, columna_etiqueta: str, cod_mpio=None, cod_depto=None,
+               filtro: str = None) -> tuple:
+        """
+        Calcula en Polars la serie de un gráfico de barras (ver `datos.serie_barras`): ordena el conteo de
+        menor a mayor número de empresas y calcula la participación en porcentaje.
+
+        Returns:
+            tuple: Arreglos de NumPy (categorías, valores, participación), en el orden del gráfico. Es la
+                   única conversión del resultado: no pasa por pandas.
+        """
+        columnas = [columnas] if isinstance(columnas, str) else list(columnas)
+        consulta = self._agregacion(columnas, cod_mpio, cod_depto, filtro)
+        if consulta is None:
+            return np.array([], dtype=object), np.array([], dtype=np.int64), np.array([], dtype=float)
+        serie = (consulta
+                 # Orden estable: los empates quedan en el orden de las categorías, como en pandas
+                 .sort('Número de empresas', maintain_order=True)
+                 .select(pl.col(columna_etiqueta),
+                         pl.col('Número de empresas').cast(pl.Int64),
+                         # Sin empresas, la división da NaN; la participación queda en cero
+                         (pl.col('Número de empresas') / pl.col('Número de empresas').sum() * 100)
+                         .fill_nan(0.0).alias('participacion'))
+                 .collect())
+        anotar(filas=serie.height)
+        return (serie[columna_etiqueta].to_numpy().astype(object), serie['Número de empresas'].to_numpy(),
+                serie['participacion'].to_numpy())
+
+    def _agregacion(self, columnas: list, cod_mpio=None, cod_depto=None, filtro: str = None) -> pl.LazyFrame:
+        # Consulta perezosa del conteo, ordenada por categorías; None si el ámbito no tiene filas
+        if cod_mpio is not None and clave_municipio(cod_mpio) == SIN_CLAVE:
+            # Un código inválido no corresponde a ningún municipio (ni a las filas sin código)
+            return None
+        consulta = self._consulta(cod_mpio, cod_depto)
+        if consulta is None:
+            return None
+
+        condiciones = [pl.col(columna).is_not_null() for columna in columnas]
+        if cod_mpio is not None:
+            condiciones.append(pl.col(CLAVE) == clave_municipio(cod_mpio))
+        if cod_depto is not None:
+            condiciones.append(pl.col('Cod. Depto') == cod_depto)
+        if filtro is not None:
+            columna, operador, valor = FILTROS[filtro]
+            # ne_missing conserva los nulos, igual que la comparación '!=' de pandas
+            condiciones.append(pl.col(columna).ne_missing(valor) if operador == '!=' else pl.col(columna) == valor)
+
+        return (consulta
+                .filter(*condiciones)
+                .group_by(columnas)
+                .agg(pl.col('Número de empresas').sum())
+                # Las categóricas vuelven a texto, como en pandas; la clave sigue siendo entera
+                .with_columns(pl.col(pl.Categorical).cast(pl.String))
+                .sort(columnas))
+
+    def medir_memoria(self) -> tuple:
+        """Devuelve (tablas en memoria, bytes del tejido compactado)."""
+        if self._tejido is None:
+            return 0, 0
+        return 1, self._tejido.estimated_size()
@@ -0,0 +1,208 @@
+"""
+Motor de agregación que resuelve los conteos en el backend.
+
+En lugar de descargar TABLA_TEJIDO_MUNICIPIOS completa, cada conteo es una consulta parametrizada
+    SELECT <categorías>, SUM("Número de empresas") FROM TABLA_TEJIDO_MUNICIPIOS
+    WHERE "Cod. Municipio" = ? ... GROUP BY <categorías>
+que Snowflake (o el backend local) ejecuta y de la que sólo viaja el resultado, de unas pocas filas. Los
+conteos de un perfil se piden juntos con `precargar`, que los une en una sola consulta UNION ALL: un solo
+viaje al servidor por municipio. Los resultados se guardan en un caché LRU del motor, que vive en la
+instantánea y se descarta con ella cuando cambian los datos; con el caché en disco activado (ver
+`cache_consultas.py`) los comparten además los procesos y sobreviven a los reinicios.
+
+La tabla del backend no tiene la clave entera de los municipios (ver `claves.py`): agrupar por 'Clave
+municipio' se traduce a `COALESCE(TRY_CAST("Cod. Municipio" AS INTEGER), -1)` en Snowflake y a una
+expresión equivalente en SQLite, que no tiene TRY_CAST y convierte los textos no numéricos en 0. En ambos
+las filas sin código o con un código no numérico (p. ej. 'No determinado') quedan en `SIN_CLAVE`, como en
+memoria. El filtro por municipio sigue comparando el código de texto, que es la columna por la que está
+organizada la tabla.
+
+Se elige con MUNICIPIOS_MOTOR=servidor; en ese caso la capa de datos no descarga el tejido (ver
+`datos.tablas_en_memoria`). `benchmark.py --motor servidor` verifica que dé los mismos resultados que
+`MotorPandas`.
+"""
+import collections
+import threading
+
+import pandas as pd
+
+from claves import CLAVE, SIN_CLAVE, clave_municipio, texto_clave
+from datos import FILTROS, cargar_sf_config
+from perf_utils import anotar, medido, tamano_objeto
+from snowflake_utils import nombre_backend, st_query_to_snowflake_and_return_dataframe
+
+TABLA_TEJIDO = 'TABLA_TEJIDO_MUNICIPIOS'
+
+# Conteos guardados por motor, es decir, por versión de los datos
+MAXIMO_CONTEOS = 2048
+
+
+def _identificador(columna: str) -> str:
+    return '"' + columna.replace('"', '""') + '"'
+
+
+def _expresion(columna: str, dialecto: str = 'snowflake') -> str:
+    # Columnas calculadas en el servidor porque no existen en la tabla del backend
+    if columna != CLAVE:
+        return _identificador(columna)
+    codigo = _identificador('Cod. Municipio')
+    if dialecto == 'local':
+        # SQLite: sólo los códigos formados por dígitos se convierten; los demás y los nulos van a SIN_CLAVE
+        return (f"CASE WHEN {codigo} GLOB '[0-9]*' AND {codigo} NOT GLOB '*[^0-9]*' "
+                f"THEN CAST({codigo} AS INTEGER) ELSE {SIN_CLAVE} END")
+    return f'COALESCE(TRY_CAST({codigo} AS INTEGER), {SIN_CLAVE})'
+
+
+def _clave(columnas, cod_mpio=None, cod_depto=None, filtro=None) -> tuple:
+    columnas = (columnas,) if isinstance(columnas, str) else tuple(columnas)
+    return columnas, cod_mpio, cod_depto, filtro
+
+
+def consulta_conteo(columnas: tuple, cod_mpio=None, cod_depto=None, filtro: str = None, ancho: int = None,
+                    dialecto: str = 'snowflake') -> tuple:
+    """
+    Arma la consulta SQL parametrizada de un conteo.
+
+    Args:
+        columnas (tuple): Columnas de categoría.
+        ancho (int, optional): Número de columnas de categoría del resultado; las que sobran se rellenan con
+                               NULL para poder unir consultas de distinto número de columnas con UNION ALL.
+        dialecto (str, optional): Backend que ejecuta la consulta ('snowflake' o 'local', es decir, SQLite).
+
+    Returns:
+        tuple: (SQL con marcadores `?`, lista de parámetros). Las categorías salen como C0, C1, ... y la
+               suma como N.
+    """
+    ancho = len(columnas) if ancho is None else ancho
+    seleccion = [f'{_expresion(columna, dialecto)} AS C{i}' for i, columna in enumerate(columnas)]
+    seleccion += [f'NULL AS C{i}' for i in range(len(columnas), ancho)]
+    condiciones = [f'{_expresion(columna, dialecto)} IS NOT NULL' for columna in columnas]
+    parametros = []
+    if cod_mpio is not None:
+        clave = clave_municipio(cod_mpio)
+        if clave == SIN_CLAVE:
+            # Un código inválido no corresponde a ningún municipio (ni a las filas sin código)
+            condiciones.append('1 = 0')
+        else:
+            condiciones.append(f'{_identificador("Cod. Municipio")} = ?')
+            parametros.append(texto_clave(clave))
+    if cod_depto is not None:
+        condiciones.append(f'{_identificador("Cod. Depto")} = ?')
+        parametros.append(cod_depto)
+    if filtro is not None:
+        columna, operador, valor = FILTROS[filtro]
+        # Igual que en pandas, '!=' conserva los nulos
+        if operador == '!=':
+            condiciones.append(f'({_identificador(columna)} <> ? OR {_identificador(columna)} IS NULL)')
+        else:
+            condiciones.append(f'{_identificador(columna)} = ?')
+        parametros.append(valor)
+    agrupacion = ', '.join(_expresion(columna, dialecto) for columna in columnas)
+    sql = (f'SELECT {", ".join(seleccion)}, SUM({_identificador("Número de empresas")}) AS N '
+           f'FROM {TABLA_TEJIDO} WHERE {" AND ".join(condiciones)} GROUP BY {agrupacion}')
+    return sql, parametros
+
+
+class MotorServidor:
+    """
+    Motor de agregación que envía los conteos al backend configurado.
+
+    Args:
+        inst (datos.Instantanea): Instantánea de la que se leen el índice territorial y la versión.
+        sf_config (dict, optional): Configuración de conexión. Por defecto se lee de `st.secrets`.
+    """
+    nombre = 'servidor'
+
+    def __init__(self, inst, sf_config: dict = None):
+        self.inst = inst
+        self.sf_config = cargar_sf_config() if sf_config is None else sf_config
+        # Marcador de cambio del tejido: los resultados del caché en disco de otra versión no se reutilizan
+        self._marcador = inst.marcadores.get(TABLA_TEJIDO)
+        self._dialecto = nombre_backend(self.sf_config)
+        self._conteos = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def departamentos(self) -> list:
+        return self.inst.derivado('indice_territorial')['departamentos']
+
+    def municipios(self, departamento: str) -> list:
+        return self.inst.derivado('indice_territorial')['municipios'].get(departamento, [])
+
+    def codigo_municipio(self, departamento: str, municipio: str):
+        return self.inst.derivado('indice_territorial')['codigos'][departamento][municipio]
+
+    def territorios(self) -> pd.DataFrame:
+        """Devuelve las combinaciones distintas de departamento, municipio y código del tejido."""
+        columnas = ', '.join(_identificador(columna) for columna in ('Departamento', 'Municipio', 'Cod. Municipio'))
+        return st_query_to_snowflake_and_return_dataframe(f'SELECT DISTINCT {columnas} FROM {TABLA_TEJIDO}', self.sf_config,
+                                                          expected_types={'Cod. Municipio': str}, marcador=self._marcador)
+
+    def _guardar(self, clave: tuple, conteo: pd.DataFrame) -> None:
+        with self._lock:
+            self._conteos[clave] = conteo
+            self._conteos.move_to_end(clave)
+            while len(self._conteos) > MAXIMO_CONTEOS:
+                self._conteos.popitem(last=False)
+
+    def _resultado(self, columnas: tuple, filas: pd.DataFrame) -> pd.DataFrame:
+        # Nombres originales, tipos del tejido y el mismo orden que `MotorPandas`
+        conteo = pd.DataFrame({columna: filas[f'C{i}'].astype('int32' if columna == CLAVE else str)
+                               for i, columna in enumerate(columnas)})
+        conteo['Número de empresas'] = pd.to_numeric(filas['N']).astype('int64')
+        return conteo.sort_values(list(columnas)).reset_index(drop=True)
+
+    @medido(lambda self, consultas: f'precarga servidor ({len(consultas)} conteos)')
+    def precargar(self, consultas: list) -> None:
+        """
+        Resuelve en un solo viaje al servidor los conteos que aún no están en el caché.
+
+        Args:
+            consultas (list): Diccionarios con los argumentos de `conteo`.
+        """
+        with self._lock:
+            pendientes = list(dict.fromkeys(clave for clave in (_clave(**consulta) for consulta in consultas)
+                                            if clave not in self._conteos))
+        if not pendientes:
+            return
+
+        ancho = max(len(clave[0]) for clave in pendientes)
+        partes, parametros = [], []
+        for i, (columnas, cod_mpio, cod_depto, filtro) in enumerate(pendientes):
+            sql, valores = consulta_conteo(columnas, cod_mpio, cod_depto, filtro, ancho, self._dialecto)
+            partes.append(f'SELECT {i} AS CONSULTA, T.* FROM ({sql}) T')
+            parametros += valores
+        filas = st_query_to_snowflake_and_return_dataframe(' UNION ALL '.join(partes), self.sf_config, parametros=parametros,
+                                                           marcador=self._marcador)
+        anotar(filas=len(filas))
+
+        grupos = dict(tuple(filas.groupby('CONSULTA')))
+        for i, clave in enumerate(pendientes):
+            columnas = clave[0]
+            grupo = grupos.get(i, filas.iloc[0:0])
+            self._guardar(clave, self._resultado(columnas, grupo))
+
+    @medido(lambda self, columnas, *args, **kwargs: f'conteo {columnas}')
+    def conteo(self, columnas, cod_mpio=None, cod_depto=None, filtro: str = None) -> pd.DataFrame:
+        """
+        Suma el 'Número de empresas' por categoría en un municipio, un departamento o todo el país.
+
+        Devuelve lo mismo que `datos.MotorPandas.conteo`.
+        """
+        clave = _clave(columnas, cod_mpio, cod_depto, filtro)
+        with self._lock:
+            conteo = self._conteos.get(clave)
+            if conteo is not None:
+                self._conteos.move_to_end(clave)
+        if conteo is None:
+            sql, parametros = consulta_conteo(*clave, dialecto=self._dialecto)
+            filas = st_query_to_snowflake_and_return_dataframe(sql, self.sf_config, parametros=parametros, marcador=self._marcador)
+            conteo = self._resultado(clave[0], filas)
+            self._guardar(clave, conteo)
+        anotar(filas=len(conteo))
+        return conteo
+
+    def medir_memoria(self) -> tuple:
+        """Devuelve (conteos en caché, bytes)."""
+        with self._lock:
+            conteos = dict(self._conteos)
+        return len(conteos), tamano_objeto(conteos)
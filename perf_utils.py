@@ -0,0 +1,357 @@
+"""
+Instrumentación de tiempos del tablero.
+
+Cada etapa del camino crítico (cargas de tablas, filtros, gráficos, mapa) se mide con `medir`, que
+registra el tiempo, las filas procesadas y el tamaño del contenido generado. Los tramos medidos durante
+una ejecución del script de Streamlit se agrupan entre `iniciar_rerun` y `finalizar_rerun`; los que
+ocurren fuera de una ejecución (p. ej. la carga inicial de tablas al importar `funciones.py` o los
+refrescos en segundo plano) se guardan aparte como tramos de carga, de los que sólo se conservan los
+últimos `MAXIMO_TRAMOS_CARGA`. Los fragmentos de Streamlit, que se vuelven a ejecutar sin la página, abren
+su propia ejecución con el decorador `ejecucion`.
+
+Los resultados se emiten como líneas JSON en el logger 'municipios.rendimiento' y se pueden ver en el
+panel "Rendimiento" de la barra lateral, que se habilita con el parámetro `?perf=1` en la URL o con la
+variable de entorno MUNICIPIOS_PERF=1.
+
+El mismo panel incluye un reporte de memoria (`reporte_memoria`) con el uso de cada DataFrame cargado,
+el tamaño de los cachés registrados con `registrar_cache` y la memoria residente del proceso. Si se
+define MUNICIPIOS_PRESUPUESTO_MEMORIA_MB, el reporte advierte cuando el proceso lo supera.
+"""
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+
+def obtener_logger_json(nombre: str) -> logging.Logger:
+    """
+    Devuelve un logger que escribe cada mensaje tal cual en una línea, para registros JSON estructurados.
+
+    Streamlit no configura el logger raíz, así que se agrega un manejador propio para que las líneas se vean.
+    """
+    log = logging.getLogger(nombre)
+    if not log.handlers:
+        manejador = logging.StreamHandler()
+        manejador.setFormatter(logging.Formatter('%(message)s'))
+        log.addHandler(manejador)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+    return log
+
+
+logger = obtener_logger_json('municipios.rendimiento')
+
+# Tramos de la ejecución en curso, uno por hilo de Streamlit
+_local = threading.local()
+
+# Tramos medidos fuera de una ejecución del script (cargas al importar módulos, hilos en segundo plano);
+# sólo se conservan los más recientes
+MAXIMO_TRAMOS_CARGA = 500
+_tramos_carga = collections.deque(maxlen=MAXIMO_TRAMOS_CARGA)
+_lock = threading.Lock()
+
+# Cachés que aparecen en el reporte de memoria: nombre -> función que devuelve (entradas, bytes)
+_caches = {}
+
+
+def emitir_json(log, evento: str, datos: dict, nivel: int = logging.INFO) -> None:
+    """Emite un registro estructurado como una línea JSON en el logger indicado."""
+    if log.isEnabledFor(nivel):
+        log.log(nivel, json.dumps({'evento': evento, **datos}, ensure_ascii=False, default=str))
+
+
+def habilitado() -> bool:
+    """
+    Indica si el panel de rendimiento está habilitado, por variable de entorno MUNICIPIOS_PERF o por el
+    parámetro `perf` en la URL.
+    """
+    if os.environ.get('MUNICIPIOS_PERF', '').lower() in ('1', 'true', 'si'):
+        return True
+    try:
+        import streamlit as st
+        return st.query_params.get('perf', '') in ('1', 'true', 'si')
+    except Exception:
+        # Fuera de una ejecución de Streamlit no hay parámetros de URL
+        return False
+
+
+def tamano_bytes(obj) -> int:
+    """
+    Devuelve el tamaño aproximado en bytes de un DataFrame, una figura de Plotly o un texto.
+
+    Para las figuras se mide el JSON que se envía al navegador, lo que implica serializarlas; por eso
+    sólo se calcula cuando el panel de rendimiento está habilitado. En otro caso devuelve None.
+    """
+    if hasattr(obj, 'memory_usage'):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, str):
+        return len(obj.encode('utf-8'))
+    if not habilitado():
+        return None
+    if hasattr(obj, 'to_json'):
+        return len(obj.to_json().encode('utf-8'))
+    return None
+
+
+def iniciar_rerun() -> None:
+    """Marca el inicio de una ejecución del script; los tramos siguientes del hilo se asocian a ella."""
+    _local.tramos = []
+    _local.inicio = time.perf_counter()
+
+
+def _tramos_abiertos() -> list:
+    if not hasattr(_local, 'abiertos'):
+        _local.abiertos = []
+    return _local.abiertos
+
+
+@contextlib.contextmanager
+def medir(nombre: str, **datos):
+    """
+    Mide el tiempo de un bloque de código y lo registra como un tramo con nombre.
+
+    El diccionario que entrega el contexto se puede completar con 'filas' y 'bytes' dentro del bloque.
+
+    Ejemplo:
+        with medir('filtro municipio') as tramo:
+            tejido = df_base[filtro]
+            tramo['filas'] = len(tejido)
+    """
+    tramo = {'nombre': nombre, **datos}
+    abiertos = _tramos_abiertos()
+    abiertos.append(tramo)
+    inicio = time.perf_counter()
+    try:
+        yield tramo
+    finally:
+        tramo['ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+        abiertos.pop()
+        tramos = getattr(_local, 'tramos', None)
+        if tramos is None:
+            with _lock:
+                _tramos_carga.append(tramo)
+            emitir_json(logger, 'carga', tramo)
+        else:
+            tramos.append(tramo)
+
+
+def medido(nombre):
+    """
+    Decorador que mide cada llamada a la función como un tramo.
+
+    Args:
+        nombre (str | callable): Nombre del tramo, o función que recibe los mismos argumentos que la
+                                 función decorada y devuelve el nombre.
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            nombre_tramo = nombre(*args, **kwargs) if callable(nombre) else nombre
+            with medir(nombre_tramo):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def ejecucion(nombre: str):
+    """
+    Decorador para las funciones que Streamlit puede volver a ejecutar sin la página (fragmentos).
+
+    Si la función corre dentro de la ejecución de la página, sus tramos se suman a ella; si corre sola,
+    abre una ejecución propia con `iniciar_rerun` y la cierra con `finalizar_rerun`, en lugar de registrar
+    sus tramos como tramos de carga.
+
+    Args:
+        nombre (str): Nombre con el que se emite el resumen de la ejecución propia.
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if getattr(_local, 'tramos', None) is not None:
+                return funcion(*args, **kwargs)
+            iniciar_rerun()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                finalizar_rerun(nombre)
+        return envoltura
+    return decorador
+
+
+def anotar(**datos) -> None:
+    """Agrega datos (p. ej. filas o bytes) al tramo abierto más interno del hilo actual, si lo hay."""
+    abiertos = _tramos_abiertos()
+    if abiertos:
+        abiertos[-1].update(datos)
+
+
+def finalizar_rerun(nombre: str = None) -> dict:
+    """
+    Cierra la ejecución en curso, emite su resumen como línea JSON y lo devuelve.
+
+    Args:
+        nombre (str, optional): Nombre de la ejecución si no es la de la página completa (p. ej. un fragmento).
+
+    Returns:
+        dict: 'ms' (tiempo total de la ejecución), 'filas' y 'bytes' (sumas de los tramos) y 'tramos'.
+    """
+    tramos = getattr(_local, 'tramos', None) or []
+    inicio = getattr(_local, 'inicio', time.perf_counter())
+    resumen = {
+        'ms': round((time.perf_counter() - inicio) * 1000, 3),
+        'filas': sum(t.get('filas') or 0 for t in tramos),
+        'bytes': sum(t.get('bytes') or 0 for t in tramos),
+        'tramos': tramos,
+    }
+    _local.tramos = None
+    emitir_json(logger, 'rerun', {'nombre': nombre, **resumen} if nombre else resumen)
+    return resumen
+
+
+def tramos_carga() -> list:
+    """Devuelve una copia de los tramos medidos fuera de las ejecuciones del script."""
+    with _lock:
+        return list(_tramos_carga)
+
+
+def mostrar_panel_rendimiento(resumen: dict) -> None:
+    """Muestra en la barra lateral los tiempos de la ejecución actual y de las cargas de datos."""
+    import pandas as pd
+    import streamlit as st
+
+    with st.sidebar.expander('Rendimiento', expanded=True):
+        st.markdown(f"**Ejecución:** {resumen['ms']:,.1f} ms · {resumen['filas']:,} filas · {resumen['bytes']:,} bytes")
+        columnas = ['nombre', 'ms', 'filas', 'bytes']
+        st.dataframe(pd.DataFrame(resumen['tramos'], columns=columnas), hide_index=True, use_container_width=True)
+        st.markdown('**Cargas de datos**')
+        st.dataframe(pd.DataFrame(tramos_carga(), columns=columnas), hide_index=True, use_container_width=True)
+
+
+def tamano_objeto(obj) -> int:
+    """
+    Estima el tamaño en memoria de un objeto en bytes: uso profundo para DataFrames y Series, `nbytes` para
+    arreglos de NumPy, suma recursiva para diccionarios, listas y tuplas, y `medir_memoria()` para los
+    objetos que lo definen (motores, cargadores).
+    """
+    if hasattr(obj, 'medir_memoria'):
+        return int(obj.medir_memoria()[1])
+    if hasattr(obj, 'memory_usage'):
+        uso = obj.memory_usage(index=True, deep=True)
+        return int(uso.sum() if hasattr(uso, 'sum') else uso)
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(tamano_objeto(k) + tamano_objeto(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(tamano_objeto(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+def registrar_cache(nombre: str, medidor) -> None:
+    """
+    Registra un caché para el reporte de memoria.
+
+    Args:
+        nombre (str): Nombre con el que aparece el caché en el reporte.
+        medidor (callable): Función sin argumentos que devuelve una tupla (entradas, bytes).
+    """
+    with _lock:
+        _caches[nombre] = medidor
+
+
+def memoria_proceso_bytes() -> int:
+    """Devuelve la memoria residente (RSS) del proceso en bytes, o None si no se puede determinar."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/status') as archivo:
+            for linea in archivo:
+                if linea.startswith('VmRSS:'):
+                    return int(linea.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # ru_maxrss es el máximo histórico (en KB en Linux, en bytes en macOS), no el valor actual
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maximo if sys.platform == 'darwin' else maximo * 1024
+    except ImportError:
+        return None
+
+
+def presupuesto_memoria_bytes() -> int:
+    """Devuelve el presupuesto de memoria configurado en MUNICIPIOS_PRESUPUESTO_MEMORIA_MB, o None."""
+    valor = os.environ.get('MUNICIPIOS_PRESUPUESTO_MEMORIA_MB')
+    return int(float(valor) * 1024 * 1024) if valor else None
+
+
+def reporte_memoria(dataframes: dict) -> dict:
+    """
+    Calcula el uso de memoria de los DataFrames cargados, de los cachés registrados y del proceso.
+
+    Args:
+        dataframes (dict): Diccionario nombre -> DataFrame con las tablas cargadas.
+
+    Returns:
+        dict: 'columnas' (DataFrame con tabla, columna y bytes), 'tablas' (DataFrame con tabla, filas y bytes),
+              'caches' (DataFrame con cache, entradas y bytes), 'rss' (bytes del proceso), 'presupuesto'
+              (bytes o None) y 'excedido' (bool).
+    """
+    import pandas as pd
+
+    filas_columnas = []
+    filas_tablas = []
+    for nombre, df in dataframes.items():
+        uso = df.memory_usage(index=True, deep=True)
+        filas_columnas.extend({'tabla': nombre, 'columna': columna, 'bytes': int(valor)} for columna, valor in uso.items())
+        filas_tablas.append({'tabla': nombre, 'filas': len(df), 'bytes': int(uso.sum())})
+
+    with _lock:
+        medidores = list(_caches.items())
+    filas_caches = []
+    for nombre, medidor in medidores:
+        entradas, tamano = medidor()
+        filas_caches.append({'cache': nombre, 'entradas': entradas, 'bytes': int(tamano)})
+
+    rss = memoria_proceso_bytes()
+    presupuesto = presupuesto_memoria_bytes()
+    excedido = bool(presupuesto and rss and rss > presupuesto)
+    if excedido:
+        emitir_json(logger, 'memoria_excedida', {'rss': rss, 'presupuesto': presupuesto}, nivel=logging.WARNING)
+
+    return {
+        'columnas': pd.DataFrame(filas_columnas, columns=['tabla', 'columna', 'bytes']),
+        'tablas': pd.DataFrame(filas_tablas, columns=['tabla', 'filas', 'bytes']),
+        'caches': pd.DataFrame(filas_caches, columns=['cache', 'entradas', 'bytes']),
+        'rss': rss,
+        'presupuesto': presupuesto,
+        'excedido': excedido,
+    }
+
+
+def mostrar_panel_memoria(reporte: dict) -> None:
+    """Muestra en la barra lateral el reporte de memoria generado con `reporte_memoria`."""
+    import streamlit as st
+
+    mb = 1024 * 1024
+    with st.sidebar.expander('Memoria'):
+        if reporte['rss'] is not None:
+            st.markdown(f"**Memoria del proceso (RSS):** {reporte['rss'] / mb:,.1f} MB")
+        if reporte['presupuesto']:
+            st.markdown(f"**Presupuesto:** {reporte['presupuesto'] / mb:,.1f} MB")
+        if reporte['excedido']:
+            st.warning('El proceso supera el presupuesto de memoria configurado.')
+        st.markdown('**Tablas**')
+        st.dataframe(reporte['tablas'], hide_index=True, use_container_width=True)
+        st.markdown('**Cachés**')
+        st.dataframe(reporte['caches'], hide_index=True, use_container_width=True)
+        st.markdown('**Columnas**')
+        st.dataframe(reporte['columnas'], hide_index=True, use_container_width=True)
@@ -0,0 +1,117 @@
+"""
+Publicación de agregados precalculados en el backend.
+
+Calcula fuera del tablero, con el motor de agregación configurado, las tablas pequeñas que resumen el
+tejido empresarial y los indicadores generales:
+    AGG_EMPRESAS_MUNICIPIOS      Número de empresas por municipio en cada distribución del perfil
+                                 (`datos.DISTRIBUCIONES_EMPRESAS`, incluidas las actividades de turismo).
+    AGG_EMPRESAS_DEPARTAMENTOS   Lo mismo por departamento.
+    AGG_PERCENTILES_MUNICIPIOS   Percentil nacional y departamental de cada indicador de cada municipio.
+Cada distribución se calcula con una sola agregación para todos los municipios (o departamentos) a la vez,
+no un municipio a la vez. Las tablas se cargan en bloque con `write_pandas` y reemplazan a las vigentes
+sólo si todas cargaron bien (ver `snowflake_utils.BackendSnowflake.publicar`).
+
+Uso:
+    python publicacion.py --chunk 100000
+    MUNICIPIOS_BACKEND=local MUNICIPIOS_DATOS_LOCALES=datos_locales python publicacion.py
+"""
+import argparse
+
+import pandas as pd
+
+import datos
+from claves import texto_clave
+from perf_utils import anotar, medir
+from snowflake_utils import publicar_tablas
+
+# Columna del tejido con el código de cada ámbito
+AMBITOS = {
+    'MUNICIPIOS': 'Cod. Municipio',
+    'DEPARTAMENTOS': 'Cod. Depto',
+}
+
+
+def agregados_empresas(inst: datos.Instantanea, columna_ambito: str) -> pd.DataFrame:
+    """
+    Calcula el número de empresas de cada categoría de cada distribución del perfil, por ámbito.
+
+    Args:
+        columna_ambito (str): 'Cod. Municipio' o 'Cod. Depto'.
+
+    Returns:
+        pd.DataFrame: Columnas CODIGO, DISTRIBUCION, CATEGORIA, ETIQUETA (la descripción de la categoría
+                      cuando la distribución tiene una, p. ej. la actividad CIIU en turismo; si no, la
+                      categoría misma), NUMERO_EMPRESAS y PARTICIPACION (dentro del ámbito y la distribución).
+    """
+    motor = datos.motor(inst)
+    partes = []
+    for nombre, argumentos in datos.DISTRIBUCIONES_EMPRESAS.items():
+        columnas = argumentos['columnas']
+        columnas = [columnas] if isinstance(columnas, str) else list(columnas)
+        etiqueta = argumentos.get('columna_etiqueta', columnas[0])
+        conteo = motor.conteo([columna_ambito] + columnas, filtro=argumentos.get('filtro'))
+        partes.append(pd.DataFrame({
+            'CODIGO': conteo[columna_ambito].astype(str),
+            'DISTRIBUCION': nombre,
+            'CATEGORIA': conteo[columnas[0]].astype(str),
+            'ETIQUETA': conteo[etiqueta].astype(str),
+            'NUMERO_EMPRESAS': conteo['Número de empresas'].astype('int64'),
+        }))
+    agregados = pd.concat(partes, ignore_index=True)
+    totales = agregados.groupby(['CODIGO', 'DISTRIBUCION'])['NUMERO_EMPRESAS'].transform('sum')
+    agregados['PARTICIPACION'] = (agregados['NUMERO_EMPRESAS'] / totales.where(totales > 0)).astype('float64')
+    return agregados
+
+
+def agregados_percentiles(inst: datos.Instantanea) -> pd.DataFrame:
+    """
+    Pasa a formato largo los percentiles de la instantánea (ver el derivado 'percentiles' de `datos.py`).
+    Los percentiles están indexados por la clave entera; CODIGO se publica con ceros a la izquierda, igual
+    que en los agregados de empresas.
+
+    Returns:
+        pd.DataFrame: Columnas CODIGO, INDICADOR, PERCENTIL_NACIONAL y PERCENTIL_DEPARTAMENTAL.
+    """
+    percentiles = inst.derivado('percentiles')
+    largo = percentiles.stack(level=1, future_stack=True)
+    largo.index.names = ['CODIGO', 'INDICADOR']
+    largo = largo.rename(index=texto_clave, level='CODIGO')
+    return (largo.rename(columns={'nacional': 'PERCENTIL_NACIONAL', 'departamental': 'PERCENTIL_DEPARTAMENTAL'})
+            .reset_index()[['CODIGO', 'INDICADOR', 'PERCENTIL_NACIONAL', 'PERCENTIL_DEPARTAMENTAL']]
+            .astype({'PERCENTIL_NACIONAL': 'float64', 'PERCENTIL_DEPARTAMENTAL': 'float64'}))
+
+
+def calcular_agregados(inst: datos.Instantanea) -> dict:
+    """
+    Calcula todas las tablas publicadas, con la versión de los datos de la que salen.
+
+    Returns:
+        dict: Nombre de tabla -> DataFrame.
+    """
+    tablas = {}
+    for ambito, columna in AMBITOS.items():
+        with medir(f'agregados {ambito.lower()}'):
+            tablas[f'AGG_EMPRESAS_{ambito}'] = agregados_empresas(inst, columna)
+            anotar(filas=len(tablas[f'AGG_EMPRESAS_{ambito}']))
+    with medir('agregados percentiles'):
+        tablas['AGG_PERCENTILES_MUNICIPIOS'] = agregados_percentiles(inst)
+        anotar(filas=len(tablas['AGG_PERCENTILES_MUNICIPIOS']))
+    return {tabla: df.assign(VERSION=inst.version) for tabla, df in tablas.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunk', type=int, default=100_000, help='Filas por archivo de la carga masiva.')
+    args = parser.parse_args()
+
+    inst = datos.instantanea_actual()
+    tablas = calcular_agregados(inst)
+    with medir('publicación'):
+        publicar_tablas(tablas, datos.cargar_sf_config(), chunk_size=args.chunk)
+        anotar(filas=sum(len(df) for df in tablas.values()))
+    for tabla, df in tablas.items():
+        print(f"{tabla:<30} {len(df):>10,} filas   versión {inst.version}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Municipios con perfil similar.
+
+Cada municipio se describe con los indicadores porcentuales de TABLA_BASE_MUNICIPIOS y la participación
+de cada cadena productiva en sus empresas. Las columnas se estandarizan (media 0, desviación 1) y la
+similitud entre dos municipios es el coseno entre sus vectores.
+
+Los `k` más similares de todos los municipios se calculan una sola vez por versión de los datos, con
+productos de matrices por bloques de filas para no materializar la matriz completa de similitudes, y se
+guardan como posiciones int32 y puntajes float32. Consultar un municipio es leer una fila.
+"""
+import numpy as np
+import pandas as pd
+
+from claves import CLAVE
+from perf_utils import anotar, medir
+
+
+def matriz_caracteristicas(df_general: pd.DataFrame, mezcla_sectores: pd.DataFrame) -> pd.DataFrame:
+    """
+    Arma la matriz de características estandarizadas por municipio.
+
+    Args:
+        df_general (pd.DataFrame): TABLA_BASE_MUNICIPIOS.
+        mezcla_sectores (pd.DataFrame): Participación (0 a 1) de cada sector en las empresas de cada
+                                        municipio, indexada por `CLAVE`.
+
+    Returns:
+        pd.DataFrame: Una fila por municipio y una columna por característica, con los faltantes en 0 (la
+                      media) después de estandarizar.
+    """
+    df_general = df_general.drop_duplicates(CLAVE).set_index(CLAVE)
+    porcentajes = df_general[[columna for columna in df_general.columns if columna.startswith('%')]]
+    # Un municipio sin empresas registradas no tiene participación en ningún sector
+    sectores = mezcla_sectores.add_prefix('Sector ').reindex(porcentajes.index).fillna(0)
+    caracteristicas = pd.concat([porcentajes, sectores], axis=1)
+    desviacion = caracteristicas.std().replace(0, 1)
+    return ((caracteristicas - caracteristicas.mean()) / desviacion).fillna(0).astype('float32')
+
+
+class SimilitudMunicipios:
+    """
+    Los `k` municipios más similares a cada municipio.
+
+    Args:
+        caracteristicas (pd.DataFrame): Resultado de `matriz_caracteristicas`.
+        k (int): Número de municipios similares que se guardan por municipio.
+        bloque (int): Filas por producto de matrices; limita la memoria a `bloque` x municipios puntajes.
+    """
+
+    def __init__(self, caracteristicas: pd.DataFrame, k: int = 10, bloque: int = 512):
+        self.claves = caracteristicas.index.to_numpy()
+        self._posiciones = {clave: posicion for posicion, clave in enumerate(self.claves.tolist())}
+        n = len(self.claves)
+        k = min(k, n - 1)
+        self.indices = np.empty((n, max(k, 0)), dtype=np.int32)
+        self.puntajes = np.empty((n, max(k, 0)), dtype=np.float32)
+        if k <= 0:
+            return
+
+        with medir('similitud municipios'):
+            vectores = caracteristicas.to_numpy(dtype=np.float32)
+            normas = np.linalg.norm(vectores, axis=1, keepdims=True)
+            vectores = vectores / np.where(normas == 0, 1, normas)
+            for inicio in range(0, n, bloque):
+                fin = min(inicio + bloque, n)
+                similitudes = vectores[inicio:fin] @ vectores.T
+                # Un municipio no es similar a sí mismo
+                similitudes[np.arange(fin - inicio), np.arange(inicio, fin)] = -np.inf
+                mejores = np.argpartition(similitudes, -k, axis=1)[:, -k:]
+                puntajes = np.take_along_axis(similitudes, mejores, axis=1)
+                orden = np.argsort(-puntajes, axis=1)
+                self.indices[inicio:fin] = np.take_along_axis(mejores, orden, axis=1)
+                self.puntajes[inicio:fin] = np.take_along_axis(puntajes, orden, axis=1)
+            anotar(filas=n)
+
+    def similares(self, clave: int, k: int = 5) -> tuple:
+        """
+        Devuelve los `k` municipios más similares a uno dado (por su clave entera), del más al menos similar.
+
+        Returns:
+            tuple: (arreglo de claves, arreglo de similitudes entre -1 y 1). Ambos vacíos si el municipio no
+                   está en la matriz.
+        """
+        posicion = self._posiciones.get(clave)
+        if posicion is None:
+            return self.claves[:0], np.empty(0, dtype=np.float32)
+        return self.claves[self.indices[posicion, :k]], self.puntajes[posicion, :k]
+
+    def medir_memoria(self) -> tuple:
+        """Devuelve (municipios, bytes de los índices y puntajes)."""
+        return len(self.claves), int(self.indices.nbytes + self.puntajes.nbytes)
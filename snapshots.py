@@ -0,0 +1,339 @@
+"""
+Instantáneas locales de las tablas, con el tejido empresarial particionado por departamento.
+
+Cada instantánea se guarda en `<directorio>/<version>/` con:
+    - TABLA_BASE_MUNICIPIOS.parquet y TABLA_DIVIPOLA_MUNICIPIOS.parquet completas (son pequeñas).
+    - tejido/<Cod. Depto>.parquet: una partición de TABLA_TEJIDO_MUNICIPIOS por departamento.
+    - arrow/<tabla>.arrow: las tres tablas completas en formato Arrow IPC sin comprimir, para mapearlas en
+      memoria de sólo lectura (MUNICIPIOS_ORIGEN=compartido).
+    Las tablas se guardan con su columna 'Clave municipio' (ver `claves.py`), de modo que al abrirlas no hay
+    que volver a calcularla.
+    - manifest.json: versión, fecha, marcadores de cambio, particiones e índice territorial (departamentos,
+      municipios y códigos) para armar la barra lateral sin abrir ninguna partición.
+El archivo `<directorio>/ACTUAL` indica la versión vigente y se reemplaza de forma atómica al terminar de
+escribir una instantánea nueva.
+
+Al servir desde una instantánea (MUNICIPIOS_ORIGEN=snapshot), cada partición se lee sólo cuando se
+selecciona su departamento y las menos usadas se descartan cuando se supera el presupuesto de memoria
+MUNICIPIOS_PRESUPUESTO_PARTICIONES_MB.
+
+Con MUNICIPIOS_ORIGEN=compartido cada proceso mapea los archivos Arrow de la versión vigente en lugar de
+leerlos: las páginas las comparte el sistema operativo entre todos los procesos del servidor, así que la
+memoria no crece al agregar procesos. Cuando ACTUAL cambia, cada proceso mapea la nueva versión en su
+siguiente refresco; las versiones borradas siguen disponibles para los procesos que aún las tienen mapeadas.
+
+Para generar una instantánea desde el backend configurado:
+    python snapshots.py --directorio snapshots
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import re
+import shutil
+import threading
+import weakref
+
+import pandas as pd
+
+from claves import CLAVE, SIN_CLAVE, agregar_clave, clave_municipio
+from perf_utils import anotar, medir, registrar_cache, tamano_objeto
+
+DIRECTORIO_POR_DEFECTO = os.environ.get('MUNICIPIOS_SNAPSHOT_DIR', 'snapshots')
+PRESUPUESTO_PARTICIONES = int(float(os.environ.get('MUNICIPIOS_PRESUPUESTO_PARTICIONES_MB', 256)) * 1024 * 1024)
+
+TABLA_TEJIDO = 'TABLA_TEJIDO_MUNICIPIOS'
+TABLAS_COMPLETAS = ('TABLA_BASE_MUNICIPIOS', 'TABLA_DIVIPOLA_MUNICIPIOS')
+
+
+def indice_territorial(df_base: pd.DataFrame) -> dict:
+    """
+    Construye el índice de la barra lateral a partir del tejido empresarial.
+
+    Returns:
+        dict: 'departamentos' (lista ordenada, sin 'No determinado'), 'municipios' (departamento -> lista
+              ordenada de municipios) y 'codigos' (departamento -> municipio -> Cod. Municipio).
+    """
+    pares = df_base[['Departamento', 'Municipio', 'Cod. Municipio']].dropna(subset=['Departamento', 'Municipio'])
+    pares = pares.drop_duplicates(['Departamento', 'Municipio']).sort_values(['Departamento', 'Municipio'])
+    codigos = {}
+    for depto, mpio, cod in pares.itertuples(index=False):
+        codigos.setdefault(depto, {})[mpio] = cod
+    return {
+        'departamentos': [depto for depto in codigos if depto != 'No determinado'],
+        'municipios': {depto: list(mpios) for depto, mpios in codigos.items()},
+        'codigos': codigos,
+    }
+
+
+def _nombre_archivo(valor) -> str:
+    return re.sub(r'[^0-9A-Za-z_-]', '_', str(valor))
+
+
+def _escribir_arrow(df: pd.DataFrame, ruta: str) -> None:
+    # Importación diferida: pyarrow sólo se necesita para escribir y mapear los archivos Arrow
+    import pyarrow as pa
+
+    # Un solo lote: al mapear el archivo, cada columna numérica es un arreglo contiguo que NumPy puede usar
+    # sin copiarlo (con varios lotes, `to_pandas` tendría que concatenarlos)
+    tabla = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+    with pa.OSFile(ruta, 'wb') as archivo, pa.ipc.new_file(archivo, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+
+
+def _escribir_atomico(ruta: str, contenido: str) -> None:
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def version_actual(directorio: str = DIRECTORIO_POR_DEFECTO) -> str:
+    """Devuelve la versión vigente de las instantáneas del directorio, o None si no hay ninguna."""
+    try:
+        with open(os.path.join(directorio, 'ACTUAL'), encoding='utf-8') as archivo:
+            return archivo.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def guardar_instantanea(tablas: dict, version: str, marcadores: dict = None,
+                        directorio: str = DIRECTORIO_POR_DEFECTO, conservar: int = 2) -> str:
+    """
+    Guarda las tablas como una instantánea particionada y la marca como vigente.
+
+    Args:
+        tablas (dict): Nombre de tabla -> DataFrame, con las tres tablas del tablero.
+        version (str): Versión de los datos (p. ej. `Instantanea.version`).
+        marcadores (dict, optional): Marcadores de cambio de las tablas, para comparar en los refrescos.
+        directorio (str, optional): Directorio raíz de las instantáneas.
+        conservar (int, optional): Número de versiones que se conservan; las más antiguas se borran.
+
+    Returns:
+        str: Ruta del directorio de la versión guardada.
+    """
+    destino = os.path.join(directorio, version)
+    temporal = f'{destino}.{os.getpid()}.tmp'
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(os.path.join(temporal, 'tejido'))
+    os.makedirs(os.path.join(temporal, 'arrow'))
+
+    for tabla in TABLAS_COMPLETAS:
+        tablas[tabla].to_parquet(os.path.join(temporal, f'{tabla}.parquet'), index=False)
+
+    archivos_arrow = {}
+    for tabla in (*TABLAS_COMPLETAS, TABLA_TEJIDO):
+        archivos_arrow[tabla] = f'arrow/{tabla}.arrow'
+        _escribir_arrow(tablas[tabla], os.path.join(temporal, archivos_arrow[tabla]))
+
+    df_base = tablas[TABLA_TEJIDO]
+    particiones = {}
+    for cod_depto, particion in df_base.groupby('Cod. Depto', sort=True, dropna=False):
+        archivo = f'tejido/{_nombre_archivo(cod_depto)}.parquet'
+        particion.to_parquet(os.path.join(temporal, archivo), index=False)
+        particiones[str(cod_depto)] = {'archivo': archivo, 'filas': len(particion)}
+
+    municipio_depto = (df_base[['Cod. Municipio', 'Cod. Depto']].dropna()
+                       .drop_duplicates('Cod. Municipio').astype(str))
+    manifiesto = {
+        'version': version,
+        'creada': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'marcadores': marcadores or {},
+        'particiones': particiones,
+        'arrow': archivos_arrow,
+        'columnas_tejido': list(df_base.columns),
+        'municipio_depto': dict(zip(municipio_depto['Cod. Municipio'], municipio_depto['Cod. Depto'])),
+        'indice_territorial': indice_territorial(df_base),
+    }
+    with open(os.path.join(temporal, 'manifest.json'), 'w', encoding='utf-8') as archivo:
+        json.dump(manifiesto, archivo, ensure_ascii=False, default=str)
+
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(temporal, destino)
+    _escribir_atomico(os.path.join(directorio, 'ACTUAL'), version)
+    _borrar_versiones_antiguas(directorio, conservar)
+    return destino
+
+
+def _borrar_versiones_antiguas(directorio: str, conservar: int) -> None:
+    vigente = version_actual(directorio)
+    versiones = [entrada for entrada in os.scandir(directorio)
+                 if entrada.is_dir() and not entrada.name.endswith('.tmp') and entrada.name != vigente]
+    versiones.sort(key=lambda entrada: entrada.stat().st_mtime, reverse=True)
+    for entrada in versiones[max(conservar - 1, 0):]:
+        shutil.rmtree(entrada.path, ignore_errors=True)
+
+
+def leer_manifiesto(directorio: str = DIRECTORIO_POR_DEFECTO, version: str = None) -> dict:
+    """
+    Lee el manifiesto de una versión (por defecto la vigente) y agrega su ruta en la llave 'ruta'.
+
+    Raises:
+        FileNotFoundError: Si no hay instantáneas en el directorio.
+    """
+    version = version or version_actual(directorio)
+    if version is None:
+        raise FileNotFoundError(f"No hay instantáneas en el directorio '{directorio}'")
+    ruta = os.path.join(directorio, version)
+    with open(os.path.join(ruta, 'manifest.json'), encoding='utf-8') as archivo:
+        manifiesto = json.load(archivo)
+    manifiesto['ruta'] = ruta
+    return manifiesto
+
+
+class CargadorParticiones:
+    """
+    Lee a demanda las particiones departamentales del tejido empresarial de una instantánea.
+
+    Las particiones leídas se conservan en memoria mientras su tamaño total no supere el presupuesto;
+    al superarlo se descartan las usadas hace más tiempo (LRU), salvo la que se acaba de pedir.
+
+    Args:
+        manifiesto (dict): Manifiesto de la instantánea (ver `leer_manifiesto`).
+        presupuesto_bytes (int, optional): Memoria máxima para las particiones en memoria.
+    """
+
+    def __init__(self, manifiesto: dict, presupuesto_bytes: int = PRESUPUESTO_PARTICIONES):
+        self.manifiesto = manifiesto
+        self.presupuesto_bytes = presupuesto_bytes
+        self._particiones = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def departamento_de(self, cod_mpio) -> str:
+        """Devuelve el Cod. Depto de la partición que contiene al municipio, o None si no está."""
+        return self.manifiesto['municipio_depto'].get(str(cod_mpio))
+
+    def obtener(self, cod_depto: str) -> pd.DataFrame:
+        """Devuelve la partición del departamento, leyéndola del disco si no está en memoria."""
+        with self._lock:
+            if cod_depto in self._particiones:
+                self._particiones.move_to_end(cod_depto)
+                return self._particiones[cod_depto][0]
+
+        with medir(f'partición {cod_depto}'):
+            archivo = self.manifiesto['particiones'][cod_depto]['archivo']
+            # Las instantáneas anteriores a la clave entera no la guardan en las particiones
+            df = agregar_clave(TABLA_TEJIDO, pd.read_parquet(os.path.join(self.manifiesto['ruta'], archivo)))
+            tamano = tamano_objeto(df)
+            anotar(filas=len(df), bytes=tamano)
+
+        with self._lock:
+            self._particiones[cod_depto] = (df, tamano)
+            self._particiones.move_to_end(cod_depto)
+            total = sum(t for _, t in self._particiones.values())
+            while total > self.presupuesto_bytes and len(self._particiones) > 1:
+                _, (_, tamano_descartado) = self._particiones.popitem(last=False)
+                total -= tamano_descartado
+        return df
+
+    def tejido_municipio(self, cod_mpio) -> pd.DataFrame:
+        """Devuelve las filas del tejido empresarial de un municipio, o un DataFrame vacío si no tiene."""
+        clave = clave_municipio(cod_mpio)
+        cod_depto = self.departamento_de(cod_mpio) if clave != SIN_CLAVE else None
+        if cod_depto is None:
+            return pd.DataFrame(columns=self.manifiesto['columnas_tejido'])
+        particion = self.obtener(cod_depto)
+        return particion[particion[CLAVE] == clave]
+
+    def medir_memoria(self) -> tuple:
+        """Devuelve (particiones en memoria, bytes)."""
+        with self._lock:
+            return len(self._particiones), sum(t for _, t in self._particiones.values())
+
+
+_cargadores = []
+
+
+def _medir_cargadores() -> tuple:
+    # Sólo los cargadores que siguen vivos, es decir, los de instantáneas aún en uso
+    vivos = [cargador() for cargador in _cargadores if cargador() is not None]
+    medidas = [cargador.medir_memoria() for cargador in vivos]
+    return sum(m[0] for m in medidas), sum(m[1] for m in medidas)
+
+
+registrar_cache('particiones del tejido', _medir_cargadores)
+
+
+def abrir_instantanea(directorio: str = DIRECTORIO_POR_DEFECTO, version: str = None):
+    """
+    Abre una instantánea: lee las tablas completas y prepara el cargador de particiones del tejido.
+
+    Returns:
+        tuple: (tablas, cargador, manifiesto), con `tablas` como diccionario nombre -> DataFrame de las
+               tablas completas.
+    """
+    manifiesto = leer_manifiesto(directorio, version)
+    tablas = {}
+    for tabla in TABLAS_COMPLETAS:
+        with medir(f'carga {tabla} (instantánea)'):
+            tablas[tabla] = pd.read_parquet(os.path.join(manifiesto['ruta'], f'{tabla}.parquet'))
+            anotar(filas=len(tablas[tabla]))
+    cargador = CargadorParticiones(manifiesto)
+    _cargadores[:] = [ref for ref in _cargadores if ref() is not None] + [weakref.ref(cargador)]
+    return tablas, cargador, manifiesto
+
+
+def _tipos_compartidos():
+    """
+    Devuelve el `types_mapper` de `abrir_compartida`: el texto se convierte al tipo de pandas respaldado por
+    Arrow con NaN como faltante (el 'str' de pandas 3) en lugar de objetos de Python, que serían una copia.
+    """
+    import pyarrow as pa
+
+    try:
+        tipo_texto = pd.StringDtype('pyarrow', na_value=float('nan'))
+    except TypeError:
+        # pandas 2.1 y 2.2
+        tipo_texto = pd.StringDtype('pyarrow_numpy')
+    return lambda tipo: tipo_texto if pa.types.is_string(tipo) or pa.types.is_large_string(tipo) else None
+
+
+def abrir_compartida(directorio: str = DIRECTORIO_POR_DEFECTO, version: str = None):
+    """
+    Mapea en memoria, de sólo lectura, las tablas Arrow de una instantánea (por defecto la vigente).
+
+    Las columnas de texto quedan como arreglos Arrow y las numéricas sin nulos como arreglos de NumPy, unas
+    y otras sobre las páginas mapeadas: varios procesos que abren la misma versión comparten esa memoria en
+    lugar de tener cada uno su copia. Sólo se copian las columnas que pandas no puede representar sin
+    convertirlas (p. ej. enteros con nulos, que pasan a float).
+
+    Returns:
+        tuple: (tablas, manifiesto), con `tablas` como diccionario nombre -> DataFrame de las tres tablas.
+
+    Raises:
+        FileNotFoundError: Si no hay instantáneas o la vigente se generó sin archivos Arrow.
+    """
+    import pyarrow as pa
+
+    manifiesto = leer_manifiesto(directorio, version)
+    if 'arrow' not in manifiesto:
+        raise FileNotFoundError(f"La instantánea {manifiesto['version']} no tiene archivos Arrow; hay que volver a generarla")
+    tablas = {}
+    for tabla, archivo in manifiesto['arrow'].items():
+        with medir(f'mapeo {tabla} (compartida)'):
+            fuente = pa.memory_map(os.path.join(manifiesto['ruta'], archivo), 'r')
+            # split_blocks: una columna por bloque, sin consolidar las del mismo tipo en un arreglo nuevo
+            tablas[tabla] = pa.ipc.open_file(fuente).read_all().to_pandas(
+                split_blocks=True, self_destruct=True, types_mapper=_tipos_compartidos())
+            anotar(filas=len(tablas[tabla]))
+    return tablas, manifiesto
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera una instantánea local particionada desde el backend configurado.')
+    parser.add_argument('--directorio', default=DIRECTORIO_POR_DEFECTO)
+    args = parser.parse_args()
+
+    import datos
+
+    sf_config = datos.cargar_sf_config()
+    instantanea = datos.cargar_desde_backend(sf_config)
+    # Con el motor 'servidor' el tejido no se descarga al cargar: `tablas_completas` lo trae aparte
+    ruta = guardar_instantanea(datos.tablas_completas(instantanea, sf_config), instantanea.version,
+                               instantanea.marcadores, args.directorio)
+    print(f"Instantánea {instantanea.version} guardada en {ruta}")
+
+
+if __name__ == '__main__':
+    main()
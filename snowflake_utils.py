@@ -1,14 +1,219 @@
-import snowflake.connector
-from snowflake.connector.pandas_tools import write_pandas
-from snowflake.connector.pandas_tools import pd_writer
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import logging
+import os
+import random
+import re
+import threading
+import time
 import pandas as pd
 
+from cache_consultas import cache_configurado, clave_consulta
+from perf_utils import emitir_json, obtener_logger_json
+
+# Registro estructurado de consultas: una línea JSON por consulta ejecutada
+logger = obtener_logger_json('municipios.snowflake')
+
+# Funciones que reciben cada registro de consulta (ver `registrar_observador_consultas`)
+_observadores_consultas = []
+
+# Segundos que puede tardar una consulta (conexión incluida) antes de cancelarse
+PLAZO_CONSULTA = float(os.environ.get('MUNICIPIOS_PLAZO_CONSULTA', 30))
+# Reintentos tras una falla de disponibilidad, con espera exponencial aleatoria desde ESPERA_REINTENTO segundos
+REINTENTOS = int(os.environ.get('MUNICIPIOS_REINTENTOS', 2))
+ESPERA_REINTENTO = 0.5
+# Fallas seguidas que abren el interruptor y segundos que permanece abierto antes de probar de nuevo
+FALLOS_INTERRUPTOR = int(os.environ.get('MUNICIPIOS_INTERRUPTOR_FALLOS', 3))
+ESPERA_INTERRUPTOR = float(os.environ.get('MUNICIPIOS_INTERRUPTOR_ESPERA', 60))
+# Conexiones inactivas que conserva el pool de Snowflake y segundos entre latidos de las inactivas
+CONEXIONES_POOL = int(os.environ.get('MUNICIPIOS_POOL_CONEXIONES', 4))
+INTERVALO_LATIDO = float(os.environ.get('MUNICIPIOS_INTERVALO_LATIDO', 300))
+# Segundos entre consultas del estado de las consultas asíncronas: empieza en el mínimo y se duplica
+SONDEO_MINIMO = 0.05
+SONDEO_MAXIMO = 1.0
+
+
+class PlazoConsultaVencido(TimeoutError):
+    """La consulta superó MUNICIPIOS_PLAZO_CONSULTA y se canceló."""
+
+
+class BackendNoDisponible(ConnectionError):
+    """El interruptor del backend está abierto: la consulta no se envió."""
+
+
+def es_falla_disponibilidad(error: Exception) -> bool:
+    """
+    Indica si un error se debe a que el backend no respondió (red, plazo vencido, servicio caído) y no a la
+    consulta misma. Sólo estas fallas se reintentan y cuentan para el interruptor.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Errores de red y de sesión del conector; los de SQL son ProgrammingError
+    return type(error).__module__.startswith('snowflake') and type(error).__name__ in ('OperationalError', 'InterfaceError')
+
+
+class Interruptor:
+    """
+    Interruptor de circuito de un backend.
+
+    Cerrado, deja pasar todas las consultas. Tras `fallos` fallas de disponibilidad seguidas se abre y
+    las consultas fallan de inmediato con `BackendNoDisponible`, sin esperar al conector. Pasados `espera`
+    segundos deja pasar una sola consulta de prueba: si responde se cierra y si falla se abre otra vez.
+
+    Args:
+        fallos (int): Fallas seguidas que abren el interruptor.
+        espera (float): Segundos que permanece abierto antes de la consulta de prueba.
+    """
+
+    def __init__(self, fallos: int = FALLOS_INTERRUPTOR, espera: float = ESPERA_INTERRUPTOR):
+        self.fallos = fallos
+        self.espera = espera
+        self._fallos_seguidos = 0
+        self._abierto_desde = None
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    @property
+    def abierto(self) -> bool:
+        return self._abierto_desde is not None
+
+    def permitir(self) -> bool:
+        """Indica si una consulta puede enviarse al backend."""
+        with self._lock:
+            if self._abierto_desde is None:
+                return True
+            if self._prueba_en_curso or time.monotonic() - self._abierto_desde < self.espera:
+                return False
+            self._prueba_en_curso = True
+            return True
+
+    def exito(self) -> None:
+        with self._lock:
+            if self._abierto_desde is not None:
+                emitir_json(logger, 'interruptor_cerrado', {})
+            self._fallos_seguidos = 0
+            self._abierto_desde = None
+            self._prueba_en_curso = False
+
+    def falla(self) -> None:
+        with self._lock:
+            self._fallos_seguidos += 1
+            self._prueba_en_curso = False
+            if self._abierto_desde is not None or self._fallos_seguidos >= self.fallos:
+                if self._abierto_desde is None:
+                    emitir_json(logger, 'interruptor_abierto', {'fallos': self._fallos_seguidos}, nivel=logging.WARNING)
+                self._abierto_desde = time.monotonic()
+
+
+# Interruptor de cada backend, por nombre
+_interruptores = {}
+
+
+def interruptor_backend(nombre: str) -> Interruptor:
+    """Devuelve el interruptor del backend `nombre`, compartido por todas las consultas del proceso."""
+    return _interruptores.setdefault(nombre, Interruptor())
+
+
+def normalizar_consulta(query: str) -> str:
+    """Colapsa los espacios de una consulta SQL para agrupar en los registros las consultas equivalentes."""
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+def registrar_observador_consultas(observador) -> None:
+    """
+    Registra una función que recibe el diccionario de cada consulta ejecutada, p. ej. `HistogramaConsultas.observar`.
+
+    El registro incluye 'consulta', 'backend', 'query_id', 'warehouse', 'conexion_ms', 'ejecucion_ms',
+    'descarga_ms', 'total_ms', 'filas', 'bytes', 'intentos', 'conexion' ('nueva' o 'reutilizada' del pool),
+    'cache' ('acierto' o 'fallo' si está activo el caché en disco) y, si la consulta falló, 'error'.
+    """
+    _observadores_consultas.append(observador)
+
+
+def _publicar_consulta(registro: dict) -> None:
+    nivel = logging.ERROR if 'error' in registro else logging.INFO
+    emitir_json(logger, 'consulta', registro, nivel=nivel)
+    for observador in list(_observadores_consultas):
+        try:
+            observador(registro)
+        except Exception:
+            logger.exception("Error en un observador de consultas")
+
+
+class HistogramaConsultas:
+    """
+    Agrega los registros de consultas en histogramas de latencia por consulta y por etapa.
+
+    Ejemplo:
+        histograma = HistogramaConsultas()
+        registrar_observador_consultas(histograma.observar)
+        ...
+        print(histograma.resumen())
+    """
+    LIMITES_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+    ETAPAS = ('conexion_ms', 'ejecucion_ms', 'descarga_ms', 'total_ms')
+
+    def __init__(self, limites_ms=LIMITES_MS):
+        self.limites_ms = tuple(limites_ms)
+        self._conteos = {}
+        self._totales = {}
+        self._lock = threading.Lock()
+
+    def observar(self, registro: dict) -> None:
+        """Agrega un registro de consulta a los histogramas."""
+        consulta = registro.get('consulta', '')
+        with self._lock:
+            totales = self._totales.setdefault(consulta, {'consultas': 0, 'errores': 0, 'filas': 0, 'bytes': 0})
+            totales['consultas'] += 1
+            totales['errores'] += 'error' in registro
+            totales['filas'] += registro.get('filas') or 0
+            totales['bytes'] += registro.get('bytes') or 0
+            for etapa in self.ETAPAS:
+                valor = registro.get(etapa)
+                if valor is None:
+                    continue
+                conteos = self._conteos.setdefault((consulta, etapa), [0] * (len(self.limites_ms) + 1))
+                conteos[bisect.bisect_left(self.limites_ms, valor)] += 1
+
+    def _percentil(self, conteos, q):
+        # Devuelve el límite superior del intervalo que contiene el percentil q
+        objetivo = q * sum(conteos)
+        acumulado = 0
+        for i, conteo in enumerate(conteos):
+            acumulado += conteo
+            if acumulado >= objetivo:
+                return self.limites_ms[i] if i < len(self.limites_ms) else float('inf')
+        return float('inf')
+
+    def resumen(self) -> pd.DataFrame:
+        """
+        Devuelve un DataFrame con una fila por consulta y etapa, con el número de observaciones, los
+        percentiles 50, 95 y 99 (cota superior del intervalo, en ms) y los totales de filas y bytes.
+        """
+        with self._lock:
+            filas = []
+            for (consulta, etapa), conteos in self._conteos.items():
+                filas.append({
+                    'consulta': consulta,
+                    'etapa': etapa,
+                    'n': sum(conteos),
+                    'p50_ms': self._percentil(conteos, 0.50),
+                    'p95_ms': self._percentil(conteos, 0.95),
+                    'p99_ms': self._percentil(conteos, 0.99),
+                    **self._totales[consulta],
+                })
+        return pd.DataFrame(filas)
+
+
 def sf_check_snowflake_connection(sf_config):
     """
-    Verifica la conexión con Snowflake ejecutando una consulta para obtener la versión actual del servidor.
+    Verifica la conexión con Snowflake calentando el backend (ver `calentar_backend`).
 
-    Esta función intenta establecer una conexión con Snowflake usando las configuraciones proporcionadas,
-    ejecuta una consulta para determinar la versión actual del servidor y cierra adecuadamente todos los recursos.
+    Además de comprobar la conexión, deja abiertas las conexiones del pool, con el warehouse reanudado y
+    el latido en marcha, para que la primera consulta de un usuario no pague la conexión.
 
     Args:
         sf_config (dict): Un diccionario que contiene las credenciales y configuración para la conexión.
@@ -16,44 +221,582 @@ def sf_check_snowflake_connection(sf_config):
 
     Returns:
         str: Devuelve la versión actual de Snowflake si la conexión es exitosa. En caso de error, retorna un mensaje indicativo.
-
-    Note:
-        Esta función es útil para verificar la correcta configuración y operatividad de las conexiones a Snowflake.
     """
-    conn = None
-    cur = None
     try:
-        # Crear la conexión utilizando las credenciales y configuraciones especificadas
-        conn = snowflake.connector.connect(
-            user=sf_config['user'],
-            password=sf_config['password'],
-            account=sf_config['account']  # Asegura que 'account' no incluya URL de Snowflake
-        )
-        # Crear un cursor para ejecutar consultas
-        cur = conn.cursor()
-        # Ejecutar consulta para obtener la versión actual de Snowflake
-        cur.execute("SELECT current_version()")
-        one_row = cur.fetchone()
-        # Imprimir la versión actual de Snowflake
-        return one_row[0] if one_row else "No se pudo obtener la versión."
+        return calentar_backend(sf_config).get('version') or "No se pudo obtener la versión."
     except Exception as e:
-        # Manejo de excepciones si ocurre un error durante la conexión o ejecución
         return f"Error al conectar o ejecutar la consulta: {e}"
-    finally:
-        # Asegurarse de cerrar el cursor y la conexión
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
-        print("Conexión cerrada correctamente.")
 
 # Ejemplo de uso:
 # sf_config = {'user': 'usuario', 'password': 'contraseña', 'account': 'cuenta'}
 # print(check_snowflake_connection(sf_config))
 
-def st_query_to_snowflake_and_return_dataframe(query: str, sf_config: dict, limit: int = None, expected_types: dict = None) -> pd.DataFrame:
+
+def calentar_backend(sf_config: dict, conexiones: int = None) -> dict:
+    """
+    Prepara el backend configurado antes de atender usuarios.
+
+    En Snowflake abre `conexiones` sesiones del pool en paralelo, reanuda el warehouse, ejecuta
+    `SELECT current_version()` en cada sesión y arranca el latido que las mantiene vivas mientras el
+    proceso está inactivo. El backend local carga sus tablas al crearse, así que basta con crearlo.
+
+    Args:
+        sf_config (dict): Configuración de conexión (ver `st_query_to_snowflake_and_return_dataframe`).
+        conexiones (int, optional): Sesiones que se abren. Por defecto MUNICIPIOS_POOL_CONEXIONES.
+
+    Returns:
+        dict: 'backend', 'conexiones' abiertas, 'version' del servidor (si el backend la informa) y 'ms'.
+    """
+    inicio = time.perf_counter()
+    registro = {'consulta': 'calentamiento', 'backend': None}
+    try:
+        backend = obtener_backend(sf_config)
+        registro['backend'] = backend.nombre
+        resultado = {'backend': backend.nombre, 'conexiones': 0, 'version': None}
+        if hasattr(backend, 'calentar'):
+            resultado.update(backend.calentar(CONEXIONES_POOL if conexiones is None else conexiones))
+        registro['conexiones'] = resultado['conexiones']
+        resultado['ms'] = _ms_desde(inicio)
+        return resultado
+    except Exception as e:
+        registro['error'] = f"{type(e).__name__}: {e}"
+        if registro['backend'] is not None and es_falla_disponibilidad(e):
+            interruptor_backend(registro['backend']).falla()
+        raise
+    finally:
+        registro['total_ms'] = _ms_desde(inicio)
+        _publicar_consulta(registro)
+
+
+def _conector():
+    # Importación diferida: snowflake.connector tarda en importarse y no se usa con el backend local ni
+    # al servir desde una instantánea
+    import snowflake.connector
+    return snowflake.connector
+
+
+def _ms_desde(inicio: float) -> float:
+    return round((time.perf_counter() - inicio) * 1000, 3)
+
+
+def _cerrar(conexion) -> None:
+    try:
+        conexion.close()
+    except Exception:
+        pass
+
+
+def _consulta_trivial(conexion, consulta: str = 'SELECT 1'):
+    cursor = conexion.cursor()
+    try:
+        cursor.execute(consulta)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class PoolConexiones:
     """
-    Ejecuta una consulta SQL en Snowflake y devuelve los resultados en un DataFrame de Pandas.
+    Conexiones abiertas que se reutilizan entre consultas.
+
+    `tomar` entrega una conexión inactiva, o abre una nueva si no hay ninguna; al terminar la consulta la
+    conexión vuelve al pool, que conserva hasta `maximo` inactivas. Una conexión con la que falló la red se
+    cierra en lugar de devolverse. `calentar` abre las conexiones de antemano y el latido (`iniciar_latido`)
+    ejecuta una consulta trivial en las inactivas, reemplaza las que ya no responden y repone las que
+    falten, de modo que el pool sigue listo mientras el proceso espera usuarios.
+
+    Args:
+        abrir (callable): Función sin argumentos que abre una conexión.
+        maximo (int): Conexiones inactivas que se conservan.
+    """
+
+    def __init__(self, abrir, maximo: int = CONEXIONES_POOL):
+        self.abrir = abrir
+        self.maximo = maximo
+        # Conexiones que el latido mantiene abiertas; lo fija `calentar`
+        self.minimo = 0
+        # (conexión, último uso según time.monotonic)
+        self._inactivas = collections.deque()
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo_latido = None
+
+    @contextlib.contextmanager
+    def tomar(self, registro: dict = None):
+        """
+        Entrega una conexión para una consulta y la devuelve al pool al salir del bloque `with`.
+
+        Args:
+            registro (dict, optional): Diccionario en el que se anotan 'conexion' ('reutilizada' o 'nueva')
+                                       y 'conexion_ms'.
+        """
+        registro = {} if registro is None else registro
+        inicio = time.perf_counter()
+        with self._lock:
+            conexion = self._inactivas.pop()[0] if self._inactivas else None
+        registro['conexion'] = 'nueva' if conexion is None else 'reutilizada'
+        if conexion is None:
+            conexion = self.abrir()
+        registro['conexion_ms'] = _ms_desde(inicio)
+        try:
+            yield conexion
+        except Exception as e:
+            if es_falla_disponibilidad(e):
+                _cerrar(conexion)
+            else:
+                self._devolver(conexion)
+            raise
+        else:
+            self._devolver(conexion)
+
+    def _devolver(self, conexion) -> None:
+        with self._lock:
+            if len(self._inactivas) < self.maximo:
+                self._inactivas.append((conexion, time.monotonic()))
+                return
+        _cerrar(conexion)
+
+    def _reponer(self, preparar=None) -> int:
+        with self._lock:
+            faltan = self.minimo - len(self._inactivas)
+        if faltan <= 0:
+            return 0
+
+        def abrir_y_preparar(_):
+            conexion = self.abrir()
+            try:
+                if preparar is not None:
+                    preparar(conexion)
+            except Exception:
+                _cerrar(conexion)
+                raise
+            return conexion
+
+        # Las conexiones se abren en paralelo: cada una espera la autenticación por su cuenta
+        with concurrent.futures.ThreadPoolExecutor(max_workers=faltan) as ejecutor:
+            conexiones = list(ejecutor.map(abrir_y_preparar, range(faltan)))
+        for conexion in conexiones:
+            self._devolver(conexion)
+        return len(conexiones)
+
+    def calentar(self, conexiones: int, preparar=None) -> int:
+        """
+        Abre conexiones hasta tener `conexiones` inactivas y ejecuta `preparar(conexion)` en cada una nueva.
+
+        Returns:
+            int: Número de conexiones abiertas.
+        """
+        self.minimo = min(conexiones, self.maximo)
+        return self._reponer(preparar)
+
+    def latir(self, intervalo: float = INTERVALO_LATIDO) -> dict:
+        """
+        Ejecuta `SELECT 1` en las conexiones inactivas desde hace más de `intervalo` segundos, cierra las que
+        fallan y abre las que falten para llegar al mínimo.
+
+        Returns:
+            dict: 'vivas', 'cerradas' y 'abiertas'.
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            revisar = [(conexion, uso) for conexion, uso in self._inactivas if ahora - uso >= intervalo]
+            self._inactivas = collections.deque((conexion, uso) for conexion, uso in self._inactivas
+                                                if ahora - uso < intervalo)
+        vivas = cerradas = 0
+        for conexion, _ in revisar:
+            try:
+                _consulta_trivial(conexion)
+            except Exception:
+                _cerrar(conexion)
+                cerradas += 1
+                continue
+            self._devolver(conexion)
+            vivas += 1
+        return {'vivas': vivas, 'cerradas': cerradas, 'abiertas': self._reponer()}
+
+    def iniciar_latido(self, intervalo: float = INTERVALO_LATIDO) -> None:
+        """Arranca, si no está en marcha, un hilo de fondo que llama a `latir` cada `intervalo` segundos."""
+        with self._lock:
+            if self._hilo_latido is not None and self._hilo_latido.is_alive():
+                return
+            self._detener.clear()
+            self._hilo_latido = threading.Thread(target=self._latir_en_fondo, args=(intervalo,), daemon=True)
+            self._hilo_latido.start()
+
+    def _latir_en_fondo(self, intervalo: float) -> None:
+        while not self._detener.wait(intervalo):
+            try:
+                resultado = self.latir(intervalo)
+                if resultado['cerradas'] or resultado['abiertas']:
+                    emitir_json(logger, 'latido', resultado)
+            except Exception as e:
+                # Si no se pudo reponer una conexión, el siguiente latido lo vuelve a intentar
+                emitir_json(logger, 'latido_fallido', {'error': f'{type(e).__name__}: {e}'}, nivel=logging.WARNING)
+
+    def cerrar(self) -> None:
+        """Detiene el latido y cierra las conexiones inactivas."""
+        self._detener.set()
+        with self._lock:
+            inactivas, self._inactivas = self._inactivas, collections.deque()
+        for conexion, _ in inactivas:
+            _cerrar(conexion)
+
+    def __len__(self) -> int:
+        return len(self._inactivas)
+
+
+class BackendSnowflake:
+    """
+    Backend por defecto: ejecuta las consultas directamente en Snowflake con `snowflake.connector`.
+
+    Args:
+        sf_config (dict): Configuración de conexión. Debe incluir 'user', 'password' y 'account', y
+                          opcionalmente 'warehouse', 'database' y 'schema'.
+    """
+    nombre = 'snowflake'
+
+    def __init__(self, sf_config):
+        self.sf_config = sf_config
+        self.pool = PoolConexiones(self._abrir)
+
+    def _abrir(self):
+        return _conector().connect(
+            user=self.sf_config['user'],
+            password=self.sf_config['password'],
+            account=self.sf_config['account'],
+            warehouse=self.sf_config.get('warehouse'),  # Opcional, aunque útil para llevar seguimiento.
+            database=self.sf_config.get('database'),    # Opcional
+            schema=self.sf_config.get('schema'),        # Opcional
+            paramstyle='qmark',
+            login_timeout=PLAZO_CONSULTA,
+            network_timeout=PLAZO_CONSULTA,
+            # Renueva el token de la sesión mientras la conexión espera en el pool
+            client_session_keep_alive=True
+        )
+
+    def calentar(self, conexiones: int = CONEXIONES_POOL) -> dict:
+        """
+        Abre las conexiones del pool, reanuda el warehouse y arranca el latido.
+
+        Returns:
+            dict: 'conexiones' abiertas y 'version' de Snowflake.
+        """
+        warehouse = self.sf_config.get('warehouse')
+        version = []
+
+        def preparar(conexion):
+            if warehouse and not version:
+                # Reanudar requiere el privilegio OPERATE; sin él, el warehouse se reanuda con la primera consulta
+                try:
+                    _consulta_trivial(conexion, f'ALTER WAREHOUSE IF EXISTS "{warehouse}" RESUME IF SUSPENDED')
+                except Exception as e:
+                    if es_falla_disponibilidad(e):
+                        raise
+                    emitir_json(logger, 'warehouse_no_reanudado', {'warehouse': warehouse, 'error': str(e)})
+            version[:] = _consulta_trivial(conexion, 'SELECT current_version()')[0]
+
+        abiertas = self.pool.calentar(conexiones, preparar)
+        self.pool.iniciar_latido()
+        return {'conexiones': abiertas, 'version': version[0] if version else None}
+
+    def consultar(self, query: str, registro: dict = None, parametros=None, plazo: float = None) -> pd.DataFrame:
+        """
+        Ejecuta la consulta en Snowflake y devuelve los resultados en un DataFrame, sin conversión de tipos.
+
+        Args:
+            query (str): La consulta SQL a ejecutar.
+            registro (dict, optional): Diccionario en el que se anotan el ID de la consulta en Snowflake,
+                                       el warehouse y los tiempos de conexión, ejecución y descarga.
+            parametros (list, optional): Valores de los marcadores `?` de la consulta, que Snowflake enlaza
+                                         en el servidor.
+            plazo (float, optional): Segundos máximos de la ejecución; al vencer, Snowflake cancela la
+                                     consulta. Las conexiones nuevas del pool se autentican con el plazo
+                                     MUNICIPIOS_PLAZO_CONSULTA.
+
+        Raises:
+            snowflake.connector.errors.ProgrammingError: Si hay un error al ejecutar la consulta SQL en Snowflake.
+            PlazoConsultaVencido: Si la ejecución superó `plazo`.
+        """
+        registro = {} if registro is None else registro
+        registro['warehouse'] = self.sf_config.get('warehouse')
+        # Conexión del pool: sólo se abre una nueva si no hay ninguna inactiva
+        with self.pool.tomar(registro) as conn:
+            # Crear un cursor para ejecutar la consulta
+            with conn.cursor() as cs:
+                # Ejecutar la consulta SQL
+                inicio = time.perf_counter()
+                try:
+                    cs.execute(query, parametros, timeout=None if plazo is None else max(1, int(plazo)))
+                except Exception as e:
+                    # 604: Snowflake canceló la consulta al vencer el plazo
+                    if getattr(e, 'errno', None) == 604:
+                        raise PlazoConsultaVencido(f"La consulta superó el plazo de {plazo} s") from e
+                    raise
+                registro['query_id'] = cs.sfqid
+                registro['ejecucion_ms'] = _ms_desde(inicio)
+
+                # Obtener los nombres de las columnas y los resultados de la consulta
+                inicio = time.perf_counter()
+                column_names = [desc[0] for desc in cs.description]
+                results = cs.fetchall()
+                registro['descarga_ms'] = _ms_desde(inicio)
+
+            return pd.DataFrame(results, columns=column_names)
+
+    def enviar(self, query: str, parametros=None, plazo: float = None, registro: dict = None) -> str:
+        """
+        Envía la consulta con `execute_async` y vuelve sin esperar a que Snowflake la ejecute.
+
+        La conexión vuelve al pool enseguida: la consulta sigue en el warehouse y su resultado se lee
+        después, con cualquier conexión del mismo usuario, a partir del ID.
+
+        Returns:
+            str: ID de la consulta en Snowflake.
+        """
+        registro = {} if registro is None else registro
+        registro['warehouse'] = self.sf_config.get('warehouse')
+        with self.pool.tomar(registro) as conn:
+            with conn.cursor() as cs:
+                inicio = time.perf_counter()
+                cs.execute_async(query, parametros, timeout=None if plazo is None else max(1, int(plazo)))
+                registro['query_id'] = cs.sfqid
+                registro['envio_ms'] = _ms_desde(inicio)
+        return registro['query_id']
+
+    def terminada(self, query_id: str) -> bool:
+        """Indica si la consulta ya terminó, con éxito o con error."""
+        with self.pool.tomar() as conn:
+            return not conn.is_still_running(conn.get_query_status(query_id))
+
+    def recoger(self, query_id: str, registro: dict = None, plazo: float = None) -> pd.DataFrame:
+        """
+        Descarga el resultado de una consulta enviada con `enviar` y ya terminada.
+
+        Raises:
+            snowflake.connector.errors.ProgrammingError: Si la consulta falló en Snowflake.
+            PlazoConsultaVencido: Si Snowflake la canceló al vencer el plazo.
+        """
+        registro = {} if registro is None else registro
+        with self.pool.tomar(registro) as conn:
+            try:
+                conn.get_query_status_throw_if_error(query_id)
+            except Exception as e:
+                if getattr(e, 'errno', None) == 604:
+                    raise PlazoConsultaVencido(f"La consulta superó el plazo de {plazo} s") from e
+                raise
+            with conn.cursor() as cs:
+                inicio = time.perf_counter()
+                cs.get_results_from_sfqid(query_id)
+                column_names = [desc[0] for desc in cs.description]
+                results = cs.fetchall()
+                registro['descarga_ms'] = _ms_desde(inicio)
+        return pd.DataFrame(results, columns=column_names)
+
+    def publicar(self, tablas: dict, chunk_size: int = 100_000) -> None:
+        """
+        Carga DataFrames completos en tablas de Snowflake y las reemplaza sólo si todas cargaron bien.
+
+        Cada DataFrame se carga con `write_pandas` (archivos Parquet de `chunk_size` filas en un stage
+        temporal y un solo COPY INTO) en la tabla `<tabla>__NUEVA`. Cuando todas terminan, cada tabla se
+        intercambia con la vigente con `ALTER TABLE ... SWAP WITH`, que es atómico, de modo que el tablero
+        nunca lee una tabla a medio cargar. Si alguna carga falla, se borran las tablas nuevas y las
+        vigentes quedan intactas.
+
+        Snowflake confirma cada sentencia DDL por separado, así que los intercambios no pueden ir en una
+        sola transacción: si uno falla, los ya hechos se deshacen volviendo a intercambiar las mismas tablas.
+        Si además no se puede deshacer alguno, su `<tabla>__NUEVA` (que tiene los datos anteriores) no se
+        borra, para recuperarla a mano.
+
+        Args:
+            tablas (dict): Nombre de tabla -> DataFrame.
+            chunk_size (int, optional): Filas por archivo Parquet del stage.
+
+        Raises:
+            RuntimeError: Si `write_pandas` informa que no cargó alguna tabla.
+        """
+        # Importación diferida: igual que el conector, sólo se necesita al publicar
+        from snowflake.connector.pandas_tools import write_pandas
+
+        conn = _conector().connect(
+            user=self.sf_config['user'],
+            password=self.sf_config['password'],
+            account=self.sf_config['account'],
+            warehouse=self.sf_config.get('warehouse'),
+            database=self.sf_config.get('database'),
+            schema=self.sf_config.get('schema')
+        )
+        nuevas = []
+        try:
+            for tabla, df in tablas.items():
+                registro = {'consulta': f'write_pandas {tabla}', 'backend': self.nombre, 'warehouse': self.sf_config.get('warehouse')}
+                inicio = time.perf_counter()
+                try:
+                    nuevas.append(f'{tabla}__NUEVA')
+                    exito, archivos, filas, _ = write_pandas(conn, df, f'{tabla}__NUEVA', chunk_size=chunk_size,
+                                                             compression='snappy', auto_create_table=True,
+                                                             overwrite=True, use_logical_type=True)
+                    if not exito:
+                        raise RuntimeError(f"write_pandas no cargó {tabla}")
+                    registro.update(filas=filas, archivos=archivos, bytes=int(df.memory_usage(index=True, deep=True).sum()))
+                except Exception as e:
+                    registro['error'] = f"{type(e).__name__}: {e}"
+                    raise
+                finally:
+                    registro['total_ms'] = _ms_desde(inicio)
+                    _publicar_consulta(registro)
+
+            intercambiadas = []
+            with conn.cursor() as cs:
+                try:
+                    for tabla in tablas:
+                        cs.execute(f'CREATE TABLE IF NOT EXISTS {tabla} LIKE {tabla}__NUEVA')
+                        cs.execute(f'ALTER TABLE {tabla} SWAP WITH {tabla}__NUEVA')
+                        intercambiadas.append(tabla)
+                except Exception:
+                    for tabla in reversed(intercambiadas):
+                        try:
+                            cs.execute(f'ALTER TABLE {tabla} SWAP WITH {tabla}__NUEVA')
+                        except Exception as e:
+                            nuevas.remove(f'{tabla}__NUEVA')
+                            emitir_json(logger, 'publicacion_no_revertida', {'tabla': tabla, 'error': f'{type(e).__name__}: {e}'},
+                                        nivel=logging.ERROR)
+                    raise
+        finally:
+            # Después del intercambio `<tabla>__NUEVA` tiene los datos anteriores; si algo falló, los nuevos.
+            # Un error al borrarlas no debe ocultar el de la publicación: la siguiente las vuelve a crear.
+            try:
+                with conn.cursor() as cs:
+                    for nueva in nuevas:
+                        cs.execute(f'DROP TABLE IF EXISTS {nueva}')
+            except Exception as e:
+                emitir_json(logger, 'limpieza_publicacion_fallida', {'tablas': nuevas, 'error': f'{type(e).__name__}: {e}'},
+                            nivel=logging.WARNING)
+            finally:
+                conn.close()
+
+
+def _crear_backend_local(sf_config):
+    # Importación diferida: el backend local sólo se necesita en ejecuciones sin conexión
+    from backend_local import BackendLocal, DIRECTORIO_POR_DEFECTO
+    directorio = os.environ.get('MUNICIPIOS_DATOS_LOCALES') or sf_config.get('local_dir', DIRECTORIO_POR_DEFECTO)
+    return BackendLocal(directorio)
+
+
+# Fábricas de backends disponibles. Cada fábrica recibe `sf_config` y devuelve un objeto con el
+# método `consultar(query, registro=None, parametros=None, plazo=None) -> pd.DataFrame`.
+_FABRICAS_BACKEND = {
+    'snowflake': BackendSnowflake,
+    'local': _crear_backend_local,
+}
+
+# Backends ya creados. El backend local carga sus tablas una sola vez por proceso.
+_backends_creados = {}
+# Backends de Snowflake ya creados, cada uno con su pool de conexiones (ver `obtener_backend`)
+_backends_snowflake = {}
+_lock_backends = threading.Lock()
+
+
+def registrar_backend(nombre: str, fabrica) -> None:
+    """
+    Registra un backend adicional para `st_query_to_snowflake_and_return_dataframe`.
+
+    Args:
+        nombre (str): Nombre con el que se selecciona el backend (variable de entorno `MUNICIPIOS_BACKEND`
+                      o llave 'backend' de `sf_config`).
+        fabrica (callable): Función que recibe `sf_config` y devuelve un objeto con el atributo `nombre` y el
+                            método `consultar(query, registro=None, parametros=None, plazo=None) -> pd.DataFrame`.
+    """
+    _FABRICAS_BACKEND[nombre] = fabrica
+    _backends_creados.pop(nombre, None)
+
+
+def nombre_backend(sf_config: dict) -> str:
+    """Devuelve el nombre del backend configurado ('snowflake' o 'local'), sin crearlo."""
+    return os.environ.get('MUNICIPIOS_BACKEND') or sf_config.get('backend', 'snowflake')
+
+
+def obtener_backend(sf_config: dict):
+    """
+    Devuelve el backend configurado para ejecutar consultas.
+
+    El backend se elige con la variable de entorno `MUNICIPIOS_BACKEND` o, en su defecto, con la llave
+    'backend' de `sf_config`. Por defecto es 'snowflake'. Con 'local', las consultas se resuelven contra
+    archivos Parquet/CSV del directorio `MUNICIPIOS_DATOS_LOCALES` (ver `backend_local.py`).
+
+    Raises:
+        ValueError: Si el backend solicitado no está registrado.
+    """
+    nombre = nombre_backend(sf_config)
+    if nombre not in _FABRICAS_BACKEND:
+        raise ValueError(f"Backend desconocido: {nombre}. Opciones: {', '.join(_FABRICAS_BACKEND)}")
+    if nombre == 'snowflake':
+        # Un backend, con su pool de conexiones, por cuenta, usuario y ubicación
+        llave = tuple(sf_config.get(campo) for campo in ('account', 'user', 'warehouse', 'database', 'schema'))
+        with _lock_backends:
+            if llave not in _backends_snowflake:
+                _backends_snowflake[llave] = BackendSnowflake(sf_config)
+            return _backends_snowflake[llave]
+    if nombre not in _backends_creados:
+        _backends_creados[nombre] = _FABRICAS_BACKEND[nombre](sf_config)
+    return _backends_creados[nombre]
+
+
+def publicar_tablas(tablas: dict, sf_config: dict, chunk_size: int = 100_000) -> None:
+    """
+    Publica DataFrames como tablas del backend configurado, reemplazando todas o ninguna.
+
+    Args:
+        tablas (dict): Nombre de tabla -> DataFrame.
+        sf_config (dict): Configuración de conexión (ver `st_query_to_snowflake_and_return_dataframe`).
+        chunk_size (int, optional): Filas por archivo en la carga masiva.
+
+    Raises:
+        ValueError: Si el backend configurado no permite publicar tablas.
+    """
+    backend = obtener_backend(sf_config)
+    if not hasattr(backend, 'publicar'):
+        raise ValueError(f"El backend {backend.nombre} no permite publicar tablas")
+    backend.publicar(tablas, chunk_size=chunk_size)
+
+
+def _aplicar_tipos(df: pd.DataFrame, expected_types: dict = None) -> pd.DataFrame:
+    if expected_types:
+        for col_name, col_type in expected_types.items():
+            if col_name in df.columns:
+                df[col_name] = df[col_name].astype(col_type)
+    return df
+
+
+def _consultar_con_reintentos(backend, query: str, registro: dict, parametros=None) -> pd.DataFrame:
+    interruptor = interruptor_backend(backend.nombre)
+    argumentos = {'registro': registro, 'plazo': PLAZO_CONSULTA}
+    if parametros is not None:
+        argumentos['parametros'] = parametros
+    for intento in range(REINTENTOS + 1):
+        if not interruptor.permitir():
+            raise BackendNoDisponible(f"El backend {backend.nombre} no está disponible (interruptor abierto)")
+        registro['intentos'] = intento + 1
+        try:
+            df = backend.consultar(query, **argumentos)
+        except Exception as e:
+            if not es_falla_disponibilidad(e):
+                # El backend respondió, aunque la consulta fuera inválida
+                interruptor.exito()
+                raise
+            interruptor.falla()
+            if intento == REINTENTOS or interruptor.abierto:
+                raise
+            # Espera exponencial con variación aleatoria, para que los procesos no reintenten a la vez
+            time.sleep(random.uniform(0, ESPERA_REINTENTO * 2 ** intento))
+            continue
+        interruptor.exito()
+        return df
+
+
+def st_query_to_snowflake_and_return_dataframe(query: str, sf_config: dict, limit: int = None, expected_types: dict = None,
+                                                parametros=None, usar_cache: bool = True, marcador: str = None) -> pd.DataFrame:
+    """
+    Ejecuta una consulta SQL en Snowflake (o en el backend configurado) y devuelve los resultados en un DataFrame de Pandas.
 
     Args:
         query (str): La consulta SQL a ejecutar en Snowflake.
@@ -65,133 +808,312 @@ def st_query_to_snowflake_and_return_dataframe(query: str, sf_config: dict, limi
                           - 'warehouse': El nombre del almacén de datos en Snowflake (opcional).
                           - 'database': El nombre de la base de datos en Snowflake (opcional).
                           - 'schema': El nombre del esquema en Snowflake (opcional).
+                          - 'backend': 'snowflake' (por defecto) o 'local' (opcional, ver `obtener_backend`).
         limit (int, optional): El número máximo de filas a devolver. Si se proporciona, se agrega un límite
                                a la consulta SQL. Por defecto es None, lo que significa que no se aplica límite.
         expected_types (dict, optional): Un diccionario que mapea nombres de columnas a sus tipos de datos esperados.
+        parametros (list, optional): Valores de los marcadores `?` de la consulta.
+        usar_cache (bool, optional): Si es False, la consulta no se responde desde el caché en disco ni se
+                                     guarda en él (ver `cache_consultas.py`). Se usa para consultas cuya
+                                     respuesta debe ser siempre la actual, como los marcadores de cambio.
+        marcador (str, optional): Marcador de cambio de los datos consultados. Entra en la llave del caché en
+                                  disco, de modo que un resultado deja de servirse en cuanto cambian los datos.
 
     Returns:
         pd.DataFrame: Un DataFrame de Pandas que contiene los resultados de la consulta SQL.
 
+    Cada intento tiene un plazo de MUNICIPIOS_PLAZO_CONSULTA segundos. Las fallas de disponibilidad se
+    reintentan hasta MUNICIPIOS_REINTENTOS veces y, si se repiten, abren el interruptor del backend (ver
+    `Interruptor`): mientras está abierto las consultas fallan de inmediato con `BackendNoDisponible`.
+
     Raises:
         snowflake.connector.errors.ProgrammingError: Si hay un error al ejecutar la consulta SQL en Snowflake.
+        PlazoConsultaVencido: Si el último intento superó el plazo.
+        BackendNoDisponible: Si el interruptor del backend está abierto.
     """
+    backend = obtener_backend(sf_config)
+
+    # Agregar límite a la consulta solo si se proporciona un valor para limit
+    if limit is not None:
+        query += f" LIMIT {limit}"
+
+    registro = {'consulta': normalizar_consulta(query), 'backend': backend.nombre}
+    inicio = time.perf_counter()
+    cache = cache_configurado() if usar_cache else None
     try:
-        # Establecer la conexión a Snowflake utilizando la configuración proporcionada
-        conn = snowflake.connector.connect(
-            user=sf_config['user'],
-            password=sf_config['password'],
-            account=sf_config['account'],
-            warehouse=sf_config.get('warehouse'),  # Opcional, aunque útil para llevar seguimiento.
-            database=sf_config.get('database'),    # Opcional
-            schema=sf_config.get('schema')         # Opcional
-        )
+        if cache is not None:
+            clave = clave_consulta(registro['consulta'], parametros, sf_config, backend.nombre, expected_types, marcador)
+            df = cache.obtener(clave)
+            if df is not None:
+                registro.update(cache='acierto', filas=len(df), bytes=int(df.memory_usage(index=True, deep=True).sum()))
+                return df
+            registro['cache'] = 'fallo'
+
+        df = _consultar_con_reintentos(backend, query, registro, parametros)
 
-        # Crear un cursor para ejecutar la consulta
-        with conn.cursor() as cs:
-            # Agregar límite a la consulta solo si se proporciona un valor para limit
-            if limit is not None:
-                query += f" LIMIT {limit}"
+        # Aplicar tipos de datos esperados al DataFrame si se proporcionan
+        df = _aplicar_tipos(df, expected_types)
+
+        registro['filas'] = len(df)
+        registro['bytes'] = int(df.memory_usage(index=True, deep=True).sum())
+        if cache is not None:
+            cache.guardar(clave, df)
+        return df
 
-            # Imprimir la consulta para depuración
-            print("Executing query:", query)
+    except Exception as e:
+        # El error se registra y se propaga a quien llamó
+        registro['error'] = f"{type(e).__name__}: {e}"
+        raise
+
+    finally:
+        registro['total_ms'] = _ms_desde(inicio)
+        _publicar_consulta(registro)
 
-            # Ejecutar la consulta SQL
-            cs.execute(query)
 
-            # Obtener los nombres de las columnas
-            column_names = [desc[0] for desc in cs.description]
+# Hilos que ejecutan las consultas enviadas a backends sin ejecución asíncrona (p. ej. el local)
+_ejecutor_consultas = None
+_lock_ejecutor = threading.Lock()
 
-            # Obtener los resultados de la consulta
-            results = cs.fetchall()
 
-            # Crear un DataFrame de Pandas con los resultados
-            df = pd.DataFrame(results, columns=column_names)
+def _ejecutor():
+    global _ejecutor_consultas
+    with _lock_ejecutor:
+        if _ejecutor_consultas is None:
+            _ejecutor_consultas = concurrent.futures.ThreadPoolExecutor(max_workers=CONEXIONES_POOL,
+                                                                        thread_name_prefix='consulta')
+    return _ejecutor_consultas
 
-            # Aplicar tipos de datos esperados al DataFrame si se proporcionan
-            if expected_types:
-                for col_name, col_type in expected_types.items():
-                    if col_name in df.columns:
-                        df[col_name] = df[col_name].astype(col_type)
 
+class ConsultaEnviada:
+    """
+    Consulta enviada al backend cuyo resultado se recoge después (ver `enviar_consulta`).
+
+    En Snowflake la consulta corre en el warehouse mientras el proceso sigue con otra cosa; `lista`
+    pregunta su estado por el ID y `resultado` la descarga. En los backends sin ejecución asíncrona la
+    consulta corre en un hilo. El registro de la consulta se publica una sola vez, al recoger el resultado.
+
+    Attributes:
+        query_id (str): ID de la consulta en Snowflake; None si corre en un hilo o salió del caché en disco.
+    """
+
+    def __init__(self, backend, registro: dict, expected_types: dict = None, cache=None, clave: str = None):
+        self.backend = backend
+        self.registro = registro
+        self.query_id = None
+        self._expected_types = expected_types
+        self._cache = cache
+        self._clave = clave
+        self._futuro = None
+        self._df = None
+        self._publicada = False
+        self._inicio = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def consulta(self) -> str:
+        return self.registro['consulta']
+
+    def lista(self) -> bool:
+        """Indica si el resultado ya se puede recoger sin esperar."""
+        if self._df is not None:
+            return True
+        if self._futuro is not None:
+            return self._futuro.done()
+        return self.backend.terminada(self.query_id)
+
+    def _publicar(self) -> None:
+        if not self._publicada:
+            self._publicada = True
+            self.registro['total_ms'] = _ms_desde(self._inicio)
+            _publicar_consulta(self.registro)
+
+    def _terminar(self, df: pd.DataFrame) -> pd.DataFrame:
+        self._df = df
+        self.registro['filas'] = len(df)
+        self.registro['bytes'] = int(df.memory_usage(index=True, deep=True).sum())
+        self._publicar()
         return df
 
-    except snowflake.connector.errors.ProgrammingError as e:
-        # Manejar errores específicos de Snowflake
-        print(f"Error executing query: {e}")
-        raise e
+    def _fallar(self, error: Exception) -> None:
+        self.registro['error'] = f"{type(error).__name__}: {error}"
+        self._publicar()
 
-    finally:
-        # Cerrar la conexión a Snowflake
-        conn.close()
+    def resultado(self, plazo: float = None) -> pd.DataFrame:
+        """
+        Espera a que la consulta termine y devuelve su resultado, con los tipos esperados aplicados.
+
+        Args:
+            plazo (float, optional): Segundos máximos de espera.
+
+        Raises:
+            PlazoConsultaVencido: Si la consulta no terminó dentro de `plazo`. Se puede volver a esperar.
+        """
+        with self._lock:
+            if self._df is not None:
+                return self._df
+            # Vencer el plazo de espera no es un error de la consulta: se puede volver a esperar
+            _esperar([self], plazo)
+            try:
+                if self._futuro is not None:
+                    df = self._futuro.result()
+                else:
+                    interruptor = interruptor_backend(self.backend.nombre)
+                    try:
+                        df = self.backend.recoger(self.query_id, self.registro, PLAZO_CONSULTA)
+                    except Exception as e:
+                        if es_falla_disponibilidad(e):
+                            interruptor.falla()
+                        else:
+                            interruptor.exito()
+                        raise
+                    interruptor.exito()
+                    self.registro['ejecucion_ms'] = _ms_desde(self._inicio)
+            except Exception as e:
+                self._fallar(e)
+                raise
+            df = _aplicar_tipos(df, self._expected_types)
+            if self._cache is not None:
+                self._cache.guardar(self._clave, df)
+            return self._terminar(df)
+
+    async def resultado_async(self, plazo: float = None) -> pd.DataFrame:
+        """Versión para asyncio de `resultado`: espera sin bloquear el bucle de eventos."""
+        limite = None if plazo is None else time.monotonic() + plazo
+        intervalo = SONDEO_MINIMO
+        # El estado y la descarga son llamadas de red bloqueantes: se hacen en un hilo
+        while not await asyncio.to_thread(self.lista):
+            if limite is not None and time.monotonic() > limite:
+                raise PlazoConsultaVencido(f"La consulta no terminó en {plazo} s")
+            await asyncio.sleep(intervalo)
+            intervalo = min(intervalo * 2, SONDEO_MAXIMO)
+        return await asyncio.to_thread(self.resultado)
+
+
+def _esperar(consultas, plazo: float = None) -> None:
+    limite = None if plazo is None else time.monotonic() + plazo
+    # Las que corren en hilos avisan al terminar; por las de Snowflake se pregunta el estado en cada
+    # vuelta, con espera creciente
+    concurrent.futures.wait([consulta._futuro for consulta in consultas if consulta._futuro is not None], timeout=plazo)
+    intervalo = SONDEO_MINIMO
+    pendientes = [consulta for consulta in consultas if not consulta.lista()]
+    while pendientes:
+        if limite is not None and time.monotonic() > limite:
+            raise PlazoConsultaVencido(f"{len(pendientes)} consultas no terminaron en {plazo} s")
+        time.sleep(intervalo)
+        intervalo = min(intervalo * 2, SONDEO_MAXIMO)
+        pendientes = [consulta for consulta in pendientes if not consulta.lista()]
+
+
+def enviar_consulta(query: str, sf_config: dict, expected_types: dict = None, parametros=None,
+                    usar_cache: bool = True, marcador: str = None) -> ConsultaEnviada:
     """
-    Ejecuta una consulta SQL en Snowflake y devuelve los resultados en un DataFrame de Pandas,
-    conservando los tipos de datos de las columnas.
+    Envía una consulta al backend configurado sin esperar su resultado.
 
-    Args:
-        query (str): La consulta SQL a ejecutar en Snowflake.
-        sf_config (dict): Un diccionario que contiene la configuración de conexión a Snowflake.
-                          Debe incluir las siguientes claves:
-                          - 'user': El nombre de usuario de Snowflake.
-                          - 'password': La contraseña del usuario de Snowflake.
-                          - 'account': El identificador de cuenta de Snowflake.
-                          - 'warehouse': El nombre del almacén de datos en Snowflake (opcional).
-                          - 'database': El nombre de la base de datos en Snowflake (opcional).
-                          - 'schema': El nombre del esquema en Snowflake (opcional).
-        limit (int, optional): El número máximo de filas a devolver. Si se proporciona, se agrega un límite
-                               a la consulta SQL. Por defecto es None, lo que significa que no se aplica límite.
+    Recibe los mismos argumentos que `st_query_to_snowflake_and_return_dataframe` y pasa por el mismo caché
+    en disco e interruptor. En Snowflake la consulta se envía con `execute_async`; en los demás backends se
+    ejecuta en un hilo. Así se pueden enviar de una vez todas las consultas de un perfil o de un refresco y
+    recogerlas después con `recoger_consultas`, de modo que el warehouse las ejecute a la vez.
 
     Returns:
-        pd.DataFrame: Un DataFrame de Pandas que contiene los resultados de la consulta SQL,
-                      con los tipos de datos de las columnas conservados.
+        ConsultaEnviada: Consulta en curso, con su `query_id`.
 
     Raises:
-        snowflake.connector.errors.ProgrammingError: Si hay un error al ejecutar la consulta SQL en Snowflake.
+        BackendNoDisponible: Si el interruptor del backend está abierto.
     """
+    backend = obtener_backend(sf_config)
+    registro = {'consulta': normalizar_consulta(query), 'backend': backend.nombre, 'asincrona': True}
+    cache = cache_configurado() if usar_cache else None
+    clave = clave_consulta(registro['consulta'], parametros, sf_config, backend.nombre, expected_types, marcador) if cache else None
+    enviada = ConsultaEnviada(backend, registro, expected_types, cache, clave)
+
+    if cache is not None:
+        df = cache.obtener(clave)
+        if df is not None:
+            registro['cache'] = 'acierto'
+            enviada._terminar(df)
+            return enviada
+        registro['cache'] = 'fallo'
+
+    if not hasattr(backend, 'enviar'):
+        enviada._futuro = _ejecutor().submit(_consultar_con_reintentos, backend, query, registro, parametros)
+        return enviada
+
+    interruptor = interruptor_backend(backend.nombre)
     try:
-        # Establecer la conexión a Snowflake utilizando la configuración proporcionada
-        conn = snowflake.connector.connect(
-            user=sf_config['user'],
-            password=sf_config['password'],
-            account=sf_config['account'],
-            warehouse=sf_config.get('warehouse'),  # Opcional, aunque útil para llevar seguimiento.
-            database=sf_config.get('database'),    # Opcional
-            schema=sf_config.get('schema')         # Opcional
-        )
+        if not interruptor.permitir():
+            raise BackendNoDisponible(f"El backend {backend.nombre} no está disponible (interruptor abierto)")
+        enviada.query_id = backend.enviar(query, parametros, plazo=PLAZO_CONSULTA, registro=registro)
+    except Exception as e:
+        if es_falla_disponibilidad(e) and not isinstance(e, BackendNoDisponible):
+            interruptor.falla()
+        enviada._fallar(e)
+        raise
+    return enviada
 
-        # Crear un cursor para ejecutar la consulta
-        with conn.cursor() as cs:
-            # Agregar límite a la consulta solo si se proporciona un valor para limit
-            if limit is not None:
-                query += f" LIMIT {limit}"
 
-            # Ejecutar la consulta SQL
-            cs.execute(query)
+def recoger_consultas(consultas, plazo: float = None) -> list:
+    """
+    Espera a que terminen todas las consultas enviadas y devuelve sus resultados en el mismo orden.
 
-            # Obtener los nombres de las columnas y sus tipos de datos
-            column_names = [desc[0] for desc in cs.description]
-            column_types = [desc[1] for desc in cs.description]
+    El estado de todas se consulta en cada vuelta, así que la espera total es la de la consulta más lenta
+    y no la suma de todas.
 
-            # Mapeo de tipos de datos de Snowflake a tipos de datos de Pandas
-            snowflake_to_pandas_map = {
-                'FIXED': 'int64', 'REAL': 'float64', 'TEXT': 'object',
-                'BOOLEAN': 'bool', 'TIMESTAMP_NTZ': 'datetime64[ns]', 'DATE': 'datetime64[ns]',
-                'ARRAY': 'object', 'OBJECT': 'object', 'VARIANT': 'object', 'BLOB': 'object'
-            }
+    Args:
+        consultas (list): Consultas devueltas por `enviar_consulta`.
+        plazo (float, optional): Segundos máximos de espera para todas juntas.
+    """
+    _esperar(consultas, plazo)
+    return [consulta.resultado() for consulta in consultas]
 
-            # Obtener los resultados de la consulta
-            results = cs.fetchall()
 
-            # Crear un DataFrame de Pandas con los resultados y especificar los tipos de datos de las columnas
-            df = pd.DataFrame(results, columns=column_names)
-            for i, col_type in enumerate(column_types):
-                df.iloc[:, i] = df.iloc[:, i].astype(snowflake_to_pandas_map.get(col_type, 'object'))
+async def consultar_async(query: str, sf_config: dict, **argumentos) -> pd.DataFrame:
+    """
+    Versión para asyncio de `st_query_to_snowflake_and_return_dataframe`: envía la consulta y espera su
+    resultado sin bloquear el bucle de eventos. `argumentos` son los de `enviar_consulta`.
+    """
+    enviada = await asyncio.to_thread(enviar_consulta, query, sf_config, **argumentos)
+    return await enviada.resultado_async()
 
-        return df
 
-    except snowflake.connector.errors.ProgrammingError as e:
-        # Manejar errores específicos de Snowflake
-        raise e
+async def consultar_varias_async(consultas: list, sf_config: dict) -> list:
+    """
+    Ejecuta varias consultas a la vez con asyncio y devuelve sus resultados en el mismo orden.
+
+    Args:
+        consultas (list): Diccionarios con 'query' y, opcionalmente, los demás argumentos de `enviar_consulta`.
+    """
+    return await asyncio.gather(*(consultar_async(sf_config=sf_config, **consulta) for consulta in consultas))
 
-    finally:
-        # Cerrar la conexión a Snowflake
-        conn.close()
\ No newline at end of file
+
+def sf_obtener_marcadores_cambio(tablas, sf_config: dict) -> dict:
+    """
+    Devuelve un marcador de cambio por tabla, que cambia cuando cambian los datos de la tabla.
+
+    En Snowflake el marcador es `LAST_ALTERED` y `ROW_COUNT` de `INFORMATION_SCHEMA.TABLES`. Para las tablas
+    que no aparecen allí (p. ej. vistas) se usa el número de filas más `HASH_AGG(*)` del contenido, con las
+    etiquetas 'filas=' y 'hash=' para no confundirlo con una fecha (ver `datos.fecha_modificacion`). Los
+    backends que definen `marcadores_cambio(tablas)` (como el local) usan su propio marcador.
+
+    Args:
+        tablas (list): Nombres de las tablas.
+        sf_config (dict): Configuración de conexión (ver `st_query_to_snowflake_and_return_dataframe`).
+
+    Returns:
+        dict: Nombre de tabla -> marcador (str), o None si no se pudo obtener.
+    """
+    backend = obtener_backend(sf_config)
+    if hasattr(backend, 'marcadores_cambio'):
+        return backend.marcadores_cambio(tablas)
+
+    lista = ", ".join(f"'{tabla}'" for tabla in tablas)
+    df = st_query_to_snowflake_and_return_dataframe(f"""
+        SELECT TABLE_NAME, LAST_ALTERED, ROW_COUNT FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA = CURRENT_SCHEMA() AND TABLE_NAME IN ({lista})
+    """, sf_config, usar_cache=False)
+    marcadores = {fila.TABLE_NAME: f'{fila.LAST_ALTERED}|{fila.ROW_COUNT}' for fila in df.itertuples(index=False)}
+
+    for tabla in tablas:
+        if tabla not in marcadores:
+            df = st_query_to_snowflake_and_return_dataframe(f"SELECT COUNT(*) AS FILAS, HASH_AGG(*) AS HASH FROM {tabla}", sf_config, usar_cache=False)
+            marcadores[tabla] = f'filas={df["FILAS"].iloc[0]}|hash={df["HASH"].iloc[0]}' if len(df) else None
+    return marcadores
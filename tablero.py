@@ -0,0 +1,38 @@
+"""
+Arranque del tablero con los datos listos antes de atender la primera sesión.
+
+`streamlit run app.py` no ejecuta nada hasta que llega el primer usuario: esa sesión pagaría abrir las
+conexiones, reanudar el warehouse y cargar las tablas. Este script calienta el proceso (ver
+`datos.calentar`) y sólo después arranca Streamlit en el mismo proceso, así que `app.py` encuentra el
+módulo `datos` ya cargado. El puerto de Streamlit (y su verificación de salud `/_stcore/health`) no
+responde hasta que termina el calentamiento, de modo que el balanceador no envía usuarios a un proceso
+frío.
+
+Los argumentos se pasan tal cual a `streamlit run`:
+    python tablero.py --server.port 8501
+"""
+import os
+import sys
+import time
+
+import datos
+import perf_utils as pf
+
+logger = pf.obtener_logger_json('municipios.tablero')
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+def main():
+    inicio = time.perf_counter()
+    datos.calentar()
+    pf.emitir_json(logger, 'inicio', {'version': datos.instantanea_actual().version,
+                                      'ms': round((time.perf_counter() - inicio) * 1000, 3)})
+
+    # Importación diferida: la interfaz de línea de comandos de Streamlit sólo se necesita al arrancar
+    from streamlit.web import cli
+    sys.exit(cli.main(['run', APP, *sys.argv[1:]], prog_name='streamlit'))
+
+
+if __name__ == '__main__':
+    main()
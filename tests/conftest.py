@@ -0,0 +1,77 @@
+"""
+Datos sintéticos para las pruebas: unas pocas filas del tejido con la misma forma que las tablas del tablero.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import datos  # noqa: E402
+
+# Departamento -> municipios (código DIVIPOLA, nombre)
+TERRITORIOS = {
+    ('05', 'Antioquia'): [('05001', 'Medellín'), ('05002', 'Abejorral'), ('05004', 'Abriaquí')],
+    ('11', 'Bogotá, D.C.'): [('11001', 'Bogotá, D.C.')],
+    ('54', 'Norte de Santander'): [('54001', 'Cúcuta'), ('54003', 'Ábrego')],
+}
+
+CATEGORIAS = {
+    'Tamaño': ['Micro', 'Pequeña', 'Mediana', 'Grande', None],
+    'Cadena productiva': ['Turismo', 'Agroalimentos', 'Metalmecánica', 'Químicos', None],
+    'Valor agregado empresa': ['Bajo', 'Medio', 'Alto'],
+    'Cadena* ult 10 años': ['Agroalimentos', 'Químicos', None],
+    'Tipo* ult 10 años': ['No exportó ult. 10 años', 'Exportó', None],
+    'Sucursal sociedad extranjera': ['Si', 'No'],
+}
+
+CIIU = {'5511': 'Alojamiento en hoteles', '5611': 'Expendio a la mesa de comidas preparadas', '7911': 'Agencias de viaje'}
+
+
+def tejido_sintetico(filas_por_municipio: int = 40, semilla: int = 7) -> pd.DataFrame:
+    """
+    Devuelve un TABLA_TEJIDO_MUNICIPIOS pequeño, con nulos en las categorías, una fila sin municipio y otra
+    con un código de municipio que no es numérico.
+    """
+    rng = np.random.default_rng(semilla)
+    filas = []
+    for (cod_depto, departamento), municipios in TERRITORIOS.items():
+        for cod_mpio, municipio in municipios:
+            for _ in range(filas_por_municipio):
+                fila = {'Cod. Depto': cod_depto, 'Departamento': departamento,
+                        'Cod. Municipio': cod_mpio, 'Municipio': municipio}
+                fila.update({columna: valores[rng.integers(len(valores))] for columna, valores in CATEGORIAS.items()})
+                ciiu = list(CIIU)[rng.integers(len(CIIU))]
+                fila.update({'CIIU Rev 4 principal': ciiu, 'Descripción CIIU principal': CIIU[ciiu],
+                             'Número de empresas': int(rng.integers(1, 50))})
+                filas.append(fila)
+    filas.append({**filas[0], 'Cod. Depto': None, 'Departamento': 'No determinado', 'Cod. Municipio': None,
+                  'Municipio': 'No determinado'})
+    filas.append({**filas[1], 'Cod. Depto': None, 'Departamento': 'No determinado', 'Cod. Municipio': 'No determinado',
+                  'Municipio': 'No determinado'})
+    return pd.DataFrame(filas)
+
+
+@pytest.fixture(scope='session')
+def tablas() -> dict:
+    municipios = [(cod_mpio, municipio, departamento)
+                  for (_, departamento), lista in TERRITORIOS.items() for cod_mpio, municipio in lista]
+    df_general = pd.DataFrame({'Cod. Municipio': [m[0] for m in municipios],
+                               'Población municipio': np.arange(len(municipios)) * 1000.0})
+    df_ubicacion = pd.DataFrame({'Código .1': [m[0] for m in municipios], 'Nombre': [m[2] for m in municipios],
+                                 'Nombre.1': [m[1] for m in municipios],
+                                 'LATITUD': np.linspace(2, 10, len(municipios)),
+                                 'LONGITUD': np.linspace(-77, -72, len(municipios))})
+    return {
+        'TABLA_BASE_MUNICIPIOS': df_general,
+        'TABLA_TEJIDO_MUNICIPIOS': tejido_sintetico(),
+        'TABLA_DIVIPOLA_MUNICIPIOS': df_ubicacion,
+    }
+
+
+@pytest.fixture
+def instantanea(tablas) -> datos.Instantanea:
+    return datos.Instantanea(dict(tablas), {})
@@ -0,0 +1,70 @@
+"""
+Paridad de los motores de agregación con `datos.MotorPandas`, la implementación de referencia.
+"""
+import pytest
+
+import datos
+from claves import CLAVE
+
+# Columnas de categoría que pide el tablero, más las agrupaciones por municipio de los derivados
+COLUMNAS = ['Tamaño', 'Cadena productiva', ['CIIU Rev 4 principal', 'Descripción CIIU principal'],
+            [CLAVE, 'Cadena productiva']]
+
+# Los códigos inválidos no deben devolver las filas sin código de municipio
+AMBITOS = [{'cod_mpio': '05001'}, {'cod_mpio': '54003'}, {'cod_mpio': '99999'}, {'cod_mpio': 'No determinado'},
+           {'cod_mpio': ' 5_001 '}, {'cod_depto': '05'}, {'cod_depto': '11'}, {}]
+
+
+def consultas_paridad() -> list:
+    """Todas las combinaciones de columnas, ámbito (municipio, departamento, país) y filtro de `FILTROS`."""
+    return [{'columnas': columnas, **ambito, 'filtro': filtro}
+            for columnas in COLUMNAS for ambito in AMBITOS for filtro in [None, *datos.FILTROS]]
+
+
+def verificar_paridad(instantanea, candidato) -> None:
+    referencia = datos.MotorPandas(instantanea)
+    consultas = consultas_paridad()
+    assert datos.comparar_motores(referencia, candidato, consultas) == []
+    # Las consultas no son todas vacías: la comparación de verdad mira conteos
+    assert sum(not referencia.conteo(**consulta).empty for consulta in consultas) > len(consultas) / 2
+
+
+def test_paridad_duckdb(instantanea):
+    pytest.importorskip('duckdb')
+    from motor_duckdb import MotorDuckDB
+    verificar_paridad(instantanea, MotorDuckDB(instantanea))
+
+
+def test_paridad_polars(instantanea):
+    pytest.importorskip('polars')
+    from motor_polars import MotorPolars
+    verificar_paridad(instantanea, MotorPolars(instantanea))
+
+
+def test_paridad_servidor(instantanea, tablas, tmp_path, monkeypatch):
+    import snowflake_utils
+    from motor_servidor import MotorServidor
+
+    # Backend local (SQLite) sobre las mismas tablas, sin el caché en disco
+    for tabla, df in tablas.items():
+        df.to_parquet(tmp_path / f'{tabla}.parquet', index=False)
+    monkeypatch.setenv('MUNICIPIOS_BACKEND', 'local')
+    monkeypatch.setenv('MUNICIPIOS_DATOS_LOCALES', str(tmp_path))
+    monkeypatch.delenv('MUNICIPIOS_CACHE_CONSULTAS', raising=False)
+    monkeypatch.setattr(snowflake_utils, '_backends_creados', {})
+    verificar_paridad(instantanea, MotorServidor(instantanea, sf_config={}))
+
+
+def test_barras_polars(instantanea):
+    pytest.importorskip('polars')
+    import numpy as np
+    from motor_polars import MotorPolars
+    referencia, candidato = datos.MotorPandas(instantanea), MotorPolars(instantanea)
+    for consulta in consultas_paridad():
+        columnas = [consulta['columnas']] if isinstance(consulta['columnas'], str) else consulta['columnas']
+        conteo = referencia.conteo(**consulta).sort_values('Número de empresas', kind='stable')
+        categorias, valores, participacion = candidato.barras(columna_etiqueta=columnas[-1], **consulta)
+        assert list(categorias) == list(conteo[columnas[-1]])
+        assert list(valores) == list(conteo['Número de empresas'])
+        total = valores.sum()
+        assert np.allclose(participacion, valores / total * 100 if total else 0)
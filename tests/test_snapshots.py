@@ -0,0 +1,43 @@
+"""
+Pruebas de las instantáneas locales.
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import snapshots
+from claves import agregar_clave
+
+
+def _mapeado(arreglo, ruta: str) -> bool:
+    """Indica si los datos de un arreglo de NumPy están dentro de un mapeo en memoria del archivo `ruta`."""
+    direccion = arreglo.__array_interface__['data'][0]
+    with open('/proc/self/maps') as mapas:
+        for linea in mapas:
+            rango, *_, archivo = linea.split(maxsplit=5)
+            inicio, fin = (int(valor, 16) for valor in rango.split('-'))
+            if archivo.strip() == ruta and inicio <= direccion < fin:
+                return True
+    return False
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/maps'), reason='requiere /proc/self/maps (Linux)')
+def test_compartida_sin_copias(tablas, tmp_path):
+    # Las columnas numéricas sin nulos y las de texto deben quedar sobre el archivo mapeado, sin copiarse
+    copia = {tabla: agregar_clave(tabla, df) for tabla, df in tablas.items()}
+    tejido = copia['TABLA_TEJIDO_MUNICIPIOS']
+    # Texto en varios fragmentos, como el de las tablas que se arman concatenando lotes de una consulta
+    copia['TABLA_TEJIDO_MUNICIPIOS'] = pd.concat([tejido.iloc[:100], tejido.iloc[100:]], ignore_index=True)
+    ruta = snapshots.guardar_instantanea(copia, 'v1', directorio=str(tmp_path))
+    compartidas, manifiesto = snapshots.abrir_compartida(str(tmp_path))
+    assert manifiesto['version'] == 'v1'
+
+    for tabla, columnas in [('TABLA_TEJIDO_MUNICIPIOS', ['Número de empresas', 'Clave municipio']),
+                            # Columnas del mismo tipo, que `to_pandas` consolidaría en un arreglo nuevo
+                            ('TABLA_DIVIPOLA_MUNICIPIOS', ['LATITUD', 'LONGITUD'])]:
+        archivo = os.path.realpath(os.path.join(ruta, manifiesto['arrow'][tabla]))
+        for columna in columnas:
+            assert _mapeado(compartidas[tabla][columna].to_numpy(), archivo), (tabla, columna)
+    assert type(compartidas['TABLA_TEJIDO_MUNICIPIOS']['Municipio'].array).__name__ == 'ArrowStringArray'
+    assert compartidas['TABLA_TEJIDO_MUNICIPIOS'].equals(tejido)
@@ -0,0 +1,96 @@
+"""
+Índice espacial de los municipios a partir de las coordenadas de DIVIPOLA.
+
+Las coordenadas se convierten a puntos sobre la esfera unitaria y se indexan en un KD-tree (`scipy`). La
+distancia euclidiana entre dos de esos puntos (la cuerda) crece con la distancia sobre la superficie, así
+que el vecino más cercano por cuerda es también el más cercano por la fórmula de haversine, y la cuerda se
+convierte a kilómetros de forma exacta. Cada consulta toma microsegundos y las consultas por radio para
+todos los municipios a la vez evitan recorrer todos los pares de municipios.
+"""
+import numpy as np
+import pandas as pd
+
+from claves import CLAVE
+
+RADIO_TIERRA_KM = 6371.0088
+
+
+def _a_cartesianas(latitudes, longitudes) -> np.ndarray:
+    latitudes = np.radians(np.asarray(latitudes, dtype=float))
+    longitudes = np.radians(np.asarray(longitudes, dtype=float))
+    return np.column_stack([np.cos(latitudes) * np.cos(longitudes),
+                            np.cos(latitudes) * np.sin(longitudes),
+                            np.sin(latitudes)])
+
+
+def cuerda_a_km(cuerda):
+    """Convierte la distancia entre dos puntos de la esfera unitaria a kilómetros sobre la superficie."""
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.clip(np.asarray(cuerda) / 2, 0, 1))
+
+
+def km_a_cuerda(km):
+    """Convierte una distancia en kilómetros sobre la superficie a la cuerda de la esfera unitaria."""
+    return 2 * np.sin(np.asarray(km) / (2 * RADIO_TIERRA_KM))
+
+
+class IndiceEspacial:
+    """
+    KD-tree de los municipios con coordenadas.
+
+    Args:
+        df_ubicacion (pd.DataFrame): Columnas `CLAVE`, 'Cod. Municipio', 'Departamento', 'Municipio', 'LATITUD'
+                                     y 'LONGITUD' (el derivado 'ubicacion' de `datos.py`).
+    """
+
+    def __init__(self, df_ubicacion: pd.DataFrame):
+        df = df_ubicacion.dropna(subset=['LATITUD', 'LONGITUD']).drop_duplicates(CLAVE)
+        self.municipios = df[[CLAVE, 'Cod. Municipio', 'Departamento', 'Municipio', 'LATITUD', 'LONGITUD']].reset_index(drop=True)
+        self._posiciones = {clave: posicion for posicion, clave in enumerate(self.municipios[CLAVE].tolist())}
+        # Importación diferida: scipy sólo se carga cuando se arma el primer índice y no al importar el módulo
+        from scipy.spatial import cKDTree
+        self._arbol = cKDTree(_a_cartesianas(self.municipios['LATITUD'], self.municipios['LONGITUD']))
+
+    def cercanos(self, clave: int, k: int = 5) -> tuple:
+        """
+        Devuelve las posiciones en `municipios` de los `k` municipios más cercanos a uno dado (por su clave
+        entera), sin incluirlo.
+
+        Returns:
+            tuple: (arreglo de posiciones, arreglo de distancias en km), del más cercano al más lejano.
+                   Ambos vacíos si el municipio no tiene coordenadas.
+        """
+        posicion = self._posiciones.get(clave)
+        if posicion is None or k <= 0:
+            return np.empty(0, dtype=int), np.empty(0)
+        cuerdas, posiciones = self._arbol.query(self._arbol.data[posicion], k=min(k + 1, len(self._posiciones)))
+        cuerdas, posiciones = np.atleast_1d(cuerdas), np.atleast_1d(posiciones)
+        distintos = posiciones != posicion
+        return posiciones[distintos][:k], cuerda_a_km(cuerdas[distintos][:k])
+
+    def vecinos(self, clave: int, k: int = 5) -> pd.DataFrame:
+        """
+        Devuelve los `k` municipios más cercanos a uno dado (por su clave entera), sin incluirlo.
+
+        Returns:
+            pd.DataFrame: Columnas de `municipios` más 'Distancia (km)', del más cercano al más lejano.
+                          Vacío si el municipio no tiene coordenadas.
+        """
+        posiciones, distancias = self.cercanos(clave, k)
+        vecinos = self.municipios.iloc[posiciones].reset_index(drop=True)
+        return vecinos.assign(**{'Distancia (km)': distancias.round(1)})
+
+    def pares_en_radio(self, radio_km: float) -> pd.DataFrame:
+        """
+        Devuelve todos los pares de municipios a menos de `radio_km`, incluido cada municipio consigo mismo.
+
+        Returns:
+            pd.DataFrame: Columnas `CLAVE`, '<CLAVE> vecino' y 'Distancia (km)'.
+        """
+        pares = self._arbol.sparse_distance_matrix(self._arbol, float(km_a_cuerda(radio_km)), output_type='ndarray')
+        claves = self.municipios[CLAVE].to_numpy()
+        return pd.DataFrame({CLAVE: claves[pares['i']], f'{CLAVE} vecino': claves[pares['j']],
+                             'Distancia (km)': cuerda_a_km(pares['v'])})
+
+    def medir_memoria(self) -> tuple:
+        """Devuelve (municipios indexados, bytes de las coordenadas y la tabla de municipios)."""
+        return len(self.municipios), int(self._arbol.data.nbytes + self.municipios.memory_usage(deep=True).sum())